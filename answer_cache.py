@@ -0,0 +1,117 @@
+import asyncio
+import os
+import re
+import threading
+
+import numpy as np
+
+from cache import LRUCache
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Cosine similarity above which a differently phrased query reuses an answer; 0 disables
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip(" ?!.")
+
+
+class AnswerCache:
+    """
+    Cache of generated answers keyed by (document hash, normalized query, retrieval params).
+
+    With a similarity threshold and an embedding model, a query whose embedding is
+    close enough to a cached query of the same document and params also hits.
+
+    :param maxsize: Maximum number of cached answers (LRU eviction).
+    :param ttl: Seconds an answer stays valid.
+    :param similarity_threshold: Minimum cosine similarity for near-duplicate hits, 0 to disable.
+    :param embed_model: Model used to embed queries for near-duplicate matching, or a
+        function returning it so the model is only created on first use.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None, similarity_threshold: float = 0.0, embed_model=None):
+        self.similarity_threshold = similarity_threshold
+        self.embed_model = embed_model
+        self._answers = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._embeddings = {}  # (document hash, params) -> {key: unit query embedding}
+        self._lock = threading.Lock()
+
+    def _use_similarity(self) -> bool:
+        return self.similarity_threshold > 0 and self.embed_model is not None
+
+    def _embed(self, query: str) -> np.ndarray:
+        embed_model = self.embed_model() if callable(self.embed_model) else self.embed_model
+        vector = np.asarray(embed_model.get_query_embedding(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, document_hash: str, query: str, params: tuple = ()):
+        """Return the cached answer for a query, or None."""
+        key = (document_hash, normalize_query(query), params)
+        answer = self._answers.get(key)
+        if answer is not None or not self._use_similarity():
+            return answer
+
+        with self._lock:
+            candidates = dict(self._embeddings.get((document_hash, params), {}))
+        if not candidates:
+            return None
+
+        keys = list(candidates)
+        similarities = np.stack([candidates[k] for k in keys]) @ self._embed(query)
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.similarity_threshold:
+                break
+            answer = self._answers.get(keys[i])
+            if answer is not None:
+                return answer
+        return None
+
+    def store(self, document_hash: str, query: str, params: tuple, answer: str):
+        key = (document_hash, normalize_query(query), params)
+        self._answers.set(key, answer)
+        if self._use_similarity():
+            embedding = self._embed(query)
+            with self._lock:
+                group = self._embeddings.setdefault((document_hash, params), {})
+                group[key] = embedding
+                # Forget embeddings of answers the LRU has already evicted
+                for stale in [k for k in group if k not in self._answers]:
+                    del group[stale]
+
+    def record(self, document_hash: str, query: str, params: tuple, response_gen):
+        """
+        Pass a streaming answer through, storing it once the stream completes.
+        Interrupted streams are not cached.
+        """
+        chunks = []
+        for chunk in response_gen:
+            chunks.append(chunk)
+            yield chunk
+        self.store(document_hash, query, params, "".join(chunks))
+
+    async def arecord(self, document_hash: str, query: str, params: tuple, response_gen):
+        """Async version of `record` for async generators; storing runs in an executor."""
+        chunks = []
+        async for chunk in response_gen:
+            chunks.append(chunk)
+            yield chunk
+        # Storing may embed the query for near-duplicate matching
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.store, document_hash, query, params, "".join(chunks))
+
+    def invalidate(self, document_hash: str):
+        """Drop every cached answer of a document, e.g. after it was re-indexed."""
+        for key in self._answers.keys():
+            if key[0] == document_hash:
+                self._answers.pop(key)
+        with self._lock:
+            for group_key in [k for k in self._embeddings if k[0] == document_hash]:
+                del self._embeddings[group_key]
+
+    def stats(self) -> dict:
+        return self._answers.stats()
@@ -1,10 +1,28 @@
 import os
-from flask import Flask, request, jsonify
+import time
+import itertools
+from flask import Flask, Request, request, jsonify, g
 from flask_cors import CORS  # 导入 CORS
 from build_index import get_chroma_index,build_chroma_index,get_query_engine,check_chroma_index
-from parse_document import hash_file_chunked,parse_pdf,parse_html
-from keyword_search import save_chunk_text,load_pdf_text,parse_pdf_for_keyword_search,keyword_search,parse_html_for_keyword_search
+from parse_document import hash_file_chunked,iter_pages,iter_documents,iter_chunks,chunk_id
+from page_store import write_page_store,page_store_path,open_page_store
+from keyword_search import build_keyword_index,save_keyword_index,keyword_index_path,load_keyword_store,ranked_keyword_search,paginated_keyword_search
+from keyword_search import chunk_map_path,save_chunk_map
 from flask import Response
+from jobs import JobQueue,QueueFullError,STRATEGY_STAGES
+from hybrid_search import hybrid_query
+from corpus_search import CorpusScopeError,corpus_query
+from retrieval import batch_retrieve
+from retrieval_strategies import STRATEGIES,INGEST_STRATEGIES,build_strategy_index,get_strategy_index,get_strategy_query_engine,strategy_ready
+from context_selection import context_report
+from answer_cache import AnswerCache,ANSWER_CACHE_SIZE,ANSWER_CACHE_TTL,ANSWER_CACHE_SIMILARITY
+from build_index import get_cache_stats,get_embed_model,hot_documents
+from build_index import warmup as warmup_indexes
+import build_index
+from metrics import timed,count,traced_stream,log_event,new_request_id,request_id_var
+from metrics import render_metrics,set_cache_stats,HTTP_REQUESTS,HTTP_SECONDS
+from utils import HashingTempFile,content_addressed_path
+
 # 初始化 Flask 应用
 app = Flask(__name__)
 
@@ -16,6 +34,108 @@ UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'pdf', 'html'}
+PAGE_STORE_COMPRESS = os.getenv("PAGE_STORE_COMPRESS", "0") == "1"
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "25"))
+CHUNK_SPAN_PAGES = os.getenv("CHUNK_SPAN_PAGES", "0") == "1"
+MAX_RETRIEVE_QUERIES = int(os.getenv("MAX_RETRIEVE_QUERIES", "64"))
+
+# Background ingestion workers, sized through the environment
+ingestion_queue = JobQueue(
+    max_workers=int(os.getenv("INGEST_WORKERS", "2")),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", "16")),
+    max_attempts=int(os.getenv("INGEST_MAX_ATTEMPTS", "3")),
+)
+
+# Answers of semantic and hybrid searches, replayed for repeated questions
+answer_cache = AnswerCache(
+    maxsize=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    embed_model=get_embed_model,
+)
+
+
+class UploadRequest(Request):
+    """Spools uploaded files into hashing temp files inside the upload folder."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = HashingTempFile(UPLOAD_FOLDER)
+        if not hasattr(self, "upload_temp_files"):
+            self.upload_temp_files = []
+        self.upload_temp_files.append(stream)
+        return stream
+
+app.request_class = UploadRequest
+
+@app.before_request
+def start_request():
+    # Every request gets an id, echoed back and included in the structured logs
+    g.request_start = time.perf_counter()
+    g.request_id = request.headers.get("X-Request-ID") or new_request_id()
+    request_id_var.set(g.request_id)
+
+
+@app.after_request
+def finish_request(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "unknown"
+    response.headers["X-Request-ID"] = g.request_id
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    HTTP_SECONDS.observe(elapsed, endpoint=endpoint)
+    log_event("request", method=request.method, path=request.path, status=response.status_code, seconds=round(elapsed, 6))
+    return response
+
+
+def prefetch_file(path, block_size=1024 * 1024):
+    """Read a file once so its pages are in the OS page cache, shared by every worker."""
+    size = 0
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            while block := f.read(block_size):
+                size += len(block)
+    return size
+
+
+def warmup(prefetch_only=False):
+    """
+    Prepare the process for traffic before it accepts requests.
+
+    :param prefetch_only: Only read the hot documents' page stores and keyword
+        indexes into the page cache, creating no clients. Used in a pre-fork
+        master; workers run the full warmup after forking.
+    """
+    hashes = hot_documents()
+    if prefetch_only:
+        size = 0
+        for document_hash in hashes:
+            size += prefetch_file(page_store_path(document_hash))
+            size += prefetch_file(keyword_index_path(document_hash))
+            size += prefetch_file(chunk_map_path(document_hash))
+            if build_index.VECTOR_BACKEND == "numpy":
+                store_dir = os.path.join(build_index.NUMPY_STORE_PATH, build_index.collection_name(document_hash))
+                size += prefetch_file(os.path.join(store_dir, "vectors.bin"))
+                size += prefetch_file(os.path.join(store_dir, "records.jsonl"))
+        log_event("prefetch", documents=len(hashes), bytes=size)
+        return
+
+    warmup_indexes(hashes)
+    for document_hash in hashes:
+        try:
+            load_keyword_store(document_hash)
+        except FileNotFoundError:
+            pass
+        for strategy in STRATEGIES:
+            if strategy_ready(document_hash, strategy):
+                get_strategy_index(document_hash, strategy)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    set_cache_stats(get_cache_stats())
+    set_cache_stats({"answers": answer_cache.stats()})
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4")
+
 
 def allowed_file(filename):
     """检查文件扩展名是否允许"""
@@ -35,43 +155,212 @@ def upload_file():
     if not allowed_file(file.filename):
         return jsonify({"error": "Only PDF and HTML files are allowed"}), 400
 
-    # 生成文件路径并保存
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    file.save(file_path)
+    # The body was hashed while it was spooled to a temp file; nothing is re-read here
+    upload = file.stream
     file_ext = os.path.splitext(file.filename)[1].lower()
+    document_hash = upload.hexdigest()
 
-    document_hash = hash_file_chunked(file_path)
-    if check_chroma_index(document_hash):
-        return jsonify({"message": "RAG already established"}), 200
-    response = upload_file_worker(file_path)
+    # A collection that is still being written by a running job is not established yet
+    if ingestion_queue.active_job(document_hash) is None and check_chroma_index(document_hash):
+        upload.discard()
+        return jsonify({"message": "RAG already established", "hash": document_hash}), 200
 
+    # Move to the content-addressed path, identical files share one copy
+    file_path = upload.commit(content_addressed_path(app.config['UPLOAD_FOLDER'], document_hash, file_ext))
 
+    # Parse and index in the background; duplicate uploads attach to the running job
+    tenant = request.form.get("tenant") or None
+    try:
+        job, created = ingestion_queue.submit(
+            document_hash, file_path, upload_file_worker, file_path, document_hash, tenant=tenant
+        )
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
 
-    return response
+    return jsonify({
+        "message": "RAG job queued" if created else "RAG job already running",
+        "job_id": job.id,
+        "hash": document_hash,
+        "status_url": f"/jobs/{job.id}",
+    }), 202
 
 
-def upload_file_worker(file_path):
+@app.teardown_request
+def discard_upload_temp_files(exc):
+    # Temp files of rejected or failed uploads; committed ones were already moved
+    for stream in getattr(request, "upload_temp_files", []):
+        stream.discard()
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingestion_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+def upload_file_worker(file_path, document_hash=None, progress=None, tenant=None):
+    """
+    Parse, embed and index a file, then store its page text for keyword search.
+
+    :param file_path: Path to the uploaded PDF or HTML file.
+    :param document_hash: Hash of the file, computed if not given.
+    :param progress: Optional callback `progress(stage, fraction)`, see jobs.INGESTION_STAGES.
+    :param tenant: Optional tenant scope stored with the chunks for corpus-wide search.
+    :return: A summary with the document hash and the number of pages and chunks.
+    """
+    report = progress or (lambda stage, fraction: None)
     file_ext = os.path.splitext(file_path)[1].lower()
     print(f"file_ext: {file_ext}")
-    document_hash = hash_file_chunked(file_path)
-    if file_ext == '.pdf':
-        documents = parse_pdf(file_path, chunk_size=1000, overlap=100)
-        
-        index = build_chroma_index(documents, document_hash)
-        pdf_text = parse_pdf_for_keyword_search(file_path)
-        save_chunk_text(pdf_text, f"uploads/{document_hash}.json")
-    elif file_ext == '.html':
-        print("html file")
-        documents = parse_html(file_path, chunk_size=1000, overlap=100)
-        index = build_chroma_index(documents, document_hash)
-        html_text = parse_html_for_keyword_search(file_path)
-        save_chunk_text(html_text, f"uploads/{document_hash}.json")
-    else:
-        return jsonify({"error": "Unsupported file type"}), 400
-
-
-    return jsonify({"message": "RAG established"}), 200
+    document_hash = document_hash or hash_file_chunked(file_path)
+    if file_ext not in ('.pdf', '.html'):
+        raise ValueError(f"Unsupported file type: {file_ext}")
+
+    # Read the file once, streaming pages straight into the page store; chunking and
+    # the keyword index then read them back one at a time, so memory stays bounded
+    # by the page (HTML section) size rather than the file size
+    report("parse", 0.0)
+    with timed("parse", file_type=file_ext[1:]):
+        write_page_store(iter_pages(file_path), page_store_path(document_hash), compress=PAGE_STORE_COMPRESS)
+        pages = open_page_store(document_hash)
+    count("parse", len(pages))
+    report("parse", 1.0)
+
+    # Chunks are produced lazily as the embedding stage consumes them
+    documents = iter_documents(
+        pages, file_path, document_hash,
+        max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+        span_pages=CHUNK_SPAN_PAGES, file_type=file_ext[1:],
+    )
+    chunk_counter = itertools.count()
+    counted_documents = (doc for doc, _ in zip(documents, chunk_counter))
+
+    # Chunk ids are cheap to compute up front; the manifest tracks which ones are written
+    chunk_params = {"max_tokens": CHUNK_MAX_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS, "span_pages": CHUNK_SPAN_PAGES}
+    chunk_spans = [
+        {key: chunk[key] for key in ("page_number", "start_char", "page_end", "end_char")}
+        for chunk in iter_chunks(pages, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_SPAN_PAGES)
+    ]
+    expected_ids = [chunk_id(document_hash, span) for span in chunk_spans]
+
+    index = build_chroma_index(
+        counted_documents, document_hash, progress=report, tenant=tenant,
+        expected_ids=expected_ids, params=chunk_params,
+    )
+    chunks = next(chunk_counter)  # zip only advances the counter after a chunk was produced
+    count("chunk_text", chunks)
+    answer_cache.invalidate(document_hash)  # answers from a previous index are stale
+
+    report("keyword_store", 0.0)
+    with timed("keyword_store"):
+        save_keyword_index(build_keyword_index(pages), keyword_index_path(document_hash))
+        save_chunk_map(chunk_spans, chunk_map_path(document_hash), source=file_path)  # maps keyword hits to chunk ids
+    report("keyword_store", 1.0)
+
+    # Sentence-window / auto-merging indexes, parsed from the stored pages
+    for i, strategy in enumerate(INGEST_STRATEGIES):
+        report("strategies", i / len(INGEST_STRATEGIES))
+        if not strategy_ready(document_hash, strategy):
+            build_strategy_index(document_hash, strategy, pages=pages, source=file_path)
+    if INGEST_STRATEGIES:
+        report("strategies", 1.0)
+
+    return {"document_hash": document_hash, "pages": len(pages), "chunks": chunks}
+
+def build_strategy_worker(document_hash, strategy, progress=None, source=None):
+    """
+    Build a retrieval strategy of an ingested document from its page store.
+
+    :param source: Path of the uploaded file, stored in the metadata for citations.
+    """
+    report = progress or (lambda stage, fraction: None)
+    report("strategies", 0.0)
+    build_strategy_index(document_hash, strategy, source=source)
+    answer_cache.invalidate(document_hash)
+    report("strategies", 1.0)
+    return {"document_hash": document_hash, "strategy": strategy}
+
+
+def strategy_job_key(document_hash, strategy):
+    """Single-flight key of a strategy build, separate from the document's ingestion job."""
+    return f"{document_hash}:{strategy}"
+
+
+def queue_strategy_build(document_hash, strategy):
+    """
+    Queue the build of a retrieval strategy that isn't ready yet.
+
+    Queries never build strategies inline; the client polls the job and retries.
+    While the document itself is still being ingested, its ingestion job is returned.
+
+    :return: A tuple of (response body, status code).
+    """
+    ingestion_job = ingestion_queue.active_job(document_hash)
+    if ingestion_job is None and not check_chroma_index(document_hash):
+        return {"error": "Document not found"}, 404
+    if ingestion_job is not None:
+        return {
+            "message": "RAG job still running, retry once it has finished",
+            "job_id": ingestion_job.id,
+            "hash": document_hash,
+            "strategy": strategy,
+            "status_url": f"/jobs/{ingestion_job.id}",
+        }, 202
+
+    source = None
+    for ext in ALLOWED_EXTENSIONS:
+        path = content_addressed_path(UPLOAD_FOLDER, document_hash, ext)
+        if os.path.isfile(path):
+            source = path
+    try:
+        job, created = ingestion_queue.submit(
+            document_hash, source, build_strategy_worker, document_hash, strategy,
+            source=source, stages=STRATEGY_STAGES, key=strategy_job_key(document_hash, strategy),
+        )
+    except QueueFullError as e:
+        return {"error": str(e)}, 503
+
+    return {
+        "message": f"Retrieval strategy {strategy} is being built" if created else f"Retrieval strategy {strategy} is already being built",
+        "job_id": job.id,
+        "hash": document_hash,
+        "strategy": strategy,
+        "status_url": f"/jobs/{job.id}",
+    }, 202
+
+
+@app.route('/retrieve', methods=['POST'])
+def retrieve():
+    """Top-k chunks with scores and page metadata for one or more queries, no answer generation."""
+    data = request.get_json() or {}
+    document_hash = data.get("hash", "")
+    queries = data.get("queries") or ([data["query"]] if data.get("query") else [])
+    top_k = int(data.get("topK", 5))
+
+    if not queries:
+        return jsonify({"error": "No query"}), 400
+    if len(queries) > MAX_RETRIEVE_QUERIES:
+        return jsonify({"error": f"At most {MAX_RETRIEVE_QUERIES} queries per request"}), 400
+
+    log_event("retrieve_request", hash=document_hash, queries=len(queries), top_k=top_k)
+    try:
+        results = batch_retrieve(document_hash, queries, top_k=top_k)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        log_event("retrieve_error", error=str(e))
+        return jsonify({"error": "Internal server error"}), 500
+
+    return jsonify({"hash": document_hash, "results": results}), 200
+
+
+def context_headers(nodes):
+    """Log the retrieved context sent to the LLM and expose its size as response headers."""
+    report = context_report(nodes)
+    log_event("context", chunks=report["chunks"], tokens=report["tokens"])
+    return {"X-Context-Chunks": str(report["chunks"]), "X-Context-Tokens": str(report["tokens"])}
+
 
 @app.route('/search', methods=['POST'])
 def search():
@@ -83,29 +372,76 @@ def search():
         query = data.get("query", "")
         search_type = data.get("searchType", "")  # Default to "semantic"
         document_hash = data.get("hash", "")  # File hash from frontend
+        hashes = data.get("hashes") or []  # Corpus-wide search over several documents
+        tenant = data.get("tenant")  # or over a tenant's library (shared layout)
 
-        # Print received request details
-        print(f"Received search request: Query='{query}', Search Type='{search_type}', Document Hash='{document_hash}'")
-        if search_type == "keyword":
-            pdf_text = load_pdf_text(f"uploads/{document_hash}.json")
-            streaming_response = keyword_search(pdf_text, query)
+        # Log received request details
+        log_event("search_request", query=query, search_type=search_type, hash=document_hash, hashes=hashes, tenant=tenant)
+        start = time.perf_counter()
+        content_type = "text/plain"
+        headers = {}
+        if search_type == "keyword" and data.get("format") == "ndjson":
+            # All hits in page order, one JSON record per snippet, paginated
+            with timed("keyword_load"):
+                pages = open_page_store(document_hash)
+            results = paginated_keyword_search(
+                pages, query, page=int(data.get("page", 1)), page_size=int(data.get("pageSize", 20)),
+                whole_words=bool(data.get("wholeWords", False)),
+            )
+            streaming_response = traced_stream(results, "keyword_search", start)
+            content_type = "application/x-ndjson"
+        elif search_type == "keyword":
+            with timed("keyword_load"):
+                pages, keyword_index = load_keyword_store(document_hash)
+            top_k = int(data.get("topK", 10))
+            results = ranked_keyword_search(keyword_index, pages, query, top_k=top_k)
+            streaming_response = traced_stream(results, "keyword_search", start)
+        elif hashes or tenant:
+            top_k = int(data.get("topK", 5))
+            with timed("retrieval", search_type="corpus"):
+                response = corpus_query(query, hashes=hashes, tenant=tenant, top_k=top_k)
+            headers = context_headers(response.source_nodes)
+            streaming_response = traced_stream(response.response_gen, "llm", start)
+        elif search_type in STRATEGIES and not strategy_ready(document_hash, search_type):
+            body, status = queue_strategy_build(document_hash, search_type)
+            return jsonify(body), status
         else:
-            query_engine = get_query_engine(document_hash)  # Assume a function to retrieve the index
-            streaming_response = query_engine.query(query)  # Get the streaming response
-            streaming_response = streaming_response.response_gen
-
+            top_k = int(data.get("topK", 5))
+            params = (search_type or "semantic", top_k)
+            cached_answer = answer_cache.lookup(document_hash, query, params)
+            if cached_answer is not None:
+                print(f"Answer cache hit for document {document_hash}")
+                streaming_response = [cached_answer]
+            else:
+                with timed("retrieval", search_type=params[0]):
+                    if search_type == "hybrid":
+                        response = hybrid_query(document_hash, query, top_k=top_k)
+                    elif search_type in STRATEGIES:
+                        query_engine = get_strategy_query_engine(document_hash, search_type, similarity_top_k=top_k)
+                        response = query_engine.query(query)
+                    else:
+                        query_engine = get_query_engine(document_hash, similarity_top_k=top_k)  # Cached per document
+                        response = query_engine.query(query)  # Get the streaming response
+                headers = context_headers(response.source_nodes)
+                response_gen = traced_stream(response.response_gen, "llm", start)
+                # Stream through while keeping the answer for the next identical question
+                streaming_response = answer_cache.record(document_hash, query, params, response_gen)
 
         # Define a generator function for streaming
         def generate():
             for chunk in streaming_response:
                 yield chunk.encode("utf-8")  # Send each chunk to the client
-            yield "\n"  # Send a final newline for proper ending
+            if content_type == "text/plain":
+                yield "\n"  # Send a final newline for proper ending
 
         # Return a streaming response
-        return Response(generate(), content_type="text/plain")
+        return Response(generate(), content_type=content_type, headers=headers)
 
+    except CorpusScopeError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error processing search request: {e}")
+        log_event("search_error", error=str(e))
         return jsonify({"error": "Internal server error"}), 500
 if __name__ == '__main__':
+    warmup()
     app.run(host='0.0.0.0', port=8080, debug=True)
\ No newline at end of file
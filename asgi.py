@@ -0,0 +1,320 @@
+"""
+ASGI serving mode.
+
+Serves the same `/upload`, `/search`, `/retrieve`, `/jobs/<job_id>` and `/metrics` contracts
+as the Flask app, but streams answers from async generators so a waiting
+OpenAI stream does not pin a worker thread. Blocking work (Chroma retrieval,
+BM25 over the page store, spooling uploads) runs in the thread pool; parsing
+and embedding stay in the ingestion job queue.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+"""
+import contextlib
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from llama_index.core import get_response_synthesizer
+from llama_index.core.schema import QueryBundle
+
+from app import (
+    MAX_RETRIEVE_QUERIES, UPLOAD_FOLDER, allowed_file, answer_cache, context_headers, ingestion_queue,
+    queue_strategy_build, upload_file_worker, warmup,
+)
+from build_index import check_chroma_index, get_cache_stats, get_llm, get_query_engine
+from context_selection import CONTEXT_OVERFETCH, ContextSelector, merge_adjacent_nodes
+from corpus_search import CorpusScopeError, corpus_retrieve
+from hybrid_search import hybrid_retrieve
+from jobs import QueueFullError
+from retrieval import batch_retrieve
+from retrieval_strategies import STRATEGIES, get_strategy_query_engine, strategy_ready
+from keyword_search import load_keyword_store, paginated_keyword_search, ranked_keyword_search
+from page_store import open_page_store
+from metrics import (
+    atraced_stream, log_event, new_request_id, render_metrics, request_id_var, set_cache_stats,
+    timed, HTTP_REQUESTS, HTTP_SECONDS,
+)
+from utils import HashingTempFile, content_addressed_path
+
+class RequestContextMiddleware:
+    """
+    Assigns request ids and records HTTP metrics, like the Flask before/after_request hooks.
+
+    Written as plain ASGI middleware so the request id context variable is
+    visible to the endpoint and its streaming body.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1") or new_request_id()
+        request_id_var.set(request_id)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+                elapsed = time.perf_counter() - start
+                # The router adds the matched endpoint to the shared scope
+                endpoint = getattr(scope.get("endpoint"), "__name__", "unknown")
+                HTTP_REQUESTS.inc(endpoint=endpoint, status=message["status"])
+                HTTP_SECONDS.observe(elapsed, endpoint=endpoint)
+                log_event(
+                    "request", method=scope["method"], path=scope["path"],
+                    status=message["status"], seconds=round(elapsed, 6),
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_request_id)
+
+
+UPLOAD_COPY_SIZE = 1024 * 1024
+
+
+async def _hash_upload(file: UploadFile) -> HashingTempFile:
+    """
+    Copy a parsed upload into a hashing temp file in the upload folder.
+
+    Starlette spools file parts itself, so the body is hashed while it is copied
+    out of that spool in chunks; the temp file is then moved to its
+    content-addressed path like the Flask app's.
+    """
+    upload = await run_in_threadpool(HashingTempFile, UPLOAD_FOLDER)
+    try:
+        while chunk := await file.read(UPLOAD_COPY_SIZE):
+            await run_in_threadpool(upload.write, chunk)
+    except BaseException:
+        await run_in_threadpool(upload.discard)
+        raise
+    return upload
+
+
+async def metrics(request):
+    set_cache_stats(get_cache_stats())
+    set_cache_stats({"answers": answer_cache.stats()})
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+async def upload_file(request):
+    print("upload_file request received")
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        return JSONResponse({"error": "No file part"}, status_code=400)
+    try:
+        async with request.form() as form:
+            file = form.get("file")
+            if file is None or isinstance(file, str):
+                return JSONResponse({"error": "No file part"}, status_code=400)
+
+            if file.filename == '':
+                return JSONResponse({"error": "No selected file"}, status_code=400)
+
+            if not allowed_file(file.filename):
+                return JSONResponse({"error": "Only PDF and HTML files are allowed"}, status_code=400)
+
+            upload = await _hash_upload(file)
+            tenant = form.get("tenant") or None
+    except HTTPException as e:  # malformed multipart bodies
+        return JSONResponse({"error": e.detail}, status_code=e.status_code)
+
+    try:
+        file_ext = os.path.splitext(file.filename)[1].lower()
+        document_hash = upload.hexdigest()
+
+        # A collection that is still being written by a running job is not established yet
+        if ingestion_queue.active_job(document_hash) is None and await run_in_threadpool(check_chroma_index, document_hash):
+            return JSONResponse({"message": "RAG already established", "hash": document_hash}, status_code=200)
+
+        file_path = await run_in_threadpool(upload.commit, content_addressed_path(UPLOAD_FOLDER, document_hash, file_ext))
+
+        try:
+            job, created = ingestion_queue.submit(
+                document_hash, file_path, upload_file_worker, file_path, document_hash, tenant=tenant
+            )
+        except QueueFullError as e:
+            return JSONResponse({"error": str(e)}, status_code=503)
+
+        return JSONResponse({
+            "message": "RAG job queued" if created else "RAG job already running",
+            "job_id": job.id,
+            "hash": document_hash,
+            "status_url": f"/jobs/{job.id}",
+        }, status_code=202)
+    finally:
+        await run_in_threadpool(upload.discard)  # no-op once committed
+
+
+async def job_status(request):
+    job = ingestion_queue.get(request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return JSONResponse(job.to_dict(), status_code=200)
+
+
+async def retrieve(request):
+    data = await request.json() or {}
+    document_hash = data.get("hash", "")
+    queries = data.get("queries") or ([data["query"]] if data.get("query") else [])
+    top_k = int(data.get("topK", 5))
+
+    if not queries:
+        return JSONResponse({"error": "No query"}, status_code=400)
+    if len(queries) > MAX_RETRIEVE_QUERIES:
+        return JSONResponse({"error": f"At most {MAX_RETRIEVE_QUERIES} queries per request"}, status_code=400)
+
+    log_event("retrieve_request", hash=document_hash, queries=len(queries), top_k=top_k)
+    try:
+        results = await run_in_threadpool(batch_retrieve, document_hash, queries, top_k)
+    except LookupError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+    except Exception as e:
+        log_event("retrieve_error", error=str(e))
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+    return JSONResponse({"hash": document_hash, "results": results}, status_code=200)
+
+
+async def _answer_stream(response):
+    """Async chunks of a synthesized answer, falling back to the sync stream in the thread pool."""
+    if hasattr(response, "async_response_gen"):
+        async for chunk in response.async_response_gen():
+            yield chunk
+    else:
+        async for chunk in iterate_in_threadpool(response.response_gen):
+            yield chunk
+
+
+async def _synthesize(query, nodes, query_engine=None):
+    """Generate a streaming answer from retrieved nodes through the async LLM API."""
+    if query_engine is not None:
+        return await query_engine.asynthesize(QueryBundle(query), nodes)
+    synthesizer = get_response_synthesizer(llm=get_llm(), streaming=True)
+    return await synthesizer.asynthesize(query, nodes=nodes)
+
+
+def _retrieve_semantic(document_hash, query, top_k, strategy=None):
+    if strategy in STRATEGIES:
+        query_engine = get_strategy_query_engine(document_hash, strategy, similarity_top_k=top_k)
+    else:
+        query_engine = get_query_engine(document_hash, similarity_top_k=top_k)  # Cached per document
+    return query_engine, query_engine.retrieve(QueryBundle(query))
+
+
+async def search(request):
+    try:
+        data = await request.json()
+
+        query = data.get("query", "")
+        search_type = data.get("searchType", "")
+        document_hash = data.get("hash", "")
+        hashes = data.get("hashes") or []
+        tenant = data.get("tenant")
+
+        log_event("search_request", query=query, search_type=search_type, hash=document_hash, hashes=hashes, tenant=tenant)
+        start = time.perf_counter()
+        media_type = "text/plain"
+        headers = {}
+        if search_type == "keyword" and data.get("format") == "ndjson":
+            with timed("keyword_load"):
+                pages = await run_in_threadpool(open_page_store, document_hash)
+            results = paginated_keyword_search(
+                pages, query, page=int(data.get("page", 1)), page_size=int(data.get("pageSize", 20)),
+                whole_words=bool(data.get("wholeWords", False)),
+            )
+            streaming_response = atraced_stream(iterate_in_threadpool(results), "keyword_search", start)
+            media_type = "application/x-ndjson"
+        elif search_type == "keyword":
+            with timed("keyword_load"):
+                pages, keyword_index = await run_in_threadpool(load_keyword_store, document_hash)
+            top_k = int(data.get("topK", 10))
+            results = ranked_keyword_search(keyword_index, pages, query, top_k=top_k)
+            streaming_response = atraced_stream(iterate_in_threadpool(results), "keyword_search", start)
+        elif hashes or tenant:
+            top_k = int(data.get("topK", 5))
+            with timed("retrieval", search_type="corpus"):
+                candidates = await run_in_threadpool(corpus_retrieve, query, hashes, tenant, top_k * CONTEXT_OVERFETCH)
+                nodes = await run_in_threadpool(
+                    ContextSelector(top_k=top_k).postprocess_nodes, candidates, None, query
+                )
+                nodes = merge_adjacent_nodes(nodes)
+            headers = context_headers(nodes)
+            response = await _synthesize(query, nodes)
+            streaming_response = atraced_stream(_answer_stream(response), "llm", start)
+        elif search_type in STRATEGIES and not strategy_ready(document_hash, search_type):
+            body, status = await run_in_threadpool(queue_strategy_build, document_hash, search_type)
+            return JSONResponse(body, status_code=status)
+        else:
+            top_k = int(data.get("topK", 5))
+            params = (search_type or "semantic", top_k)
+            cached_answer = await run_in_threadpool(answer_cache.lookup, document_hash, query, params)
+            if cached_answer is not None:
+                print(f"Answer cache hit for document {document_hash}")
+                streaming_response = iterate_in_threadpool(iter([cached_answer]))
+            else:
+                query_engine = None
+                with timed("retrieval", search_type=params[0]):
+                    if search_type == "hybrid":
+                        nodes = merge_adjacent_nodes(await run_in_threadpool(hybrid_retrieve, document_hash, query, top_k))
+                    else:
+                        query_engine, nodes = await run_in_threadpool(
+                            _retrieve_semantic, document_hash, query, top_k, search_type
+                        )
+                headers = context_headers(nodes)
+                response = await _synthesize(query, nodes, query_engine)
+                response_gen = atraced_stream(_answer_stream(response), "llm", start)
+                streaming_response = answer_cache.arecord(document_hash, query, params, response_gen)
+
+        async def generate():
+            async for chunk in streaming_response:
+                yield chunk.encode("utf-8")
+            if media_type == "text/plain":
+                yield b"\n"
+
+        return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+    except CorpusScopeError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        log_event("search_error", error=str(e))
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Open clients and hot indexes before the first request is accepted
+    await run_in_threadpool(warmup)
+    yield
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/upload", upload_file, methods=["POST"]),
+        Route("/jobs/{job_id}", job_status, methods=["GET"]),
+        Route("/retrieve", retrieve, methods=["POST"]),
+        Route("/search", search, methods=["POST"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(RequestContextMiddleware),
+    ],
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv("PORT", "8080")))
@@ -0,0 +1,273 @@
+"""
+Offline benchmark for ingestion throughput and search latency.
+
+Generates synthetic PDF and HTML documents, swaps in a stub LLM and the local
+hash embedding, then drives the same code paths as the server:
+`upload_file_worker`, keyword search and the semantic query engine.
+
+    python benchmark.py --pdf-pages 200 --html-sections 50 --queries 50 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+VOCABULARY = [
+    "attention", "expert", "routing", "token", "gradient", "pipeline", "memory", "latency",
+    "throughput", "cluster", "tensor", "precision", "benchmark", "inference", "training",
+    "parameter", "batch", "kernel", "bandwidth", "cache", "network", "optimizer", "schedule",
+    "dataset", "evaluation", "context", "window", "sequence", "embedding", "retrieval",
+    "compression", "quantization", "sparsity", "activation", "checkpoint", "replica",
+    "shard", "node", "loss", "reward", "policy", "alignment", "prompt", "decoder", "encoder",
+]
+
+
+def synthetic_sentence(rng: random.Random) -> str:
+    words = [rng.choice(VOCABULARY) for _ in range(rng.randint(8, 20))]
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), f"ID-{rng.randint(1000, 9999)}")
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), f"{rng.randint(1, 999)}B")
+    return " ".join(words).capitalize() + "."
+
+
+def synthetic_page(rng: random.Random, words_per_page: int) -> str:
+    sentences = []
+    count = 0
+    while count < words_per_page:
+        sentence = synthetic_sentence(rng)
+        sentences.append(sentence)
+        count += len(sentence.split())
+    return " ".join(sentences)
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_synthetic_pdf(path: str, pages: int, words_per_page: int, seed: int = 0):
+    """Write a text-only PDF with `pages` pages of synthetic sentences."""
+    rng = random.Random(seed)
+    objects = []  # body of object i + 1
+
+    page_ids = [4 + 2 * i for i in range(pages)]
+    objects.append("<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for page_id in page_ids:
+        words = synthetic_page(rng, words_per_page).split()
+        lines = [" ".join(words[i:i + 12]) for i in range(0, len(words), 12)]
+        text_ops = " T* ".join(f"({_pdf_escape(line)}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 40 800 Td {text_ops} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+
+    xref_offset = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def write_synthetic_html(path: str, sections: int, words_per_section: int, seed: int = 0):
+    """Write an HTML file with headed sections of synthetic paragraphs plus script/style noise."""
+    rng = random.Random(seed)
+    parts = ["<html><head><title>Synthetic</title><style>p { color: black; }</style></head><body>"]
+    for section in range(sections):
+        parts.append(f"<h2>Section {section + 1}</h2>")
+        parts.append(f"<p>{synthetic_page(rng, words_per_section)}</p>")
+        parts.append("<script>var tracking = {'section': %d};</script>" % section)
+    parts.append("</body></html>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(parts))
+
+
+def percentiles(samples):
+    """p50/p95/p99 and mean of a list of seconds, reported in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def setup_offline_backends(workdir: str, embed_backend: str = "local"):
+    """
+    Point the app at `workdir` and replace the OpenAI LLM with a stub.
+    Must run before the app modules are imported.
+
+    :param embed_backend: "local" for the offline hash embedding, or "openai" to
+        embed through the persistent embedding cache.
+    """
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ["EMBED_BACKEND"] = embed_backend
+    if embed_backend == "local":
+        os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+
+    from llama_index.core.llms import MockLLM
+    from build_index import set_llm
+
+    set_llm(MockLLM(max_tokens=64))
+
+
+def bench_ingestion(files):
+    from app import upload_file_worker
+
+    results = []
+    for file_path in files:
+        start = time.perf_counter()
+        summary = upload_file_worker(file_path)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "file": os.path.basename(file_path),
+            "bytes": os.path.getsize(file_path),
+            "seconds": elapsed,
+            "pages": summary["pages"],
+            "chunks": summary["chunks"],
+            "pages_per_sec": summary["pages"] / elapsed if elapsed else None,
+            "chunks_per_sec": summary["chunks"] / elapsed if elapsed else None,
+            "document_hash": summary["document_hash"],
+        })
+    return results
+
+
+def bench_keyword(document_hash: str, queries):
+    from keyword_search import load_keyword_store, ranked_keyword_search, keyword_search
+
+    ranked, linear = [], []
+    for query in queries:
+        start = time.perf_counter()
+        pages, index = load_keyword_store(document_hash)
+        list(ranked_keyword_search(index, pages, query))
+        ranked.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        list(keyword_search(pages, query))
+        linear.append(time.perf_counter() - start)
+
+    return {"ranked": percentiles(ranked), "linear": percentiles(linear)}
+
+
+def bench_semantic(document_hash: str, queries):
+    from build_index import get_query_engine
+
+    first_byte, total = [], []
+    for query in queries:
+        start = time.perf_counter()
+        response_gen = get_query_engine(document_hash).query(query).response_gen
+        for i, _ in enumerate(response_gen):
+            if i == 0:
+                first_byte.append(time.perf_counter() - start)
+        total.append(time.perf_counter() - start)
+
+    return {"time_to_first_byte": percentiles(first_byte), "total": percentiles(total)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingestion and search benchmark")
+    parser.add_argument("--pdf-pages", type=int, default=100, help="pages of the synthetic PDF, 0 to skip")
+    parser.add_argument("--html-sections", type=int, default=50, help="sections of the synthetic HTML, 0 to skip")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--queries", type=int, default=30, help="queries per search benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="directory for uploads and indexes (default: temp dir)")
+    parser.add_argument("--output", default=None, help="write the JSON report here as well as to stdout")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rag-bench-"))
+    output = os.path.abspath(args.output) if args.output else None
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    setup_offline_backends(workdir)
+
+    files = []
+    os.makedirs("bench_inputs", exist_ok=True)
+    if args.pdf_pages:
+        path = os.path.abspath(os.path.join("bench_inputs", f"synthetic_{args.pdf_pages}p.pdf"))
+        write_synthetic_pdf(path, args.pdf_pages, args.words_per_page, seed=args.seed)
+        files.append(path)
+    if args.html_sections:
+        path = os.path.abspath(os.path.join("bench_inputs", f"synthetic_{args.html_sections}s.html"))
+        write_synthetic_html(path, args.html_sections, args.words_per_page, seed=args.seed)
+        files.append(path)
+
+    rng = random.Random(args.seed)
+    queries = []
+    for _ in range(args.queries):
+        words = rng.sample(VOCABULARY, rng.randint(1, 3))
+        queries.append(f"\"{' '.join(words)}\"" if len(words) > 1 and rng.random() < 0.3 else " ".join(words))
+
+    ingestion = bench_ingestion(files)
+    search = {}
+    for result in ingestion:
+        search[result["file"]] = {
+            "keyword": bench_keyword(result["document_hash"], queries),
+            "semantic": bench_semantic(result["document_hash"], queries),
+        }
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "workdir": workdir,
+        "parameters": vars(args),
+        "ingestion": ingestion,
+        "search": search,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,496 @@
-from llama_index.core import VectorStoreIndex, StorageContext, load_index_from_storage
-from llama_index.vector_stores.chroma import ChromaVectorStore
-from llama_index.embeddings.openai import OpenAIEmbedding
-import openai
+from llama_index.core import VectorStoreIndex, load_index_from_storage
 from dotenv import load_dotenv
 import os
-import chromadb
+import threading
+import time
+from cache import LRUCache
+from metrics import timed, count, log_event
+from manifest import IngestionManifest
+from context_selection import ContextSelector,ContextMerger,CONTEXT_OVERFETCH
+from numpy_store import NumpyVectorStore
+from embedding_cache import CachedEmbedding,EmbeddingStore,LocalHashEmbedding,ScheduledEmbedding
+from embedding_scheduler import EmbeddingScheduler
+from parse_document import estimate_tokens
 from llama_index.core import Settings
-from llama_index.llms.openai import OpenAI
+from llama_index.core.schema import MetadataMode, NodeRelationship, RelatedNodeInfo, TextNode
+from llama_index.core.vector_stores import MetadataFilter, MetadataFilters
 load_dotenv(override=True)  # Load environment variables
-openai.api_key = os.getenv("OPENAI_API_KEY")
-os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
-Settings.llm   = OpenAI(model="gpt-4o", temperature=0.1)
-Settings.embed_model = OpenAIEmbedding(
-    model="text-embedding-3-large", embed_batch_size=100
-)
+CHROMA_PATH = "./chroma_storage"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "openai")  # "openai" or "local"
+# A runtime cache, kept out of the vector store directory
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join("cache", "embedding_cache.sqlite3"))
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "1000000"))
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+# OpenAI-compatible embedding endpoint, e.g. http://127.0.0.1:8765/v1 for stub_embedding_server.py
+EMBED_API_BASE = os.getenv("EMBED_API_BASE") or None
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_MAX_IN_FLIGHT = int(os.getenv("EMBED_MAX_IN_FLIGHT", "4"))
+EMBED_TOKENS_PER_MINUTE = int(os.getenv("EMBED_TOKENS_PER_MINUTE", "0"))  # 0: no budget
+EMBED_COALESCE_SECONDS = float(os.getenv("EMBED_COALESCE_MS", "20")) / 1000
+
+# Clients are created on first use, so importing this module stays cheap and fork-safe
+_llm = None
+_embed_model = None
+_settings_lock = threading.RLock()
+
+
+def create_embed_model():
+    """
+    Configured embedding model behind the shared request scheduler, wrapped in
+    the persistent embedding cache.
+    EMBED_BACKEND=local selects the deterministic offline backend.
+    """
+    if EMBED_BACKEND == "local":
+        inner = LocalHashEmbedding(embed_batch_size=EMBED_BATCH_SIZE)
+    else:
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        # Retries and 429 backoff are left to the scheduler, which sees all callers
+        inner = OpenAIEmbedding(
+            model="text-embedding-3-large", embed_batch_size=EMBED_BATCH_SIZE,
+            api_base=EMBED_API_BASE, max_retries=0,
+        )
+    scheduler = EmbeddingScheduler(
+        inner.get_text_embedding_batch,
+        batch_size=EMBED_BATCH_SIZE,
+        max_in_flight=EMBED_MAX_IN_FLIGHT,
+        tokens_per_minute=EMBED_TOKENS_PER_MINUTE,
+        max_wait=EMBED_COALESCE_SECONDS,
+        count_tokens=estimate_tokens,
+    )
+    scheduled = ScheduledEmbedding(inner, scheduler)
+    store = EmbeddingStore(EMBED_CACHE_PATH, max_entries=EMBED_CACHE_MAX_ENTRIES)
+    # Cache keys include the model name; vectors of another endpoint (e.g. the stub server)
+    # must never be served as the real API's
+    model_name = inner.model_name if EMBED_API_BASE is None else f"{inner.model_name}@{EMBED_API_BASE}"
+    return CachedEmbedding(scheduled, store, model_name=model_name, embed_batch_size=scheduled.embed_batch_size)
+
+
+def get_embed_model():
+    """The process-wide embedding model, created and registered in `Settings` on first use."""
+    global _embed_model
+    if _embed_model is None:
+        with _settings_lock:
+            if _embed_model is None:
+                _embed_model = create_embed_model()
+                Settings.embed_model = _embed_model
+    return _embed_model
+
+
+def get_llm():
+    """The process-wide LLM, created and registered in `Settings` on first use."""
+    if _llm is None:
+        with _settings_lock:
+            if _llm is None:
+                from llama_index.llms.openai import OpenAI
+
+                set_llm(OpenAI(model=LLM_MODEL, temperature=0.1))
+    return _llm
+
+
+def set_llm(llm):
+    """Replace the LLM, e.g. with a stub for offline runs."""
+    global _llm
+    with _settings_lock:
+        _llm = llm
+        Settings.llm = llm
+
+
+def init_settings():
+    """Make sure `Settings` holds our models before llama-index falls back to its defaults."""
+    get_embed_model()
+    get_llm()
+
+
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "32"))
+INDEX_CACHE_TTL = float(os.getenv("INDEX_CACHE_TTL", "3600"))
+
+# "per_document": one collection per document hash (small deployments)
+# "shared": all documents in one collection, or CHROMA_SHARDS collections, tagged with metadata
+CHROMA_LAYOUT = os.getenv("CHROMA_LAYOUT", "per_document")
+CHROMA_SHARDS = int(os.getenv("CHROMA_SHARDS", "1"))
+SHARED_COLLECTION_PREFIX = "corpus"
+MANIFEST_DIR = os.path.join(CHROMA_PATH, "manifests")
+
+# "chroma": Chroma collections; "numpy": memory-mapped matrices with exact search (see numpy_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_STORE_PATH = os.getenv("NUMPY_STORE_PATH", os.path.join(CHROMA_PATH, "numpy"))
+NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float16")  # float32, float16 or int8
+
+# Documents opened by `warmup`: explicit hashes, otherwise the most recently ingested ones
+WARMUP_DOCUMENTS = [h for h in os.getenv("WARMUP_DOCUMENTS", "").split(",") if h]
+WARMUP_RECENT = int(os.getenv("WARMUP_RECENT", "8"))
+
+# Metadata used for filtering only, kept out of the embedded and prompted text
+FILTER_METADATA_KEYS = ["document_hash", "tenant"]
+
+_chroma_client = None
+_chroma_client_lock = threading.Lock()
+
+# Per-process caches keyed by collection name (and document hash / top-k for query engines)
+_index_cache = LRUCache(maxsize=INDEX_CACHE_SIZE, ttl=INDEX_CACHE_TTL)
+_query_engine_cache = LRUCache(maxsize=INDEX_CACHE_SIZE, ttl=INDEX_CACHE_TTL)
+_ready_documents = LRUCache(maxsize=100_000)  # document hashes known to be indexed
+
+
+def get_chroma_client():
+    """Return the process-wide Chroma client, creating it on first use."""
+    global _chroma_client
+    if _chroma_client is None:
+        with _chroma_client_lock:
+            if _chroma_client is None:
+                import chromadb
+
+                _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+    return _chroma_client
+
+
+def collection_name(document_hash):
+    """Name of the Chroma collection holding a document under the configured layout."""
+    if CHROMA_LAYOUT != "shared":
+        return document_hash
+    if CHROMA_SHARDS <= 1:
+        return SHARED_COLLECTION_PREFIX
+    return f"{SHARED_COLLECTION_PREFIX}-{int(document_hash[:8], 16) % CHROMA_SHARDS}"
+
+
+def shared_collection_names():
+    """All collections of the shared layout."""
+    if CHROMA_SHARDS <= 1:
+        return [SHARED_COLLECTION_PREFIX]
+    return [f"{SHARED_COLLECTION_PREFIX}-{shard}" for shard in range(CHROMA_SHARDS)]
+
+
+def document_filters(document_hash):
+    """Metadata filter restricting retrieval to one document, needed only in the shared layout."""
+    if CHROMA_LAYOUT != "shared":
+        return None
+    return MetadataFilters(filters=[MetadataFilter(key="document_hash", value=document_hash)])
+
+
+def get_cache_stats():
+    """Hit/miss counters of the index, query engine and embedding caches."""
+    stats = {
+        "indexes": _index_cache.stats(),
+        "query_engines": _query_engine_cache.stats(),
+    }
+    if isinstance(_embed_model, CachedEmbedding):
+        stats["embeddings"] = _embed_model.stats()
+        if isinstance(_embed_model.inner, ScheduledEmbedding):
+            stats["embed_scheduler"] = _embed_model.inner.scheduler.stats()
+    return stats
+
+
+def invalidate_document(document_hash):
+    """Drop cached state of a document, e.g. after re-indexing."""
+    _ready_documents.pop(document_hash)
+    if CHROMA_LAYOUT != "shared":
+        _index_cache.pop(collection_name(document_hash))
+    for key in [key for key in _query_engine_cache.keys() if key[0] == document_hash]:
+        _query_engine_cache.pop(key)
+
+
+def get_vector_store(name):
+    """Vector store of a collection under the configured backend."""
+    init_settings()
+    if VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore(os.path.join(NUMPY_STORE_PATH, name), dtype=NUMPY_STORE_DTYPE)
+    from llama_index.vector_stores.chroma import ChromaVectorStore
+
+    chroma_collection = get_chroma_client().get_or_create_collection(name=name)
+    return ChromaVectorStore(chroma_collection=chroma_collection)
+
+
+def _document_in_collection(document_hash):
+    name = collection_name(document_hash)
+    if VECTOR_BACKEND == "numpy":
+        return get_collection_index(name).vector_store.count(filters=document_filters(document_hash)) > 0
+
+    chroma_collection = get_chroma_client().get_or_create_collection(name=name)
+    if CHROMA_LAYOUT != "shared":
+        return chroma_collection.count() > 0
+    found = chroma_collection.get(where={"document_hash": document_hash}, limit=1, include=[])
+    return len(found["ids"]) > 0
+
+
+def _delete_chunks(document_hash, ids):
+    name = collection_name(document_hash)
+    if VECTOR_BACKEND == "numpy":
+        get_collection_index(name).vector_store.delete_nodes(ids)
+    else:
+        get_chroma_client().get_or_create_collection(name=name).delete(ids=ids)
+
+
+def stored_embeddings(nodes):
+    """
+    Vectors stored at ingestion for retrieved chunks, looked up by node id.
+
+    :param nodes: Nodes carrying `document_hash` metadata; others are skipped.
+    :return: Dict of node id to vector, for the ids found in their collection.
+    """
+    ids_by_collection = {}
+    for node in nodes:
+        document_hash = node.metadata.get("document_hash")
+        if document_hash:
+            ids_by_collection.setdefault(collection_name(document_hash), []).append(node.node_id)
+
+    embeddings = {}
+    for name, ids in ids_by_collection.items():
+        if VECTOR_BACKEND == "numpy":
+            embeddings.update(get_collection_index(name).vector_store.get_embeddings(ids))
+        else:
+            found = get_chroma_client().get_or_create_collection(name=name).get(ids=ids, include=["embeddings"])
+            embeddings.update((node_id, list(vector)) for node_id, vector in zip(found["ids"], found["embeddings"]))
+    return embeddings
+
+
 def check_chroma_index(document_hash):
-    chroma_client = chromadb.PersistentClient(path="./chroma_storage")
-    chroma_collection = chroma_client.get_or_create_collection(name=document_hash)
-    return chroma_collection.count() > 0
-def build_chroma_index(docs, document_hash):
+    """A document is ready once its ingestion manifest is complete."""
+    if document_hash in _ready_documents:
+        return True
+
+    manifest = IngestionManifest.load(MANIFEST_DIR, document_hash)
+    if manifest is not None:
+        ready = manifest.is_complete
+    else:
+        # Documents indexed before manifests existed
+        ready = _document_in_collection(document_hash)
+
+    if ready:
+        _ready_documents.set(document_hash, True)
+    return ready
+
+
+def _prepare_manifest(document_hash, expected_ids, params):
+    """
+    Load the manifest of a document, starting a new one if the expected chunks changed.
+    Chunks written under different chunking settings are removed from the vector store.
+    """
+    manifest = IngestionManifest.load(MANIFEST_DIR, document_hash)
+    if manifest is not None and manifest.expected_ids == list(expected_ids):
+        return manifest
+
+    written = ()
+    if manifest is not None:
+        stale = manifest.stale_ids(expected_ids)
+        if stale:
+            print(f"Removing {len(stale)} stale chunks of document {document_hash}")
+            _delete_chunks(document_hash, stale)
+        written = manifest.written_ids.intersection(expected_ids)
+
+    manifest = IngestionManifest(
+        IngestionManifest.path_for(MANIFEST_DIR, document_hash), document_hash, expected_ids, written, params
+    )
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    manifest.save()
+    return manifest
+
+
+def _load_collection_index(name):
+    return VectorStoreIndex.from_vector_store(get_vector_store(name))
+
+
+def get_collection_index(name):
+    """Index over a whole collection, loaded only on a cache miss."""
+    return _index_cache.get_or_create(name, lambda: _load_collection_index(name))
+
+
+def document_to_node(doc, document_hash, tenant=None):
     """
-    Build a LlamaIndex that uses Chroma as the underlying vector store.
+    Turn a parsed chunk into a node keeping its deterministic id, so writing the
+    same chunk twice upserts instead of duplicating it.
+    Chunks are tagged with the document hash (and tenant) for filtering in a shared collection.
     """
+    metadata = dict(doc.metadata)
+    metadata["document_hash"] = document_hash
+    if tenant:
+        metadata["tenant"] = tenant
+    return TextNode(
+        id_=doc.doc_id,
+        text=doc.text,
+        metadata=metadata,
+        excluded_embed_metadata_keys=list(set(doc.excluded_embed_metadata_keys + FILTER_METADATA_KEYS)),
+        excluded_llm_metadata_keys=list(set(doc.excluded_llm_metadata_keys + FILTER_METADATA_KEYS)),
+        relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=document_hash)},
+    )
+
 
-    # Initialize persistent ChromaDB client
-    chroma_client = chromadb.PersistentClient(path="./chroma_storage")
-    chroma_collection = chroma_client.get_or_create_collection(name=document_hash)
+def build_chroma_index(docs, document_hash, progress=None, tenant=None, expected_ids=None, params=None):
+    """
+    Build a LlamaIndex over the configured vector store (Chroma unless VECTOR_BACKEND=numpy).
 
-    # Path where LlamaIndex metadata will be saved
-    persist_dir = f"./chroma_storage/{document_hash}"
+    `docs` may be a lazy iterable; it is consumed one embedding batch at a time,
+    so chunking, embedding and vector store writes are interleaved.
 
-    # Check if the collection has existing records
-    if chroma_collection.count() > 0:
+    With `expected_ids`, progress is tracked in an ingestion manifest: chunks
+    already written by an earlier, interrupted run are skipped, and the
+    document is reported ready only when every expected chunk is written.
+
+    :param docs: Parsed `Document` chunks of the file.
+    :param document_hash: Hash of the file; names the collection or tags the chunks in the shared layout.
+    :param progress: Optional callback `progress(stage, fraction)` reporting the "embed" and "index" stages.
+    :param tenant: Optional tenant the document belongs to, stored as chunk metadata.
+    :param expected_ids: Ids of all chunks `docs` will yield.
+    :param params: Chunking parameters recorded in the manifest.
+    """
+    report = progress or (lambda stage, fraction: None)
+
+    # Check if the document already has records
+    if check_chroma_index(document_hash):
         print(f"Document {document_hash} found in Chroma, loading existing index...")
-        
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        index = VectorStoreIndex.from_vector_store(vector_store)
+        index = get_chroma_index(document_hash)
+        report("embed", 1.0)
+        report("index", 1.0)
+        return index
 
+    manifest = _prepare_manifest(document_hash, expected_ids, params) if expected_ids is not None else None
+    written = set(manifest.written_ids) if manifest else set()
+    if written:
+        print(f"Resuming document {document_hash}: {len(written)} chunks already written")
     else:
         print(f"Document {document_hash} not found in Chroma, building new index...")
-        
-        # Create a new vector store and storage context
-        vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
 
-        # Build and persist the index
-        index = VectorStoreIndex.from_documents(docs, storage_context=storage_context)
+    index = get_collection_index(collection_name(document_hash))
+    fraction = manifest.progress() if manifest else 0.0
+    report("embed", fraction)
+    report("index", fraction)
+
+    done = 0
+    missing_docs = (doc for doc in docs if doc.doc_id not in written)
+    for batch in _batched(missing_docs, get_embed_model().embed_batch_size):
+        nodes = [document_to_node(doc, document_hash, tenant) for doc in batch]
+        embed_nodes_in_batches(nodes)
+
+        # Nodes already carry embeddings, so inserting only writes to Chroma
+        with timed("index_write", nodes=len(nodes)):
+            index.insert_nodes(nodes)
+
+        done += len(nodes)
+        if manifest:
+            manifest.mark_written(node.node_id for node in nodes)
+            fraction = min(manifest.progress(), 0.99)
+            report("embed", fraction)
+            report("index", fraction)
 
+    if manifest and not manifest.is_complete:
+        raise RuntimeError(
+            f"Document {document_hash} is incomplete: {len(manifest.missing_ids())} expected chunks were not produced"
+        )
 
+    print(f"Indexed {done} chunks for document {document_hash}")
+    report("embed", 1.0)
+    report("index", 1.0)
+    _ready_documents.set(document_hash, True)
     return index
 
-def get_chroma_index(document_hash):
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-    # Initialize Chroma Persistent Client
-    chroma_client = chromadb.PersistentClient(path="./chroma_storage")
-    chroma_collection = chroma_client.get_or_create_collection(name=document_hash)
+def embed_nodes_in_batches(nodes, progress=None):
+    """
+    Fill in `node.embedding` for every node using the configured embedding model.
 
-    # Path where LlamaIndex metadata is stored
-    persist_dir = f"./chroma_storage/{document_hash}"
+    :param nodes: Nodes to embed, modified in place.
+    :param progress: Optional callback receiving the fraction of nodes embedded.
+    """
+    embed_model = get_embed_model()
+    batch_size = embed_model.embed_batch_size
+    total = len(nodes)
+    if progress:
+        progress(0.0)
 
-    # Check if the collection has existing records
-    if chroma_collection.count() > 0:
-        print(f"Document {document_hash} found in Chroma, loading existing index...")
+    for start in range(0, total, batch_size):
+        batch = nodes[start:start + batch_size]
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in batch]
+        with timed("embed_batch", texts=len(texts)):
+            embeddings = embed_model.get_text_embedding_batch(texts)
+        count("embed_batch", len(texts))
+        for node, embedding in zip(batch, embeddings):
+            node.embedding = embedding
+        if progress:
+            progress(min(start + batch_size, total) / total)
 
-        # Load stored index metadata from disk
-        # vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        # storage_context = StorageContext.from_defaults(vector_store=vector_store, persist_dir=persist_dir)
-
-        try:
-            vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
-        # storage_context = StorageContext.from_defaults(vector_store=vector_store)
-            index = VectorStoreIndex.from_vector_store(vector_store)
-            print(f"Index loaded successfully for document {document_hash}")
-            return index
-        except Exception as e:
-            print(f"Error loading index: {e}")
-            # print(f"persist_dir: {persist_dir}")
-            return None
-    else:
+    if progress:
+        progress(1.0)
+
+def get_chroma_index(document_hash):
+    """
+    Return the index holding a document, or None if it hasn't been indexed.
+
+    In the shared layout this index spans the whole collection, so retrieval
+    must use `document_filters(document_hash)`.
+    """
+    if not check_chroma_index(document_hash):
         print(f"Document {document_hash} not found in Chroma.")
         return None
 
-def get_query_engine(document_hash):
-    index = get_chroma_index(document_hash)
-    return index.as_query_engine(similarity_top_k=5,streaming=True)
+    try:
+        return get_collection_index(collection_name(document_hash))
+    except Exception as e:
+        print(f"Error loading index: {e}")
+        return None
+
+def get_query_engine(document_hash, similarity_top_k=5):
+    def create_query_engine():
+        index = get_chroma_index(document_hash)
+        if index is None:
+            return None
+        # Over-fetch, keep a diverse subset within the context token budget, then merge neighbouring chunks
+        return index.as_query_engine(
+            similarity_top_k=similarity_top_k * CONTEXT_OVERFETCH,
+            streaming=True,
+            filters=document_filters(document_hash),
+            node_postprocessors=[ContextSelector(top_k=similarity_top_k), ContextMerger()],
+        )
+
+    return _query_engine_cache.get_or_create((document_hash, similarity_top_k), create_query_engine)
+
+def hot_documents():
+    """Hashes of the documents worth opening before serving, newest first."""
+    if WARMUP_DOCUMENTS:
+        return list(WARMUP_DOCUMENTS)
+    if not os.path.isdir(MANIFEST_DIR):
+        return []
+    manifests = [entry for entry in os.scandir(MANIFEST_DIR) if entry.name.endswith(".json")]
+    manifests.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [entry.name[:-len(".json")] for entry in manifests[:WARMUP_RECENT]]
+
+
+def warmup(document_hashes=None):
+    """
+    Create the models and clients and open the indexes of hot documents.
+
+    Clients hold sockets, SQLite connections and threads, so under a pre-fork
+    server this runs in each worker after the fork, not in the master.
+
+    :param document_hashes: Documents to open, defaults to `hot_documents()`.
+    :return: Number of document indexes opened.
+    """
+    start = time.perf_counter()
+    init_settings()
+    if VECTOR_BACKEND != "numpy":
+        get_chroma_client()
+
+    opened = 0
+    for document_hash in hot_documents() if document_hashes is None else document_hashes:
+        index = get_chroma_index(document_hash)
+        if index is None:
+            continue
+        if VECTOR_BACKEND == "numpy":
+            index.vector_store.count()  # maps the rows
+        opened += 1
+
+    log_event("warmup", documents=opened, seconds=round(time.perf_counter() - start, 6))
+    return opened
+
 
 if __name__ == "__main__":
     from parse_document import parse_pdf
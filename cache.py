@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache with an optional TTL and hit/miss counters.
+
+    :param maxsize: Maximum number of entries kept; the least recently used entry is evicted first.
+    :param ttl: Seconds an entry stays valid after it was stored, or None to never expire.
+    :param on_evict: Called with each value dropped for size, expiry or replacement, e.g. to release resources.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = None, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.RLock()
+        self._build_locks = {}
+
+    def _evicted(self, values):
+        # Called outside the cache lock, so callbacks may take their own locks
+        if self.on_evict is not None:
+            for value in values:
+                self.on_evict(value)
+
+    def get(self, key, default=None):
+        expired = []
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and time.monotonic() - item[1] > self.ttl:
+                del self._data[key]
+                expired.append(item[0])
+                item = None
+
+            if item is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        self._evicted(expired)
+        return default if item is None else item[0]
+
+    def set(self, key, value):
+        evicted = []
+        with self._lock:
+            previous = self._data.get(key)
+            if previous is not None and previous[0] is not value:
+                evicted.append(previous[0])
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False)[1][0])
+                self.evictions += 1
+        self._evicted(evicted)
+
+    def get_or_create(self, key, factory):
+        """
+        Return the cached value for `key`, calling `factory()` to build it on a miss.
+
+        A per-key lock is held while building so concurrent callers don't build
+        the same entry twice, without blocking lookups of other keys.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            value = self.get(key)
+            if value is None:
+                value = factory()
+                if value is not None:
+                    self.set(key, value)
+
+        with self._lock:
+            self._build_locks.pop(key, None)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
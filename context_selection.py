@@ -0,0 +1,308 @@
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore, QueryBundle, TextNode
+
+from embedding_scheduler import urgent_embeddings
+from metrics import timed, count
+from parse_document import estimate_tokens
+
+# Candidates retrieved per chunk that may end up in the prompt
+CONTEXT_OVERFETCH = int(os.getenv("CONTEXT_OVERFETCH", "4"))
+# Upper bound on the estimated prompt tokens taken by retrieved chunks
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1000"))
+# 1.0 ranks by relevance only, lower values favour chunks unlike those already picked
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Candidates below this fraction of the best cosine similarity are dropped
+CONTEXT_RELATIVE_CUTOFF = float(os.getenv("CONTEXT_RELATIVE_CUTOFF", "0.8"))
+CONTEXT_MIN_SIMILARITY = float(os.getenv("CONTEXT_MIN_SIMILARITY", "0"))
+# Spans at most this many characters apart on a page are merged into one passage
+CONTEXT_MERGE_MAX_GAP = int(os.getenv("CONTEXT_MERGE_MAX_GAP", "1"))
+MIN_TEXT_OVERLAP = 20  # shortest suffix/prefix match treated as duplicated text
+
+# Position metadata kept out of the prompt; source and page numbers stay for citations
+MERGED_HIDDEN_METADATA_KEYS = ["document_hash", "tenant", "start_char", "end_char", "merged_chunks"]
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(
+    query_embedding,
+    embeddings,
+    top_k: int,
+    token_counts: List[int],
+    token_budget: int = None,
+    mmr_lambda: float = 0.7,
+    relative_cutoff: float = 0.0,
+    min_similarity: float = 0.0,
+) -> List[int]:
+    """
+    Pick a diverse, relevant subset of candidates with maximal marginal relevance.
+
+    Each step takes the candidate maximizing
+    `lambda * sim(query, c) - (1 - lambda) * max(sim(c, picked))`, skipping
+    candidates that no longer fit the token budget. The best candidate is always kept.
+
+    :param query_embedding: Query vector.
+    :param embeddings: Candidate vectors, one row per candidate.
+    :param top_k: Maximum number of candidates to pick.
+    :param token_counts: Estimated tokens of each candidate.
+    :param token_budget: Maximum total tokens of the picked candidates, None for no limit.
+    :param mmr_lambda: Relevance/diversity trade-off.
+    :param relative_cutoff: Drop candidates below this fraction of the best similarity.
+    :param min_similarity: Drop candidates below this cosine similarity.
+    :return: Indices of the picked candidates, in pick order.
+    """
+    if len(embeddings) == 0 or top_k <= 0:
+        return []
+
+    vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    query = _normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+
+    cutoff = max(min_similarity, relevance.max() * relative_cutoff)
+    eligible = relevance >= cutoff
+    eligible[int(np.argmax(relevance))] = True
+    tokens = np.asarray(token_counts, dtype=np.int64)
+
+    picked = []
+    used_tokens = 0
+    redundancy = np.zeros(len(vectors), dtype=np.float32)  # max similarity to any picked candidate
+    while len(picked) < top_k:
+        fits = eligible if token_budget is None or not picked else eligible & (tokens <= token_budget - used_tokens)
+        if not fits.any():
+            break
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        best = int(np.argmax(np.where(fits, scores, -np.inf)))
+        picked.append(best)
+        used_tokens += int(tokens[best])
+        eligible[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+
+    return picked
+
+
+def score_select(
+    scores: List[float],
+    top_k: int,
+    token_counts: List[int],
+    token_budget: int = None,
+    relative_cutoff: float = 0.0,
+    min_similarity: float = 0.0,
+) -> List[int]:
+    """
+    Pick the best-scoring candidates within the token budget, without embeddings.
+
+    Same cutoffs and budget as `mmr_select`, for candidates whose text was never
+    embedded (e.g. parent chunks produced by auto-merging).
+
+    :return: Indices of the picked candidates, best first.
+    """
+    if not scores or top_k <= 0:
+        return []
+
+    order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+    cutoff = max(min_similarity, scores[order[0]] * relative_cutoff)
+    picked = [order[0]]
+    used_tokens = token_counts[order[0]]
+    for i in order[1:]:
+        if len(picked) >= top_k or scores[i] < cutoff:
+            break
+        if token_budget is not None and used_tokens + token_counts[i] > token_budget:
+            continue
+        picked.append(i)
+        used_tokens += token_counts[i]
+    return picked
+
+
+class ContextSelector(BaseNodePostprocessor):
+    """
+    Node postprocessor shrinking over-fetched candidates to a diverse set within a token budget.
+
+    Candidates are compared by the vectors stored at ingestion: those the
+    retriever returned on the nodes, otherwise looked up in the vector store
+    by node id. Only candidates missing from the store are embedded. With
+    `diversify=False` candidates are picked by retrieval score alone.
+    """
+
+    top_k: int = Field(default=5, description="Maximum number of nodes kept.")
+    token_budget: Optional[int] = Field(default=CONTEXT_TOKEN_BUDGET, description="Maximum estimated tokens kept.")
+    mmr_lambda: float = Field(default=CONTEXT_MMR_LAMBDA, description="Relevance/diversity trade-off.")
+    relative_cutoff: float = Field(default=CONTEXT_RELATIVE_CUTOFF, description="Fraction of the best similarity required.")
+    min_similarity: float = Field(default=CONTEXT_MIN_SIMILARITY, description="Minimum cosine similarity.")
+    diversify: bool = Field(default=True, description="Re-rank with MMR over candidate embeddings.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextSelector"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        if len(nodes) <= 1:
+            return nodes[:self.top_k]
+        if not self.diversify:
+            with timed("context_select", candidates=len(nodes)):
+                token_counts = [estimate_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM)) for node in nodes]
+                picked = score_select(
+                    [node.score or 0.0 for node in nodes], self.top_k, token_counts,
+                    token_budget=self.token_budget, relative_cutoff=self.relative_cutoff,
+                    min_similarity=self.min_similarity,
+                )
+            return [nodes[i] for i in picked]
+        if query_bundle is None:
+            return nodes[:self.top_k]
+
+        from build_index import get_embed_model, stored_embeddings  # build_index imports this module
+
+        embed_model = get_embed_model()
+        with timed("context_select", candidates=len(nodes)), urgent_embeddings():
+            query_embedding = query_bundle.embedding or embed_model.get_query_embedding(query_bundle.query_str)
+            embeddings = [node.node.embedding for node in nodes]
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            if missing:
+                stored = stored_embeddings([nodes[i].node for i in missing])
+                for i in missing:
+                    embeddings[i] = stored.get(nodes[i].node.node_id)
+                missing = [i for i in missing if embeddings[i] is None]
+            if missing:
+                # e.g. merged parents or keyword hits outside the vector store
+                count("context_embedded", len(missing))
+                texts = [nodes[i].node.get_content(metadata_mode=MetadataMode.EMBED) for i in missing]
+                for i, embedding in zip(missing, embed_model.get_text_embedding_batch(texts)):
+                    embeddings[i] = embedding
+            token_counts = [estimate_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM)) for node in nodes]
+            picked = mmr_select(
+                query_embedding, embeddings, self.top_k, token_counts,
+                token_budget=self.token_budget, mmr_lambda=self.mmr_lambda,
+                relative_cutoff=self.relative_cutoff, min_similarity=self.min_similarity,
+            )
+        return [nodes[i] for i in picked]
+
+
+def _span(node: NodeWithScore):
+    """((page, char), (page, char)) position of a node, or None without position metadata."""
+    metadata = node.node.metadata
+    if any(key not in metadata for key in ("page_number", "start_char", "end_char")):
+        return None
+    return (metadata["page_number"], metadata["start_char"]), (metadata.get("page_end") or metadata["page_number"], metadata["end_char"])
+
+
+def _source_key(node: NodeWithScore):
+    metadata = node.node.metadata
+    return metadata.get("document_hash") or metadata.get("source") or node.node.ref_doc_id
+
+
+def _text_overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`, 0 if shorter than MIN_TEXT_OVERLAP."""
+    for size in range(min(len(left), len(right)), MIN_TEXT_OVERLAP - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+def _join_text(left: str, right: str, overlap_hint: int) -> str:
+    # Offsets give the overlap directly; the text comparison guards against shifted offsets
+    if overlap_hint > 0 and left.endswith(right[:overlap_hint]):
+        return left + right[overlap_hint:]
+    overlap = _text_overlap(left, right)
+    if overlap:
+        return left + right[overlap:]
+    return f"{left} {right}"
+
+
+def merge_adjacent_nodes(nodes: List[NodeWithScore], max_gap: int = CONTEXT_MERGE_MAX_GAP) -> List[NodeWithScore]:
+    """
+    Merge retrieved chunks of the same source whose spans overlap or touch into single passages.
+
+    Nodes are grouped by source and ordered by their (page, char) start; a node
+    starting before the end of the current passage (plus `max_gap` characters)
+    is appended with the duplicated text removed. Merged passages keep the best
+    score, the source and the page range; nodes without positions pass through.
+
+    :return: Passages ordered by score, best first.
+    """
+    positioned = []
+    passages = []
+    for node in nodes:
+        span = _span(node)
+        if span is None:
+            passages.append(node)
+        else:
+            positioned.append((str(_source_key(node)), span, node))
+    positioned.sort(key=lambda item: (item[0], item[1][0]))
+
+    current = None  # [source, start, end, text, score, nodes]
+    for source, (start, end), node in positioned + [(None, (None, None), None)]:
+        if current is not None and source == current[0] and start <= (current[2][0], current[2][1] + max_gap):
+            if end > current[2]:
+                overlap_hint = current[2][1] - start[1] if start[0] == current[2][0] else 0
+                current[3] = _join_text(current[3], node.node.get_content(), overlap_hint)
+                current[2] = end
+            current[4] = max(current[4], node.score or 0.0)
+            current[5].append(node)
+            continue
+
+        if current is not None:
+            passages.append(_merged_node(*current))
+        if node is not None:
+            current = [source, start, end, node.node.get_content(), node.score or 0.0, [node]]
+
+    return sorted(passages, key=lambda node: node.score or 0.0, reverse=True)
+
+
+def _merged_node(source, start, end, text, score, nodes) -> NodeWithScore:
+    if len(nodes) == 1:
+        return nodes[0]
+    first = nodes[0].node
+    metadata = {
+        key: value for key, value in first.metadata.items() if key not in ("page_end", "start_char", "end_char")
+    }
+    metadata.update({
+        "page_number": start[0],
+        "page_end": end[0],
+        "start_char": start[1],
+        "end_char": end[1],
+        "merged_chunks": len(nodes),
+    })
+    if metadata["page_end"] == metadata["page_number"]:
+        hidden = MERGED_HIDDEN_METADATA_KEYS + ["page_end"]
+    else:
+        hidden = MERGED_HIDDEN_METADATA_KEYS
+    node = TextNode(
+        id_=f"{first.node_id}:merged:{len(nodes)}",
+        text=text,
+        metadata=metadata,
+        excluded_embed_metadata_keys=hidden,
+        excluded_llm_metadata_keys=hidden,
+        relationships=first.relationships,
+    )
+    return NodeWithScore(node=node, score=score)
+
+
+class ContextMerger(BaseNodePostprocessor):
+    """Node postprocessor wrapping `merge_adjacent_nodes`."""
+
+    max_gap: int = Field(default=CONTEXT_MERGE_MAX_GAP, description="Largest gap in characters still merged.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ContextMerger"
+
+    def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+        with timed("context_merge", nodes=len(nodes)):
+            return merge_adjacent_nodes(nodes, self.max_gap)
+
+
+def context_report(nodes: List[NodeWithScore]) -> Dict[str, int]:
+    """Number of chunks and estimated tokens of retrieved context sent to the LLM."""
+    tokens = sum(estimate_tokens(node.node.get_content(metadata_mode=MetadataMode.LLM)) for node in nodes)
+    count("context_chunks", len(nodes))
+    count("context_tokens", tokens)
+    return {"chunks": len(nodes), "tokens": tokens}
@@ -0,0 +1,86 @@
+import contextvars
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from llama_index.core import get_response_synthesizer
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores import FilterOperator, MetadataFilter, MetadataFilters
+
+import build_index
+from context_selection import ContextSelector, CONTEXT_OVERFETCH, merge_adjacent_nodes
+from build_index import (
+    collection_name, get_chroma_index, get_collection_index, get_embed_model, get_llm, shared_collection_names,
+)
+
+# Shard and per-document retrievals of one request run side by side
+_corpus_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="corpus")
+
+
+class CorpusScopeError(ValueError):
+    """Raised for a corpus search scope the configured layout cannot serve; a client error."""
+
+
+def check_corpus_scope(hashes: List[str] = None, tenant: str = None):
+    """
+    Reject scopes the layout can't honour instead of silently widening or narrowing them.
+
+    Tenants are only recorded as filterable metadata in the shared layout, so a
+    tenant is rejected with one collection per document, with or without hashes.
+    """
+    if tenant and build_index.CHROMA_LAYOUT != "shared":
+        raise CorpusScopeError("Tenant-scoped search requires CHROMA_LAYOUT=shared")
+
+
+def corpus_filters(hashes: List[str] = None, tenant: str = None):
+    """Metadata filter selecting a list of documents and/or a tenant in the shared layout."""
+    filters = []
+    if hashes:
+        filters.append(MetadataFilter(key="document_hash", value=list(hashes), operator=FilterOperator.IN))
+    if tenant:
+        filters.append(MetadataFilter(key="tenant", value=tenant))
+    return MetadataFilters(filters=filters) if filters else None
+
+
+def corpus_retrieve(query: str, hashes: List[str] = None, tenant: str = None, top_k: int = 5) -> List[NodeWithScore]:
+    """
+    Retrieve the top-k chunks across several documents.
+
+    In the shared layout this is one filtered ANN query per shard involved; with
+    one collection per document each document is queried. Results are merged by score.
+
+    :param hashes: Documents to search.
+    :param tenant: Tenant scope, only supported in the shared layout.
+    """
+    check_corpus_scope(hashes, tenant)
+    # Embed once and reuse the vector for every collection
+    query_bundle = QueryBundle(query_str=query, embedding=get_embed_model().get_query_embedding(query))
+
+    if build_index.CHROMA_LAYOUT == "shared":
+        names = sorted({collection_name(h) for h in hashes}) if hashes else shared_collection_names()
+        filters = corpus_filters(hashes, tenant)
+        retrievers = [
+            get_collection_index(name).as_retriever(similarity_top_k=top_k, filters=filters) for name in names
+        ]
+    else:
+        indexes = [get_chroma_index(h) for h in hashes or []]
+        retrievers = [index.as_retriever(similarity_top_k=top_k) for index in indexes if index is not None]
+
+    futures = [
+        _corpus_executor.submit(contextvars.copy_context().run, retriever.retrieve, query_bundle)
+        for retriever in retrievers
+    ]
+    results = [node for future in futures for node in future.result()]
+    return heapq.nlargest(top_k, results, key=lambda node: node.score or 0.0)
+
+
+def corpus_query(query: str, hashes: List[str] = None, tenant: str = None, top_k: int = 5):
+    """
+    Answer a query from the merged top-k chunks of several documents.
+
+    :return: A streaming response; iterate `response_gen` for the answer.
+    """
+    candidates = corpus_retrieve(query, hashes=hashes, tenant=tenant, top_k=top_k * CONTEXT_OVERFETCH)
+    nodes = merge_adjacent_nodes(ContextSelector(top_k=top_k).postprocess_nodes(candidates, query_str=query))
+    synthesizer = get_response_synthesizer(llm=get_llm(), streaming=True)
+    return synthesizer.synthesize(query, nodes=nodes)
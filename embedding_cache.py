@@ -0,0 +1,306 @@
+import hashlib
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from embedding_scheduler import EmbeddingScheduler, urgent_embeddings, urgent_var
+
+SQLITE_MAX_VARIABLES = 500  # keys per IN (...) lookup
+# Access times of hits are buffered and written in one transaction per flush
+TOUCH_FLUSH_SIZE = 1000
+TOUCH_FLUSH_SECONDS = 10.0
+# Extra share of max_entries evicted once full, so eviction doesn't run on every write
+EVICT_SLACK = 0.05
+
+
+def embedding_key(model_name: str, text: str, kind: str = "text") -> str:
+    """Cache key of an embedding: sha256 over model name, kind (text/query) and text."""
+    digest = hashlib.sha256()
+    for part in (model_name, kind, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """
+    SQLite-backed store of embedding vectors with size-bounded LRU eviction.
+
+    Vectors are stored as float32 blobs keyed by `embedding_key`. Reads don't
+    write: access times of hits are buffered and flushed with the next write,
+    or after TOUCH_FLUSH_SIZE hits or TOUCH_FLUSH_SECONDS. The row count is
+    tracked in memory and only recounted when it passes `max_entries`, since
+    other processes may share the database.
+
+    :param path: SQLite database file.
+    :param max_entries: Maximum number of vectors kept; least recently used rows are evicted first.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1_000_000):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> last access time not yet written
+        self._touched_since = None  # monotonic time of the oldest buffered access
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        (self._count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+
+    def _write_touched(self):
+        # Callers hold the lock and commit
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched = {}
+        self._touched_since = None
+
+    def flush(self):
+        """Write buffered access times."""
+        with self._lock:
+            if self._touched:
+                self._write_touched()
+                self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Batch lookup; returns only the keys that are present."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                batch = keys[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+
+            if found:
+                self._touched.update(dict.fromkeys(found, now))
+                if self._touched_since is None:
+                    self._touched_since = time.monotonic()
+                if len(self._touched) >= TOUCH_FLUSH_SIZE or time.monotonic() - self._touched_since >= TOUCH_FLUSH_SECONDS:
+                    self._write_touched()
+                    self._conn.commit()
+
+            unique = len(set(keys))
+            self.hits += len(found)
+            self.misses += unique - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Store vectors, then evict the least recently used rows above `max_entries`."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()],
+            )
+            self._count += max(cursor.rowcount, 0)
+            self._write_touched()
+            if self._count > self.max_entries:
+                (self._count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+                if self._count > self.max_entries:
+                    surplus = self._count - self.max_entries + int(self.max_entries * EVICT_SLACK)
+                    cursor = self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (surplus,),
+                    )
+                    self._count -= cursor.rowcount
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Wraps an embedding model with a persistent `EmbeddingStore`.
+
+    Only texts missing from the store are sent to the wrapped model, in one
+    batched call per lookup.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _store: EmbeddingStore = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, store: EmbeddingStore, **kwargs):
+        kwargs.setdefault("model_name", inner.model_name)
+        kwargs.setdefault("embed_batch_size", inner.embed_batch_size)
+        super().__init__(**kwargs)
+        self._inner = inner
+        self._store = store
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def store(self) -> EmbeddingStore:
+        return self._store
+
+    @property
+    def inner(self) -> BaseEmbedding:
+        return self._inner
+
+    def _lookup(self, texts: List[str], kind: str, embed_missing) -> List[List[float]]:
+        keys = [embedding_key(self.model_name, text, kind) for text in texts]
+        found = self._store.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = embed_missing(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self._store.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._lookup(
+            [query], "query", lambda texts: [self._inner.get_query_embedding(text) for text in texts]
+        )[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def get_query_embeddings(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed several queries with one batched call for the uncached ones.
+
+        Uses the wrapped model's text batch endpoint; the OpenAI and local models
+        embed queries and texts identically.
+        """
+        with urgent_embeddings():
+            return self._lookup(queries, "query", self._inner.get_text_embedding_batch)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._lookup(texts, "text", self._inner.get_text_embedding_batch)
+
+    def stats(self) -> dict:
+        return self._store.stats()
+
+
+class ScheduledEmbedding(BaseEmbedding):
+    """
+    Sends the text embeddings of a wrapped model through an `EmbeddingScheduler`.
+
+    Calls from concurrent ingestion jobs share API batches, concurrency and the
+    token budget. Queries, and texts embedded inside `urgent_embeddings()`,
+    go to the front of the queue without waiting for a full batch.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _scheduler: EmbeddingScheduler = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, scheduler: EmbeddingScheduler, **kwargs):
+        kwargs.setdefault("model_name", inner.model_name)
+        # One call may span several API batches, which the scheduler sends concurrently
+        kwargs.setdefault("embed_batch_size", scheduler.batch_size * scheduler.max_in_flight)
+        super().__init__(**kwargs)
+        self._inner = inner
+        self._scheduler = scheduler
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ScheduledEmbedding"
+
+    @property
+    def scheduler(self) -> EmbeddingScheduler:
+        return self._scheduler
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        # The OpenAI and local models embed queries and texts identically
+        return self._scheduler.embed([query], urgent=True)[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._scheduler.embed(texts, urgent=urgent_var.get())
+
+
+class LocalHashEmbedding(BaseEmbedding):
+    """
+    Deterministic offline embedding: hashed word and word-bigram features, L2-normalized.
+
+    Texts sharing words get similar vectors, which is enough for testing and
+    benchmarking ingestion and retrieval without network access.
+    """
+
+    dimensions: int = 256
+
+    def __init__(self, dimensions: int = 256, **kwargs):
+        kwargs.setdefault("model_name", f"local-hash-{dimensions}")
+        super().__init__(dimensions=dimensions, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalHashEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm == 0:
+            return vector
+        return [value / norm for value in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
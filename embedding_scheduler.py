@@ -0,0 +1,350 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, List
+
+from metrics import count, log_event
+
+THROUGHPUT_WINDOW = 60.0  # seconds of completed batches used for rates and the token budget
+
+# Set while embedding on behalf of a search request, so its texts skip queued ingestion work
+urgent_var = contextvars.ContextVar("embed_urgent", default=False)
+
+
+@contextmanager
+def urgent_embeddings():
+    """Send every embedding made inside the block ahead of the ingestion backlog."""
+    token = urgent_var.set(True)
+    try:
+        yield
+    finally:
+        urgent_var.reset(token)
+
+
+def _estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+
+def _status_code(error: Exception):
+    response = getattr(error, "response", None)
+    return getattr(error, "status_code", None) or getattr(response, "status_code", None)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """True for HTTP 429 errors of the OpenAI SDK, httpx or requests."""
+    return _status_code(error) == 429
+
+
+def is_permanent(error: Exception) -> bool:
+    """True for 4xx errors other than timeouts, conflicts and 429, which a retry cannot fix."""
+    status = _status_code(error)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 409, 429)
+
+
+def retry_after(error: Exception):
+    """Seconds from the Retry-After header of a throttled response, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Item:
+    __slots__ = ("text", "tokens", "future", "enqueued_at", "urgent", "attempts", "caller", "isolated")
+
+    def __init__(self, text: str, tokens: int, urgent: bool, caller):
+        self.text = text
+        self.tokens = tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.urgent = urgent
+        self.attempts = 0
+        self.caller = caller  # items of one `embed` call
+        self.isolated = False  # retried in batches of its own caller only
+
+
+class EmbeddingScheduler:
+    """
+    Process-wide queue turning embedding calls from all ingestion jobs into full API batches.
+
+    Texts of concurrent `embed` calls are coalesced into batches of `batch_size`;
+    a partial batch waits at most `max_wait` seconds for more texts. Up to
+    `max_in_flight` batches are sent concurrently, and a sliding one-minute
+    window keeps the estimated tokens sent under `tokens_per_minute`.
+
+    A 429 response halves the concurrency limit and pauses dispatching for the
+    Retry-After delay (or an exponential backoff); the limit grows back by one
+    after each round of successful batches. Other failures never pause
+    dispatching: a batch coalesced from several callers is split and retried
+    per caller, so one caller's bad input cannot fail another's texts; a
+    caller's own batch fails at once on a permanent 4xx error and is otherwise
+    retried after a backoff.
+
+    Texts still queued when the scheduler is closed, or when the interpreter
+    shuts down its thread pools, fail with a RuntimeError instead of blocking
+    their callers forever.
+
+    :param embed_batch: Function embedding one batch of texts, e.g. a model's `get_text_embedding_batch`.
+    :param batch_size: Texts per API request.
+    :param max_in_flight: Maximum concurrent API requests.
+    :param tokens_per_minute: Token budget per minute, 0 for none.
+    :param max_wait: Seconds a partial batch waits to be filled by other callers.
+    :param max_retries: Retries of a batch after a 429 or a failed request.
+    :param backoff: Seconds before the first retry, doubled on each further one.
+    :param count_tokens: Token estimate of a text.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        batch_size: int = 100,
+        max_in_flight: int = 4,
+        tokens_per_minute: int = 0,
+        max_wait: float = 0.02,
+        max_retries: int = 6,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        count_tokens: Callable[[str], int] = _estimate_tokens,
+    ):
+        self.embed_batch = embed_batch
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.count_tokens = count_tokens
+
+        self._pending = deque()
+        self._in_flight = 0
+        self._limit = max_in_flight
+        self._successes = 0  # successful batches since the limit last changed
+        self._paused_until = 0.0
+        self._sent = deque()  # (time, tokens) of dispatched batches, for the token budget
+        self._completed = deque()  # (time, texts) of completed batches, for throughput
+        self._totals = {"batches": 0, "texts": 0, "tokens": 0, "throttled": 0, "retries": 0, "errors": 0}
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="embed")
+        self._dispatcher = None
+        self._closed = False
+
+    def embed(self, texts: List[str], urgent: bool = False) -> List[List[float]]:
+        """
+        Embed texts through the shared queue, blocking until all of them are done.
+
+        :param urgent: Put the texts ahead of queued ingestion work and send them
+            without waiting for a full batch, e.g. for search queries.
+        """
+        if not texts:
+            return []
+        caller = object()
+        items = [_Item(text, self.count_tokens(text), urgent, caller) for text in texts]
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Embedding scheduler is closed")
+            if urgent:
+                self._pending.extendleft(reversed(items))
+            else:
+                self._pending.extend(items)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch_loop, name="embed-dispatch", daemon=True)
+                self._dispatcher.start()
+            self._cond.notify_all()
+        return [item.future.result() for item in items]
+
+    def _ready_timeout(self, now: float):
+        """None if a batch can be dispatched now, otherwise the seconds to wait (inf: until notified)."""
+        if not self._pending:
+            return float("inf")
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._in_flight >= self._limit:
+            return float("inf")  # woken when a batch completes
+        first = self._pending[0]
+        if first.urgent or first.isolated or len(self._pending) >= self.batch_size:
+            return None
+        deadline = first.enqueued_at + self.max_wait
+        return None if now >= deadline else deadline - now
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    timeout = self._ready_timeout(time.monotonic())
+                    if timeout is None:
+                        break
+                    self._cond.wait(None if timeout == float("inf") else timeout)
+                batch = self._take_batch()
+                self._in_flight += 1
+
+            self._reserve_tokens(sum(item.tokens for item in batch))
+            try:
+                self._executor.submit(self._send, batch)
+            except RuntimeError as e:
+                # The pool was shut down, e.g. at interpreter exit; nothing queued can be sent any more
+                with self._cond:
+                    self._in_flight -= 1
+                self._fail_all(batch, e)
+                return
+
+    def _take_batch(self) -> List[_Item]:
+        """Pop the next batch; split-off items are only batched with items of the same caller."""
+        first = self._pending[0]
+        batch = []
+        while self._pending and len(batch) < self.batch_size:
+            item = self._pending[0]
+            if (first.isolated or item.isolated) and item.caller is not first.caller:
+                break
+            batch.append(self._pending.popleft())
+        return batch
+
+    def _fail_all(self, batch: List[_Item], error: Exception):
+        with self._cond:
+            self._closed = True
+            items = batch + list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+        log_event("embed_closed", texts=len(items), error=str(error))
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(RuntimeError(f"Embedding scheduler stopped: {error}"))
+
+    def close(self):
+        """Fail all queued texts and stop accepting new ones; batches in flight complete."""
+        self._fail_all([], RuntimeError("closed"))
+        self._executor.shutdown(wait=False)
+
+    def _reserve_tokens(self, tokens: int):
+        """Record the tokens of a batch, first blocking until it fits in the budget of the last minute."""
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                while self._sent and self._sent[0][0] <= now - THROUGHPUT_WINDOW:
+                    self._sent.popleft()
+                used = sum(sent for _, sent in self._sent)
+                # A batch larger than the whole budget is sent alone once the window is empty
+                if self.tokens_per_minute <= 0 or used + tokens <= self.tokens_per_minute or not self._sent:
+                    self._sent.append((now, tokens))
+                    return
+                wait = self._sent[0][0] + THROUGHPUT_WINDOW - now
+            time.sleep(max(wait, 0.01))
+
+    def _send(self, batch: List[_Item]):
+        texts = [item.text for item in batch]
+        try:
+            vectors = self.embed_batch(texts)
+            if len(vectors) != len(texts):
+                # Zipping would leave the futures of the missing texts unresolved forever
+                raise ValueError(f"Embedding endpoint returned {len(vectors)} vectors for {len(texts)} texts")
+        except Exception as e:
+            self._failed(batch, e)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            self._in_flight -= 1
+            self._successes += 1
+            if self._limit < self.max_in_flight and self._successes >= self._limit:
+                self._limit += 1
+                self._successes = 0
+            self._completed.append((now, len(batch)))
+            self._totals["batches"] += 1
+            self._totals["texts"] += len(batch)
+            self._totals["tokens"] += sum(item.tokens for item in batch)
+            self._cond.notify_all()
+        count("embed_request", len(batch))
+
+        for item, vector in zip(batch, vectors):
+            item.future.set_result(vector)
+
+    def _failed(self, batch: List[_Item], error: Exception):
+        attempt = max(item.attempts for item in batch)
+        throttled = is_rate_limited(error)
+        callers = {item.caller for item in batch}
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+            if self._closed:
+                error = RuntimeError("Embedding scheduler is closed")
+            elif throttled and attempt < self.max_retries:
+                # The whole endpoint is throttled: slow every caller down
+                delay = retry_after(error)
+                if delay is None:
+                    delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._totals["throttled"] += 1
+                self._limit = max(1, self._limit // 2)
+                self._successes = 0
+                self._requeue(batch)
+                log_event(
+                    "embed_retry", texts=len(batch), attempt=attempt + 1, throttled=True,
+                    delay=round(delay, 3), limit=self._limit, error=str(error),
+                )
+                return
+            elif len(callers) > 1:
+                # Which caller's texts failed is unknown; retry each caller's texts on their own
+                for item in batch:
+                    item.isolated = True
+                self._requeue(batch)
+                log_event("embed_split", texts=len(batch), callers=len(callers), error=str(error))
+                return
+            elif attempt < self.max_retries and not throttled and not is_permanent(error):
+                delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+                self._totals["retries"] += 1
+                timer = threading.Timer(delay, self._requeue_later, args=(batch,))
+                timer.daemon = True
+                timer.start()
+                log_event(
+                    "embed_retry", texts=len(batch), attempt=attempt + 1, throttled=False,
+                    delay=round(delay, 3), limit=self._limit, error=str(error),
+                )
+                return
+            self._totals["errors"] += 1
+
+        log_event("embed_error", texts=len(batch), attempts=attempt + 1, error=str(error))
+        for item in batch:
+            item.future.set_exception(error)
+
+    def _requeue(self, batch: List[_Item]):
+        """Put a failed batch back at the front of the queue; the caller holds the condition."""
+        self._totals["retries"] += 1
+        for item in batch:
+            item.attempts += 1
+        self._pending.extendleft(reversed(batch))
+        self._cond.notify_all()
+
+    def _requeue_later(self, batch: List[_Item]):
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                for item in batch:
+                    item.attempts += 1
+                self._pending.extendleft(reversed(batch))
+                self._cond.notify_all()
+        if closed:
+            for item in batch:
+                item.future.set_exception(RuntimeError("Embedding scheduler is closed"))
+
+    def stats(self) -> dict:
+        """Queue depth, concurrency and throughput over the last minute."""
+        with self._cond:
+            now = time.monotonic()
+            while self._completed and self._completed[0][0] <= now - THROUGHPUT_WINDOW:
+                self._completed.popleft()
+            recent = sum(texts for _, texts in self._completed)
+            window = min(THROUGHPUT_WINDOW, now - self._completed[0][0]) if self._completed else 0.0
+            return {
+                "queue_depth": len(self._pending),
+                "in_flight": self._in_flight,
+                "concurrency_limit": self._limit,
+                "texts_per_second": recent / window if window > 0 else 0.0,
+                "tokens_last_minute": sum(tokens for sent_at, tokens in self._sent if sent_at > now - THROUGHPUT_WINDOW),
+                **self._totals,
+            }
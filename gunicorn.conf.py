@@ -0,0 +1,30 @@
+"""
+Pre-fork serving of the Flask app:
+
+    gunicorn -c gunicorn.conf.py
+
+The master imports the app once (cheap: no clients are created at import) and
+reads hot document files into the page cache; each worker then creates its
+own clients and opens the hot indexes before accepting requests. Memory-mapped
+page stores and vector stores are shared through the page cache.
+"""
+import os
+
+wsgi_app = "app:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))  # streamed answers wait on the LLM
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+preload_app = True
+
+
+def when_ready(server):
+    from app import warmup
+
+    warmup(prefetch_only=True)
+
+
+def post_worker_init(worker):
+    from app import warmup
+
+    warmup()
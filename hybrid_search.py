@@ -0,0 +1,157 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from llama_index.core import get_response_synthesizer
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from build_index import FILTER_METADATA_KEYS, get_chroma_index, get_llm, document_filters
+from keyword_search import load_keyword_store, bm25_search, load_chunk_map, chunk_containing
+from parse_document import POSITION_METADATA_KEYS, chunk_id
+from context_selection import merge_adjacent_nodes
+
+RRF_K = 60  # rank constant from the original reciprocal rank fusion paper
+
+# Shared pool so the keyword and vector retrievers of one request run side by side
+_retrieval_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieve")
+
+
+def _chunk_text(pages, span) -> str:
+    """Text of an indexed chunk, rebuilt from the page store the way `iter_chunks` joins pages."""
+    page_number, start, page_end, end = span
+    if page_number == page_end:
+        return pages.get_text(page_number)[start:end]
+    parts = []
+    for number in pages.page_numbers():
+        if page_number <= number <= page_end:
+            text = pages.get_text(number)
+            if number == page_number:
+                text = text[start:]
+            elif number == page_end:
+                text = text[:end]
+            if text:
+                parts.append(text)
+    return " ".join(parts)
+
+
+def keyword_nodes(document_hash: str, query: str, top_k: int = 10, window: int = 1000) -> List[NodeWithScore]:
+    """
+    BM25 keyword retrieval returned as nodes, one per matching page.
+
+    Each node is the indexed chunk holding most of the page's hits, with the
+    same id as in the vector store, so RRF adds up the scores of chunks found
+    by both retrievers. Documents without a chunk map get a `window`-character
+    passage centered on the first hit of the page instead.
+    """
+    pages, index = load_keyword_store(document_hash)
+    results = bm25_search(index, query, top_k=top_k)
+    if not results:
+        return []
+
+    chunk_map = load_chunk_map(document_hash)
+    if chunk_map is not None:
+        return _chunk_nodes(document_hash, pages, chunk_map, results)
+
+    nodes = []
+    for page_number, score, spans in results:
+        text = pages.get_text(page_number)
+        hit_start, hit_end = spans[0]
+        start = max(0, (hit_start + hit_end) // 2 - window // 2)
+        end = min(len(text), start + window)
+        start = max(0, end - window)
+        node = TextNode(
+            id_=f"{document_hash}:keyword:{page_number}:{start}",
+            text=text[start:end],
+            metadata={"document_hash": document_hash, "page_number": page_number, "start_char": start, "end_char": end},
+            excluded_embed_metadata_keys=["document_hash", "start_char", "end_char"],
+            excluded_llm_metadata_keys=["document_hash", "start_char", "end_char"],
+        )
+        nodes.append(NodeWithScore(node=node, score=score))
+    return nodes
+
+
+def _chunk_nodes(document_hash: str, pages, chunk_map, results) -> List[NodeWithScore]:
+    hidden = POSITION_METADATA_KEYS + FILTER_METADATA_KEYS
+    nodes = {}
+    for page_number, score, spans in results:
+        hits = {}
+        for hit_start, _ in spans:
+            span = chunk_containing(chunk_map["chunks"], page_number, hit_start)
+            if span is not None:
+                hits[tuple(span)] = hits.get(tuple(span), 0) + 1
+        if not hits:
+            continue
+
+        span = max(hits, key=hits.get)
+        position = dict(zip(("page_number", "start_char", "page_end", "end_char"), span))
+        node_id = chunk_id(document_hash, position)
+        if node_id in nodes:
+            continue  # a chunk spanning pages matched on an earlier, better-ranked page
+        metadata = dict(position, document_hash=document_hash)
+        if chunk_map.get("source"):
+            metadata["source"] = chunk_map["source"]
+        node = TextNode(
+            id_=node_id,
+            text=_chunk_text(pages, span),
+            metadata=metadata,
+            excluded_embed_metadata_keys=list(hidden),
+            excluded_llm_metadata_keys=list(hidden),
+        )
+        nodes[node_id] = NodeWithScore(node=node, score=score)
+    return list(nodes.values())
+
+
+def vector_nodes(document_hash: str, query: str, top_k: int = 10) -> List[NodeWithScore]:
+    """Vector similarity retrieval from the document's Chroma index."""
+    index = get_chroma_index(document_hash)
+    if index is None:
+        return []
+    return index.as_retriever(similarity_top_k=top_k, filters=document_filters(document_hash)).retrieve(query)
+
+
+def reciprocal_rank_fusion(result_lists: List[List[NodeWithScore]], top_k: int = 5, k: int = RRF_K) -> List[NodeWithScore]:
+    """
+    Merge ranked node lists with reciprocal rank fusion: score = sum of 1 / (k + rank).
+
+    :param result_lists: Ranked lists, best first.
+    :param top_k: Number of fused nodes to return.
+    :param k: Rank constant damping the weight of top ranks.
+    """
+    scores = {}
+    nodes = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            node_id = result.node.node_id
+            scores[node_id] = scores.get(node_id, 0.0) + 1.0 / (k + rank)
+            nodes.setdefault(node_id, result.node)
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    return [NodeWithScore(node=nodes[node_id], score=score) for node_id, score in ranked]
+
+
+def hybrid_retrieve(document_hash: str, query: str, top_k: int = 5, candidates: int = 20) -> List[NodeWithScore]:
+    """
+    Run keyword and vector retrieval concurrently and fuse them with RRF.
+
+    :param candidates: Number of results taken from each retriever before fusion.
+    """
+    # copy_context keeps the request id in the worker threads' log lines
+    keyword_future = _retrieval_executor.submit(
+        contextvars.copy_context().run, keyword_nodes, document_hash, query, candidates
+    )
+    vector_future = _retrieval_executor.submit(
+        contextvars.copy_context().run, vector_nodes, document_hash, query, candidates
+    )
+    return reciprocal_rank_fusion([vector_future.result(), keyword_future.result()], top_k=top_k)
+
+
+def hybrid_query(document_hash: str, query: str, top_k: int = 5):
+    """
+    Answer a query from the fused top-k chunks.
+
+    :return: A streaming response; iterate `response_gen` for the answer.
+    """
+    # Keyword passages often overlap the vector chunks they were fused with
+    nodes = merge_adjacent_nodes(hybrid_retrieve(document_hash, query, top_k=top_k))
+    synthesizer = get_response_synthesizer(llm=get_llm(), streaming=True)
+    return synthesizer.synthesize(query, nodes=nodes)
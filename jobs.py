@@ -0,0 +1,151 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+from metrics import request_id_var
+
+INGESTION_STAGES = ["parse", "embed", "index", "keyword_store"]
+STRATEGY_STAGES = ["strategies"]
+
+
+class QueueFullError(Exception):
+    """Raised when the ingestion queue already holds its maximum number of jobs."""
+
+
+class Job:
+    """
+    State of one ingestion job, updated by the worker through `report`.
+    """
+
+    def __init__(self, document_hash: str, file_path: str, stages=INGESTION_STAGES, key: str = None):
+        self.id = uuid.uuid4().hex
+        self.key = key or document_hash
+        self.document_hash = document_hash
+        self.file_path = file_path
+        self.status = "queued"
+        self.stage = None
+        self.stages = {stage: {"status": "pending", "progress": 0.0} for stage in stages}
+        self.error = None
+        self.attempts = 0
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self._lock = threading.Lock()
+
+    def report(self, stage: str, progress: float):
+        """
+        Progress callback passed to the ingestion pipeline.
+
+        :param stage: One of INGESTION_STAGES.
+        :param progress: Fraction of the stage completed, 1.0 marks it done.
+        """
+        with self._lock:
+            self.stage = stage
+            state = self.stages.setdefault(stage, {"status": "pending", "progress": 0.0})
+            state["progress"] = min(max(progress, 0.0), 1.0)
+            state["status"] = "done" if progress >= 1.0 else "running"
+            self.updated_at = time.time()
+
+    def _set_status(self, status: str, error: str = None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.updated_at = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "document_hash": self.document_hash,
+                "status": self.status,
+                "stage": self.stage,
+                "stages": {stage: dict(state) for stage, state in self.stages.items()},
+                "error": self.error,
+                "attempts": self.attempts,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+            }
+
+
+class JobQueue:
+    """
+    Bounded worker pool running ingestion jobs, with single-flight per job key
+    (the document hash unless given).
+
+    :param max_workers: Number of jobs processed concurrently.
+    :param max_pending: Maximum number of queued or running jobs before submissions are rejected.
+    :param history_size: Number of jobs kept for status lookups.
+    :param max_attempts: Attempts per job; retries resume from the document's ingestion manifest.
+    :param retry_backoff: Seconds before the first retry, doubled on each further one.
+    """
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 16, history_size: int = 1000,
+                 max_attempts: int = 1, retry_backoff: float = 2.0):
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self._jobs = LRUCache(maxsize=history_size)
+        self._active = {}  # job key -> Job
+        self._lock = threading.Lock()
+
+    def submit(self, document_hash: str, file_path: str, worker, *args, stages=INGESTION_STAGES, key: str = None,
+               **kwargs):
+        """
+        Queue `worker(*args, progress=job.report, **kwargs)` for a document.
+
+        If a job with the same key is already queued or running, that job is
+        returned instead of starting a new one.
+
+        :param stages: Stages reported by the worker, listed as pending until it reaches them.
+        :param key: Single-flight key, the document hash by default; jobs of one
+            document doing different work (e.g. building a strategy) use their own key.
+
+        :return: A tuple of (job, created).
+        """
+        key = key or document_hash
+        with self._lock:
+            job = self._active.get(key)
+            if job is not None:
+                return job, False
+
+            if len(self._active) >= self.max_pending:
+                raise QueueFullError(f"Ingestion queue is full ({self.max_pending} jobs)")
+
+            job = Job(document_hash, file_path, stages, key=key)
+            self._active[key] = job
+            self._jobs.set(job.id, job)
+
+        self._executor.submit(self._run, job, worker, args, kwargs)
+        return job, True
+
+    def _run(self, job: Job, worker, args, kwargs):
+        request_id_var.set(job.id)  # logs of the job carry its id
+        try:
+            for attempt in range(1, self.max_attempts + 1):
+                job.attempts = attempt
+                job._set_status("running")
+                try:
+                    worker(*args, progress=job.report, **kwargs)
+                    job._set_status("succeeded")
+                    return
+                except Exception as e:
+                    traceback.print_exc()
+                    if attempt == self.max_attempts:
+                        job._set_status("failed", error=str(e))
+                        return
+                    job._set_status("retrying", error=str(e))
+                    time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+        finally:
+            with self._lock:
+                self._active.pop(job.key, None)
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def active_job(self, key: str):
+        """Queued or running job of a key (a document hash for ingestion), or None."""
+        with self._lock:
+            return self._active.get(key)
@@ -1,9 +1,21 @@
 import os
 import re
-from typing import List, Dict
-from PyPDF2 import PdfReader
+import math
+import heapq
+import bisect
+import itertools
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
 import json
-from bs4 import BeautifulSoup
+from parse_document import extract_pdf_pages, extract_html_pages
+from page_store import PageStore, open_page_store
+
+TOKEN_PATTERN = re.compile(r"\w+")
+QUERY_PATTERN = re.compile(r'"([^"]+)"|(\S+)')
+INDEX_VERSION = 1
+
+
 def save_chunk_text(pdf_text: List[Dict], save_path: str):
     """
     Saves extracted PDF text to a JSON file.
@@ -39,58 +51,469 @@ def parse_pdf_for_keyword_search(file_path: str) -> List[Dict]:
     :param file_path: Path to the PDF file.
     :return: A list of dictionaries, each containing page number and extracted text.
     """
-    if not os.path.isfile(file_path):
-        raise FileNotFoundError(f"PDF file not found: {file_path}")
+    return extract_pdf_pages(file_path)
 
-    reader = PdfReader(file_path)
-    pdf_text = []
+def parse_html_for_keyword_search(file_path: str) -> List[Dict]:
+    """
+    Extracts visible text from an HTML file as a single page.
 
-    for page_index, page in enumerate(reader.pages):
-        raw_text = page.extract_text() or ""  # Handle blank pages
-        cleaned_text = re.sub(r'\s+', ' ', raw_text.strip())  # Normalize spaces
+    :param file_path: Path to the HTML file.
+    :return: A list with one dictionary containing page number and extracted text.
+    """
+    return extract_html_pages(file_path)
 
-        if cleaned_text:
-            pdf_text.append({"page_number": page_index + 1, "text": cleaned_text})
 
-    return pdf_text
+def keyword_search(pdf_text: List[Dict], keyword: str, context_window: int = 50):
+    """
+    Perform a keyword search in the parsed PDF text.
 
-def parse_html_for_keyword_search(file_path: str) -> List[Dict]:
-    if not os.path.isfile(file_path):
-        raise FileNotFoundError(f"HTML file not found: {file_path}")
+    Every term of `keyword` (quoted text as one phrase) is matched literally and
+    case-insensitively in a single pass per page.
+
+    :param pdf_text: List of dictionaries containing page-wise text.
+    :param keyword: The keywords to search for.
+    :param context_window: Number of characters before and after the keyword to include in the snippet.
+    :return: A generator of text snippets, one per group of nearby matches.
+    """
+    for record in keyword_search_records(pdf_text, keyword, context_window):
+        yield f"📄 Page {record['page_number']}\n\n{record['snippet'].strip()}\n\n"
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        html_content = f.read()
 
-    # Use BeautifulSoup to parse the HTML and extract text
-    soup = BeautifulSoup(html_content, "html.parser")
-    plain_text = soup.get_text(separator="\n")  # This strips out HTML tags
+class MultiPatternMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of literal patterns.
 
-    return [{"page_number": 1, "text": plain_text}]
+    Built once per query; `finditer` reports every occurrence of every pattern
+    in time linear in the text length, with no regex backtracking.
+    Matching is case-insensitive.
 
+    :param patterns: Literal patterns to find.
+    :param whole_words: Drop occurrences that start or end inside a word, e.g.
+        "id" in "bandwidth"; pattern ends that are not word characters are not checked.
+    """
 
-def keyword_search(pdf_text: List[Dict], keyword: str, context_window: int = 50):
+    def __init__(self, patterns: List[str], whole_words: bool = False):
+        self.patterns = [pattern for pattern in dict.fromkeys(p.lower() for p in patterns) if pattern]
+        self.whole_words = whole_words
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for pattern_id, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = next_state
+            self._out[state].append(pattern_id)
+
+        # Failure links in breadth-first order, outputs inherited along them
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def finditer(self, text: str):
+        """
+        Yield (start, end, pattern_id) for every occurrence, ordered by end offset.
+        Offsets index into `text`.
+        """
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # A few characters lowercase to several; keep offsets aligned
+            lowered = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        whole_words = self.whole_words
+        state = 0
+        for i, char in enumerate(lowered):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in out[state]:
+                start = i + 1 - len(patterns[pattern_id])
+                if whole_words and not _on_word_boundaries(text, start, i + 1):
+                    continue
+                yield start, i + 1, pattern_id
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _on_word_boundaries(text: str, start: int, end: int) -> bool:
+    """True unless text[start:end] begins or ends in the middle of a word."""
+    if start > 0 and _is_word_char(text[start]) and _is_word_char(text[start - 1]):
+        return False
+    if end < len(text) and _is_word_char(text[end - 1]) and _is_word_char(text[end]):
+        return False
+    return True
+
+
+def query_patterns(query: str) -> List[str]:
+    """Literal patterns of a query: each quoted phrase and each other whitespace-separated word."""
+    return [" ".join((quoted or bare).split()) for quoted, bare in QUERY_PATTERN.findall(query)]
+
+
+def keyword_search_records(pages: Iterable[Dict], query: str, context_window: int = 50, whole_words: bool = False):
+    """
+    Find all query terms in page order and group nearby hits into snippet records.
+
+    Pages are read lazily, so a consumer that stops early never decodes the rest.
+
+    :param pages: Page records or a `PageStore`.
+    :param query: Raw user query, quoted text is matched as a phrase.
+    :param context_window: Number of characters before and after the hits to include in the snippet.
+    :param whole_words: Only report hits that start and end on word boundaries.
+    :return: A generator of {"page_number", "start", "end", "snippet", "highlights", "terms"};
+        `start`/`end` are page offsets of the snippet, highlights are [start, end] within the snippet.
     """
-    Perform a simple keyword search in the parsed PDF text.
+    matcher = MultiPatternMatcher(query_patterns(query), whole_words=whole_words)
+    if not matcher:
+        return
+
+    for entry in pages:
+        text = entry["text"]
+        matches = sorted(matcher.finditer(text))
+        if not matches:
+            continue
+
+        # Union of overlapping hits becomes one highlight
+        spans = []
+        for start, end, pattern_id in matches:
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+                spans[-1][2].add(pattern_id)
+            else:
+                spans.append([start, end, {pattern_id}])
+
+        # Hits whose context windows touch share one snippet
+        group = []
+        for span in spans + [None]:
+            if span is not None and (not group or span[0] - context_window <= group[-1][1] + context_window):
+                group.append(span)
+                continue
+
+            snippet_start = max(0, group[0][0] - context_window)
+            snippet_end = min(len(text), group[-1][1] + context_window)
+            yield {
+                "page_number": entry["page_number"],
+                "start": snippet_start,
+                "end": snippet_end,
+                "snippet": text[snippet_start:snippet_end],
+                "highlights": [[start - snippet_start, end - snippet_start] for start, end, _ in group],
+                "terms": sorted({matcher.patterns[p] for _, _, ids in group for p in ids}),
+            }
+            group = [span]
+
+
+def paginated_keyword_search(pages: Iterable[Dict], query: str, page: int = 1, page_size: int = 20,
+                             context_window: int = 50, whole_words: bool = False):
+    """
+    One page of keyword search records as NDJSON lines, followed by a summary line.
+
+    The scan stops as soon as the requested page is full (plus one record to
+    know whether another page exists).
+
+    :param page: 1-based result page.
+    :param page_size: Records per result page.
+    :param whole_words: Only report hits that start and end on word boundaries.
+    :return: A generator of JSON lines; records have "type": "match", the last line "type": "page".
+    """
+    page = max(page, 1)
+    page_size = max(page_size, 1)
+    skip = (page - 1) * page_size
+    records = itertools.islice(keyword_search_records(pages, query, context_window, whole_words), skip, skip + page_size + 1)
+
+    returned = 0
+    has_more = False
+    for record in records:
+        if returned == page_size:
+            has_more = True
+            break
+        returned += 1
+        yield json.dumps({"type": "match", **record}, ensure_ascii=False) + "\n"
+
+    yield json.dumps({
+        "type": "page", "page": page, "page_size": page_size, "returned": returned, "has_more": has_more,
+    }) + "\n"
+
+
+def keyword_index_path(document_hash: str, upload_dir: str = "uploads") -> str:
+    """Path of the inverted index saved next to `uploads/<hash>.json`."""
+    return os.path.join(upload_dir, f"{document_hash}.index.json")
+
+
+def tokenize(text: str):
+    """
+    Yield (term, char_offset) pairs for every word in `text`.
+
+    Terms are lowercased, offsets point into the original text so they can
+    be used directly to cut snippets.
+    """
+    for match in TOKEN_PATTERN.finditer(text):
+        yield match.group().lower(), match.start()
+
+
+def build_keyword_index(pdf_text: List[Dict]) -> Dict:
+    """
+    Build a positional inverted index over page-wise text.
+
+    Postings map term -> page number -> flat list of (token position, char offset)
+    pairs, so both phrase matching and snippet extraction can be answered
+    without rescanning the page text.
 
     :param pdf_text: List of dictionaries containing page-wise text.
-    :param keyword: The keyword to search for.
-    :param context_window: Number of characters before and after the keyword to include in the snippet.
-    :return: A list of matches, each containing page number and text snippet.
+    :return: The index as a JSON-serializable dictionary.
     """
-    keyword_lower = keyword.lower()
-    results = []
+    postings = {}
+    page_lengths = {}
 
     for entry in pdf_text:
-        page_number = entry["page_number"]
-        text = entry["text"]
-        text_lower = text.lower()
+        page_key = str(entry["page_number"])
+        length = 0
+        for position, (term, offset) in enumerate(tokenize(entry["text"])):
+            postings.setdefault(term, {}).setdefault(page_key, []).extend((position, offset))
+            length = position + 1
+        page_lengths[page_key] = length
+
+    page_count = len(page_lengths)
+    avg_page_length = sum(page_lengths.values()) / page_count if page_count else 0.0
+
+    return {
+        "version": INDEX_VERSION,
+        "page_count": page_count,
+        "avg_page_length": avg_page_length,
+        "page_lengths": page_lengths,
+        "postings": postings,
+    }
+
+
+def save_keyword_index(index: Dict, save_path: str):
+    """
+    Saves a keyword index to a compact JSON file.
+
+    :param index: Index produced by `build_keyword_index`.
+    :param save_path: Path to save the JSON file.
+    """
+    with open(save_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+
+    print(f"Keyword index saved to {save_path}")
+
+
+@lru_cache(maxsize=32)
+def _load_keyword_index_cached(save_path: str, mtime: float) -> Dict:
+    with open(save_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_keyword_index(save_path: str) -> Dict:
+    """
+    Loads a keyword index, reusing the parsed copy while the file is unchanged.
+
+    :param save_path: Path to the saved index file.
+    :return: The index dictionary.
+    """
+    if not os.path.isfile(save_path):
+        raise FileNotFoundError(f"Keyword index not found: {save_path}")
+
+    return _load_keyword_index_cached(save_path, os.path.getmtime(save_path))
+
+
+def chunk_map_path(document_hash: str, upload_dir: str = "uploads") -> str:
+    """Path of the chunk span table saved next to the keyword index."""
+    return os.path.join(upload_dir, f"{document_hash}.chunks.json")
+
+
+def save_chunk_map(chunks: Iterable[Dict], save_path: str, source: str = None):
+    """
+    Save the positions of the indexed chunks, so keyword hits can be mapped to chunk ids.
+
+    :param chunks: Chunk records with "page_number", "start_char", "page_end" and "end_char".
+    :param save_path: Path to save the JSON file.
+    :param source: Path of the original file, the "source" metadata of the chunks.
+    """
+    spans = sorted([chunk["page_number"], chunk["start_char"], chunk["page_end"], chunk["end_char"]] for chunk in chunks)
+    with open(save_path, "w", encoding="utf-8") as f:
+        json.dump({"source": source, "chunks": spans}, f, separators=(",", ":"))
+
+
+def load_chunk_map(document_hash: str, upload_dir: str = "uploads"):
+    """
+    Chunk span table of a document, or None for documents ingested before it existed.
+
+    :return: {"source": path, "chunks": [[page_number, start_char, page_end, end_char], ...]} sorted by start.
+    """
+    path = chunk_map_path(document_hash, upload_dir)
+    if not os.path.isfile(path):
+        return None
+    return _load_chunk_map_cached(path, os.path.getmtime(path))
+
+
+@lru_cache(maxsize=32)
+def _load_chunk_map_cached(path: str, mtime: float) -> Dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def chunk_containing(spans: List[List[int]], page_number: int, start: int):
+    """
+    Span of the chunk holding the character at (`page_number`, `start`), or None.
+
+    Of overlapping chunks the one starting last is returned; chunks are
+    consecutive, so no earlier chunk ends later.
+    """
+    i = bisect.bisect_right(spans, [page_number, start, math.inf, math.inf]) - 1
+    if i < 0 or (spans[i][2], spans[i][3]) <= (page_number, start):
+        return None
+    return spans[i]
+
+
+def load_keyword_store(document_hash: str, upload_dir: str = "uploads"):
+    """
+    Open the page store and inverted index of a document.
+    Documents uploaded before the index existed get one built and saved here.
+
+    :return: A tuple of (`PageStore`, index).
+    """
+    pages = open_page_store(document_hash, upload_dir)
+    index_path = keyword_index_path(document_hash, upload_dir)
+    if not os.path.isfile(index_path):
+        save_keyword_index(build_keyword_index(pages), index_path)
+    return pages, load_keyword_index(index_path)
+
+
+def parse_query(query: str) -> List[List[str]]:
+    """
+    Split a query into phrases, each a list of terms.
+
+    Quoted text becomes one phrase; every other whitespace-separated word is
+    its own phrase (so `DeepSeek-V3` still has to match as `deepseek v3`).
+    """
+    phrases = []
+    for quoted, bare in QUERY_PATTERN.findall(query):
+        terms = [term for term, _ in tokenize(quoted or bare)]
+        if terms:
+            phrases.append(terms)
+    return phrases
+
+
+def _phrase_matches(index: Dict, terms: List[str]) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Find every occurrence of a phrase using the positional postings.
+
+    :return: page key -> list of (start offset, end offset) of each occurrence.
+    """
+    postings = index["postings"]
+    term_postings = [postings.get(term) for term in terms]
+    if not all(term_postings):
+        return {}
+
+    # Intersect on the rarest term's pages first
+    pages = set(min(term_postings, key=len))
+    for page_postings in term_postings:
+        pages.intersection_update(page_postings)
 
-        if keyword_lower in text_lower:
-            match_positions = [m.start() for m in re.finditer(keyword_lower, text_lower)]
+    matches = {}
+    for page_key in pages:
+        first = term_postings[0][page_key]
+        rest = []
+        for page_postings in term_postings[1:]:
+            flat = page_postings[page_key]
+            rest.append(dict(zip(flat[0::2], flat[1::2])))
 
+        spans = []
+        for position, offset in zip(first[0::2], first[1::2]):
+            end = offset + len(terms[0])
+            for i, positions in enumerate(rest, start=1):
+                next_offset = positions.get(position + i)
+                if next_offset is None:
+                    break
+                end = next_offset + len(terms[i])
+            else:
+                spans.append((offset, end))
+
+        if spans:
+            matches[page_key] = spans
+
+    return matches
+
+
+def bm25_search(index: Dict, query: str, top_k: int = 10, k1: float = 1.2, b: float = 0.75):
+    """
+    Rank pages for a query with BM25 using only the postings of the query terms.
+
+    Pages matching any of the query phrases are candidates; each phrase
+    contributes its own BM25 term score.
+
+    :param index: Index produced by `build_keyword_index`.
+    :param query: Raw user query, quoted text is matched as a phrase.
+    :param top_k: Maximum number of pages to return.
+    :return: A list of (page number, score, sorted match spans), best first.
+    """
+    page_count = index["page_count"]
+    avg_page_length = index["avg_page_length"] or 1.0
+    page_lengths = index["page_lengths"]
+
+    scores = {}
+    spans = {}
+    for terms in parse_query(query):
+        matches = _phrase_matches(index, terms)
+        if not matches:
+            continue
+
+        df = len(matches)
+        idf = math.log(1 + (page_count - df + 0.5) / (df + 0.5))
+        for page_key, page_spans in matches.items():
+            tf = len(page_spans)
+            norm = k1 * (1 - b + b * page_lengths[page_key] / avg_page_length)
+            scores[page_key] = scores.get(page_key, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+            spans.setdefault(page_key, []).extend(page_spans)
+
+    ranked = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+    return [(int(page_key), score, sorted(spans[page_key])) for page_key, score in ranked]
+
+
+def ranked_keyword_search(
+    index: Dict,
+    pages: PageStore,
+    query: str,
+    top_k: int = 10,
+    context_window: int = 50,
+    max_snippets_per_page: int = 3,
+):
+    """
+    Keyword search answered from the inverted index, best pages first.
+
+    :param index: Index produced by `build_keyword_index`.
+    :param pages: Page store of the document; only pages with hits are decoded.
+    :param query: Raw user query, quoted text is matched as a phrase.
+    :param top_k: Maximum number of pages to return.
+    :param context_window: Number of characters before and after each hit to include in the snippet.
+    :param max_snippets_per_page: Maximum number of snippets yielded per page.
+    :return: A generator of formatted snippets.
+    """
+    results = bm25_search(index, query, top_k=top_k)
+    if not results:
+        return
 
-            for pos in match_positions:
-                start = max(0, pos - context_window)
-                end = min(len(text), pos + len(keyword) + context_window)
-                snippet = text[start:end]
-                yield f"📄 Page {page_number}\n\n{snippet.strip()}\n\n"
\ No newline at end of file
+    for page_number, score, page_spans in results:
+        text = pages.get_text(page_number)
+        for start, end in page_spans[:max_snippets_per_page]:
+            snippet = text[max(0, start - context_window):min(len(text), end + context_window)]
+            yield f"📄 Page {page_number}\n\n{snippet.strip()}\n\n"
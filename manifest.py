@@ -0,0 +1,87 @@
+import json
+import os
+import threading
+import time
+from typing import Iterable, List
+
+
+class IngestionManifest:
+    """
+    Record of which chunks of a document are expected and which have been
+    embedded and written to the vector store.
+
+    A document is ready only once every expected chunk id has been written.
+    Saved as `<directory>/<document_hash>.json` after every update, so an
+    interrupted ingestion can resume with the missing chunks only.
+    """
+
+    def __init__(self, path: str, document_hash: str, expected_ids: List[str], written_ids=(), params=None):
+        self.path = path
+        self.document_hash = document_hash
+        self.expected_ids = list(expected_ids)
+        self.written_ids = set(written_ids)
+        self.params = params or {}
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def path_for(directory: str, document_hash: str) -> str:
+        return os.path.join(directory, f"{document_hash}.json")
+
+    @classmethod
+    def load(cls, directory: str, document_hash: str):
+        """Load the manifest of a document, or None if there is none."""
+        path = cls.path_for(directory, document_hash)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        manifest = cls(path, document_hash, data["expected_ids"], data["written_ids"], data.get("params"))
+        manifest.updated_at = data.get("updated_at", manifest.updated_at)
+        return manifest
+
+    @property
+    def is_complete(self) -> bool:
+        return len(self.missing_ids()) == 0
+
+    def missing_ids(self) -> List[str]:
+        return [chunk_id for chunk_id in self.expected_ids if chunk_id not in self.written_ids]
+
+    def stale_ids(self, expected_ids: Iterable[str]) -> List[str]:
+        """Written ids that are not part of a new expected set (e.g. after chunking settings changed)."""
+        expected = set(expected_ids)
+        return [chunk_id for chunk_id in self.written_ids if chunk_id not in expected]
+
+    def mark_written(self, ids: Iterable[str]):
+        with self._lock:
+            self.written_ids.update(ids)
+            self.save()
+
+    def save(self):
+        self.updated_at = time.time()
+        data = {
+            "document_hash": self.document_hash,
+            "params": self.params,
+            "expected_ids": self.expected_ids,
+            "written_ids": sorted(self.written_ids),
+            "complete": len(self.missing_ids()) == 0,
+            "updated_at": self.updated_at,
+        }
+        # Written aside and renamed, so a crash mid-write leaves the previous manifest intact
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def progress(self) -> float:
+        if not self.expected_ids:
+            return 1.0
+        return len(self.written_ids & set(self.expected_ids)) / len(self.expected_ids)
@@ -0,0 +1,214 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Request id of the current request or job, included in every structured log line
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+logger = logging.getLogger("rag")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def log_event(event: str, **fields):
+    """Write one JSON log line carrying the current request id."""
+    record = {"ts": round(time.time(), 3), "event": event, "request_id": request_id_var.get()}
+    record.update(fields)
+    logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state["counts"][index] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def _render_samples(self, items):
+        lines = []
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {state['count']}")
+            plain = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{plain} {state['sum']}")
+            lines.append(f"{self.name}_count{plain} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds", "Duration of ingestion and query pipeline stages.", ["stage"]
+)
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stages that raised an exception.", ["stage"])
+STAGE_ITEMS = Counter("rag_stage_items_total", "Items (pages, chunks, texts) processed per stage.", ["stage"])
+HTTP_REQUESTS = Counter("rag_http_requests_total", "HTTP requests by endpoint and status.", ["endpoint", "status"])
+HTTP_SECONDS = Histogram(
+    "rag_http_request_duration_seconds", "Time until the response headers were ready.", ["endpoint"]
+)
+CACHE_STATS = Gauge("rag_cache", "Cache sizes and hit/miss counters.", ["cache", "field"])
+
+
+def render_metrics() -> str:
+    """All registered metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(stage: str, **fields):
+    """
+    Time a pipeline stage into `rag_stage_duration_seconds` and log it.
+
+    Extra keyword fields are added to the log line.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        log_event("stage_error", stage=stage, seconds=time.perf_counter() - start, **fields)
+        raise
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, stage=stage)
+    log_event("stage", stage=stage, seconds=round(elapsed, 6), **fields)
+
+
+def count(stage: str, items: int):
+    STAGE_ITEMS.inc(items, stage=stage)
+
+
+def traced_stream(stream, stage: str, start: float = None):
+    """
+    Pass a streamed response through, recording `<stage>_first_chunk` and `<stage>_total`.
+
+    :param start: perf_counter value the timings are measured from, defaults to the first iteration.
+    """
+    start = time.perf_counter() if start is None else start
+    chunks = 0
+    try:
+        for chunk in stream:
+            if chunks == 0:
+                elapsed = time.perf_counter() - start
+                STAGE_SECONDS.observe(elapsed, stage=f"{stage}_first_chunk")
+                log_event("stage", stage=f"{stage}_first_chunk", seconds=round(elapsed, 6))
+            chunks += 1
+            yield chunk
+    except Exception:
+        STAGE_ERRORS.inc(stage=f"{stage}_total")
+        raise
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, stage=f"{stage}_total")
+    log_event("stage", stage=f"{stage}_total", seconds=round(elapsed, 6), chunks=chunks)
+
+
+async def atraced_stream(stream, stage: str, start: float = None):
+    """Async version of `traced_stream` for async generators."""
+    start = time.perf_counter() if start is None else start
+    chunks = 0
+    try:
+        async for chunk in stream:
+            if chunks == 0:
+                elapsed = time.perf_counter() - start
+                STAGE_SECONDS.observe(elapsed, stage=f"{stage}_first_chunk")
+                log_event("stage", stage=f"{stage}_first_chunk", seconds=round(elapsed, 6))
+            chunks += 1
+            yield chunk
+    except Exception:
+        STAGE_ERRORS.inc(stage=f"{stage}_total")
+        raise
+    elapsed = time.perf_counter() - start
+    STAGE_SECONDS.observe(elapsed, stage=f"{stage}_total")
+    log_event("stage", stage=f"{stage}_total", seconds=round(elapsed, 6), chunks=chunks)
+
+
+def set_cache_stats(stats: dict):
+    """Publish nested `{cache: {field: number}}` stats as gauges."""
+    for cache, fields in stats.items():
+        for field, value in fields.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                CACHE_STATS.set(value, cache=cache, field=field)
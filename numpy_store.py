@@ -0,0 +1,381 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not POSIX
+    fcntl = None
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore, FilterCondition, FilterOperator, MetadataFilters,
+    VectorStoreQuery, VectorStoreQueryResult,
+)
+from llama_index.core.vector_stores.utils import metadata_dict_to_node, node_to_metadata_dict
+
+NUMPY_DTYPES = ("float32", "float16", "int8")
+SCORE_BLOCK_ROWS = 4096  # rows dequantized at a time while scoring
+
+# One lock per store directory, shared by every instance in the process
+_path_locks = {}
+_path_locks_lock = threading.Lock()
+
+
+def _path_lock(path):
+    with _path_locks_lock:
+        return _path_locks.setdefault(os.path.abspath(path), threading.RLock())
+
+
+def quantize(vectors: np.ndarray, dtype: str):
+    """
+    L2-normalize rows and store them as `dtype`.
+
+    int8 rows are scaled so their largest component maps to 127; the per-row
+    scale restores cosine similarity: `sim = (row . q) * scale`.
+
+    :return: A tuple of (rows, float32 scales).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit = vectors / norms
+    if dtype == "int8":
+        peaks = np.abs(unit).max(axis=1, keepdims=True)
+        peaks[peaks == 0] = 1.0
+        rows = np.rint(unit / peaks * 127).astype(np.int8)
+        return rows, (peaks[:, 0] / 127).astype(np.float32)
+    return unit.astype(dtype), np.ones(len(unit), dtype=np.float32)
+
+
+class _Snapshot:
+    """
+    Rows visible to one read, captured together under the store lock.
+
+    Writers only append, so the arrays and the first `rows` records never change
+    afterwards; a read working from one snapshot can't mix rows of two refreshes.
+    """
+
+    def __init__(self, rows: int, matrix, scales, active: np.ndarray, records: List[dict]):
+        self.rows = rows
+        self.matrix = matrix
+        self.scales = scales
+        self.active = active
+        self.records = records  # shared, append-only; only the first `rows` belong to the snapshot
+        self._columns = {}  # metadata key -> values per row, for filters
+
+    def column(self, key):
+        column = self._columns.get(key)
+        if column is None:
+            column = np.array([self.records[row]["metadata"].get(key) for row in range(self.rows)], dtype=object)
+            self._columns[key] = column
+        return column
+
+    def ids(self):
+        column = self._columns.get("__id__")
+        if column is None:
+            column = np.array([self.records[row]["id"] for row in range(self.rows)], dtype=object)
+            self._columns["__id__"] = column
+        return column
+
+    def vector(self, row: int) -> List[float]:
+        """Unit vector of a row, dequantized."""
+        return (self.matrix[row].astype(np.float32) * self.scales[row]).tolist()
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """
+    Exact-search vector store keeping one collection in a memory-mapped matrix.
+
+    Files in `path`, all append-only so a partial write never corrupts earlier rows:
+
+    - `meta.json`: dimension and row dtype
+    - `vectors.bin`: L2-normalized rows in float32, float16 or int8
+    - `scales.bin`: one float32 scale per row (1.0 unless int8)
+    - `records.jsonl`: id, text and llama-index metadata per row; a row exists once its line is written
+    - `tombstones.jsonl`: deleted ids with the row count at deletion time
+
+    Rows are memory-mapped read-only, so worker processes share the page cache.
+    Writers in different processes are serialized with `fcntl.flock`; without
+    fcntl (Windows) only writers within one process are.
+    A query is one blocked matrix-vector product followed by a top-k partition.
+
+    :param path: Directory of the collection.
+    :param dtype: Row dtype for a new collection; an existing collection keeps its own.
+    """
+
+    stores_text: bool = True
+    flat_metadata: bool = False
+    path: str
+    dtype: str = "float16"
+
+    _lock: Any = PrivateAttr()
+    _dim: Optional[int] = PrivateAttr(default=None)
+    _records: List[dict] = PrivateAttr(default_factory=list)
+    _records_offset: int = PrivateAttr(default=0)
+    _tombstones_offset: int = PrivateAttr(default=0)
+    _last_row: dict = PrivateAttr(default_factory=dict)  # id -> latest row
+    _deleted_before: dict = PrivateAttr(default_factory=dict)  # id -> rows below this are deleted
+    _snapshot: Any = PrivateAttr(default=None)  # rows visible to reads, see `_Snapshot`
+
+    def __init__(self, path: str, dtype: str = "float16", **kwargs):
+        if dtype not in NUMPY_DTYPES:
+            raise ValueError(f"Unsupported vector dtype {dtype}, expected one of {NUMPY_DTYPES}")
+        super().__init__(path=path, dtype=dtype, **kwargs)
+        os.makedirs(path, exist_ok=True)
+        self._lock = _path_lock(path)
+        meta = self._read_meta()
+        if meta:
+            self._dim = meta["dim"]
+            self.dtype = meta["dtype"]
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_meta(self):
+        if not os.path.isfile(self._file("meta.json")):
+            return None
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _row_bytes(self):
+        return self._dim * np.dtype(self.dtype).itemsize
+
+    def _refresh(self) -> Optional[_Snapshot]:
+        """
+        Pick up rows and deletions written since the last call, by this or another process.
+
+        :return: The snapshot reads must work from, or None if the collection is empty and new.
+        """
+        with self._lock:
+            if self._dim is None:
+                meta = self._read_meta()
+                if meta is None:
+                    return None
+                self._dim, self.dtype = meta["dim"], meta["dtype"]
+
+            changed = False
+            records_path = self._file("records.jsonl")
+            if os.path.isfile(records_path) and os.path.getsize(records_path) > self._records_offset:
+                with open(records_path, "rb") as f:
+                    f.seek(self._records_offset)
+                    data = f.read()
+                complete = data[:data.rfind(b"\n") + 1]  # ignore a line still being written
+                for line in complete.splitlines():
+                    record = json.loads(line)
+                    self._last_row[record["id"]] = len(self._records)
+                    self._records.append(record)
+                self._records_offset += len(complete)
+                changed = changed or bool(complete)
+
+            tombstones_path = self._file("tombstones.jsonl")
+            if os.path.isfile(tombstones_path) and os.path.getsize(tombstones_path) > self._tombstones_offset:
+                with open(tombstones_path, "rb") as f:
+                    f.seek(self._tombstones_offset)
+                    data = f.read()
+                complete = data[:data.rfind(b"\n") + 1]
+                for line in complete.splitlines():
+                    tombstone = json.loads(line)
+                    self._deleted_before[tombstone["id"]] = max(
+                        self._deleted_before.get(tombstone["id"], 0), tombstone["rows"]
+                    )
+                self._tombstones_offset += len(complete)
+                changed = changed or bool(complete)
+
+            if not changed and self._snapshot is not None:
+                return self._snapshot
+
+            count = len(self._records)
+            matrix = scales = None
+            if count:
+                matrix = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r", shape=(count, self._dim))
+                scales = np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r", shape=(count,))
+            active = np.zeros(count, dtype=bool)
+            for node_id, row in self._last_row.items():
+                active[row] = row >= self._deleted_before.get(node_id, 0)
+            self._snapshot = _Snapshot(count, matrix, scales, active, self._records)
+            return self._snapshot
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        if not nodes:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+
+        with self._lock, open(self._file("write.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)  # writers in other processes
+            if self._read_meta() is None:
+                with open(self._file("meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({"dim": embeddings.shape[1], "dtype": self.dtype}, f)
+            self._refresh()
+            if embeddings.shape[1] != self._dim:
+                raise ValueError(f"Embedding dimension {embeddings.shape[1]} does not match store dimension {self._dim}")
+
+            # Drop rows of an earlier write that died before its records were written
+            committed = len(self._records)
+            for name, row_bytes in (("vectors.bin", self._row_bytes()), ("scales.bin", 4)):
+                if os.path.isfile(self._file(name)) and os.path.getsize(self._file(name)) > committed * row_bytes:
+                    os.truncate(self._file(name), committed * row_bytes)
+
+            rows, scales = quantize(embeddings, self.dtype)
+            # Vectors first, records last: a row only counts once its record line is complete
+            with open(self._file("vectors.bin"), "ab") as f:
+                f.write(rows.tobytes())
+            with open(self._file("scales.bin"), "ab") as f:
+                f.write(scales.tobytes())
+            with open(self._file("records.jsonl"), "a", encoding="utf-8") as f:
+                for node in nodes:
+                    metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+                    f.write(json.dumps({"id": node.node_id, "text": node.get_content(), "metadata": metadata}) + "\n")
+            self._refresh()
+
+        return [node.node_id for node in nodes]
+
+    def _tombstone(self, node_ids):
+        with self._lock, open(self._file("write.lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._refresh()
+            rows = len(self._records)
+            with open(self._file("tombstones.jsonl"), "a", encoding="utf-8") as f:
+                for node_id in node_ids:
+                    f.write(json.dumps({"id": node_id, "rows": rows}) + "\n")
+            self._refresh()
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        snapshot = self._refresh()
+        if snapshot is None:
+            return
+        rows = np.flatnonzero(snapshot.active & (snapshot.column("ref_doc_id") == ref_doc_id))
+        if len(rows):
+            self._tombstone([snapshot.records[row]["id"] for row in rows])
+
+    def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[MetadataFilters] = None, **delete_kwargs: Any) -> None:
+        snapshot = self._refresh()
+        if snapshot is None:
+            return
+        mask = snapshot.active.copy()
+        if node_ids is not None:
+            mask &= np.isin(snapshot.ids(), list(node_ids))
+        if filters is not None:
+            mask &= self._filter_mask(snapshot, filters)
+        ids = [snapshot.records[row]["id"] for row in np.flatnonzero(mask)]
+        if ids:
+            self._tombstone(ids)
+
+    def clear(self) -> None:
+        self.delete_nodes()
+
+    def count(self, filters: Optional[MetadataFilters] = None) -> int:
+        snapshot = self._refresh()
+        if snapshot is None:
+            return 0
+        mask = snapshot.active if filters is None else snapshot.active & self._filter_mask(snapshot, filters)
+        return int(mask.sum())
+
+    def _filter_mask(self, snapshot: _Snapshot, filters: MetadataFilters) -> np.ndarray:
+        masks = []
+        for metadata_filter in filters.filters:
+            if isinstance(metadata_filter, MetadataFilters):
+                masks.append(self._filter_mask(snapshot, metadata_filter))
+                continue
+            column = snapshot.column(metadata_filter.key)
+            operator = metadata_filter.operator
+            if operator == FilterOperator.EQ:
+                masks.append(column == metadata_filter.value)
+            elif operator == FilterOperator.NE:
+                masks.append(column != metadata_filter.value)
+            elif operator == FilterOperator.IN:
+                masks.append(np.isin(column, list(metadata_filter.value)))
+            elif operator == FilterOperator.NIN:
+                masks.append(~np.isin(column, list(metadata_filter.value)))
+            else:
+                raise ValueError(f"Filter operator {operator} is not supported by NumpyVectorStore")
+
+        if not masks:
+            return np.ones(snapshot.rows, dtype=bool)
+        if filters.condition == FilterCondition.OR:
+            return np.logical_or.reduce(masks)
+        return np.logical_and.reduce(masks)
+
+    @staticmethod
+    def _similarities(snapshot: _Snapshot, queries: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row to each unit query, shape (rows, queries)."""
+        scores = np.empty((snapshot.rows, len(queries)), dtype=np.float32)
+        for start in range(0, snapshot.rows, SCORE_BLOCK_ROWS):
+            block = snapshot.matrix[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = (block.astype(np.float32) @ queries.T) * snapshot.scales[start:start + len(block), None]
+        return scores
+
+    def query_many(
+        self,
+        query_embeddings,
+        similarity_top_k: int,
+        filters: Optional[MetadataFilters] = None,
+        node_ids: Optional[List[str]] = None,
+        doc_ids: Optional[List[str]] = None,
+    ) -> List[VectorStoreQueryResult]:
+        """Exact top-k for several query vectors with one matrix product."""
+        snapshot = self._refresh()
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if snapshot is None or not snapshot.active.any():
+            return [VectorStoreQueryResult(nodes=[], similarities=[], ids=[]) for _ in queries]
+
+        mask = snapshot.active.copy()
+        if filters is not None:
+            mask &= self._filter_mask(snapshot, filters)
+        if node_ids:
+            mask &= np.isin(snapshot.ids(), list(node_ids))
+        if doc_ids:
+            mask &= np.isin(snapshot.column("ref_doc_id"), list(doc_ids))
+
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        scores = self._similarities(snapshot, queries / norms)
+        scores[~mask] = -np.inf
+
+        top_k = min(similarity_top_k, int(mask.sum()))
+        results = []
+        for column in scores.T:
+            if top_k <= 0:
+                results.append(VectorStoreQueryResult(nodes=[], similarities=[], ids=[]))
+                continue
+            top = np.argpartition(-column, top_k - 1)[:top_k]
+            top = top[np.argsort(-column[top])]
+            nodes = []
+            for row in top:
+                # Returned with its vector so postprocessors needn't embed the text again
+                node = metadata_dict_to_node(snapshot.records[row]["metadata"], text=snapshot.records[row]["text"])
+                node.embedding = snapshot.vector(row)
+                nodes.append(node)
+            results.append(VectorStoreQueryResult(
+                nodes=nodes,
+                similarities=[float(column[row]) for row in top],
+                ids=[snapshot.records[row]["id"] for row in top],
+            ))
+        return results
+
+    def get_embeddings(self, node_ids: List[str]) -> Dict[str, List[float]]:
+        """Stored unit vectors of the given ids; deleted and unknown ids are left out."""
+        snapshot = self._refresh()
+        if snapshot is None or not node_ids:
+            return {}
+        rows = np.flatnonzero(snapshot.active & np.isin(snapshot.ids(), list(node_ids)))
+        return {snapshot.records[row]["id"]: snapshot.vector(row) for row in rows}
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        return self.query_many(
+            [query.query_embedding], query.similarity_top_k,
+            filters=query.filters, node_ids=query.node_ids, doc_ids=query.doc_ids,
+        )[0]
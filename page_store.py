@@ -0,0 +1,193 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from typing import Dict, Iterable, List
+
+from cache import LRUCache
+
+MAGIC = b"RPS1"
+FLAG_ZLIB = 1
+HEADER = struct.Struct("<4sBI")  # magic, flags, page count
+ENTRY = struct.Struct("<IQI")  # page number, blob offset, blob length
+
+
+def page_store_path(document_hash: str, upload_dir: str = "uploads") -> str:
+    """Path of the binary page store of a document."""
+    return os.path.join(upload_dir, f"{document_hash}.pages")
+
+
+def write_page_store(pages: Iterable[Dict], save_path: str, compress: bool = False):
+    """
+    Write page records as an offset table followed by UTF-8 page blobs.
+
+    `pages` is consumed one record at a time: blobs are spooled to a side file
+    while only the (page number, length) table is kept in memory, so a lazily
+    produced document never has to fit in memory. The file is written to a temp
+    path and renamed, so readers never see a partial store.
+
+    :param pages: Records with "page_number" and "text".
+    :param save_path: Destination path.
+    :param compress: Compress each page blob with zlib.
+    """
+    tmp_path = f"{save_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    blob_path = f"{tmp_path}.blobs"
+    try:
+        entries = []
+        with open(blob_path, "wb") as blob_file:
+            for page in pages:
+                blob = page["text"].encode("utf-8")
+                if compress:
+                    blob = zlib.compress(blob)
+                blob_file.write(blob)
+                entries.append((page["page_number"], len(blob)))
+
+        offset = HEADER.size + ENTRY.size * len(entries)
+        with open(tmp_path, "wb") as f, open(blob_path, "rb") as blob_file:
+            f.write(HEADER.pack(MAGIC, FLAG_ZLIB if compress else 0, len(entries)))
+            for page_number, length in entries:
+                f.write(ENTRY.pack(page_number, offset, length))
+                offset += length
+            shutil.copyfileobj(blob_file, f, 1024 * 1024)
+        os.replace(tmp_path, save_path)
+    finally:
+        for path in (blob_path, tmp_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    print(f"Page store saved to {save_path}")
+
+
+class PageStore:
+    """
+    Read-only, memory-mapped view of a page store.
+
+    Only the offset table is read up front; page text is decoded when asked for.
+    Iterating yields {"page_number", "text"} records like the JSON page text.
+    `close` waits for reads in progress, including open iterators, to finish.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, flags, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a page store: {path}")
+        self.compressed = bool(flags & FLAG_ZLIB)
+        self._count = count
+        self._positions = None  # page number -> table slot, built on first lookup
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+
+    def __len__(self):
+        return self._count
+
+    def _begin_read(self):
+        with self._lock:
+            if self._closing:
+                raise ValueError(f"Page store is closed: {self.path}")
+            self._readers += 1
+
+    def _end_read(self):
+        with self._lock:
+            self._readers -= 1
+            if self._closing and not self._readers:
+                self._mmap.close()
+
+    def _entry(self, slot: int):
+        return ENTRY.unpack_from(self._mmap, HEADER.size + slot * ENTRY.size)
+
+    def page_numbers(self) -> List[int]:
+        self._begin_read()
+        try:
+            return [self._entry(slot)[0] for slot in range(self._count)]
+        finally:
+            self._end_read()
+
+    def _decode(self, offset: int, length: int) -> str:
+        blob = self._mmap[offset:offset + length]
+        if self.compressed:
+            blob = zlib.decompress(blob)
+        return blob.decode("utf-8")
+
+    def get_text(self, page_number: int, default: str = "") -> str:
+        """Decode the text of one page."""
+        self._begin_read()
+        try:
+            if self._positions is None:
+                positions = {self._entry(slot)[0]: slot for slot in range(self._count)}
+                self._positions = positions
+
+            slot = self._positions.get(page_number)
+            if slot is None:
+                return default
+            _, offset, length = self._entry(slot)
+            return self._decode(offset, length)
+        finally:
+            self._end_read()
+
+    def __iter__(self):
+        self._begin_read()
+        try:
+            for slot in range(self._count):
+                page_number, offset, length = self._entry(slot)
+                yield {"page_number": page_number, "text": self._decode(offset, length)}
+        finally:
+            self._end_read()
+
+    def close(self):
+        """Unmap the file now, or once the last read in progress ends."""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            if not self._readers:
+                self._mmap.close()
+
+
+# Opened stores are shared across requests; replaced and evicted stores are closed
+_open_stores = LRUCache(maxsize=64, on_evict=PageStore.close)
+_reopen_lock = threading.Lock()
+
+
+def open_page_store(document_hash: str, upload_dir: str = "uploads") -> PageStore:
+    """
+    Open the page store of a document.
+
+    Documents saved in the older `uploads/<hash>.json` format are converted on
+    first access and the JSON file is removed.
+    """
+    path = page_store_path(document_hash, upload_dir)
+    if not os.path.isfile(path):
+        json_path = os.path.join(upload_dir, f"{document_hash}.json")
+        if not os.path.isfile(json_path):
+            raise FileNotFoundError(f"Saved page text not found: {path}")
+
+        with open(json_path, "r", encoding="utf-8") as f:
+            pages = json.load(f)
+        write_page_store(pages, path)
+        try:
+            os.remove(json_path)
+        except FileNotFoundError:
+            pass  # migrated concurrently by another request
+        print(f"Migrated {json_path} to {path}")
+
+    store = _open_stores.get_or_create(path, lambda: PageStore(path))
+    if store.mtime == os.path.getmtime(path):
+        return store
+    # Rewritten since it was opened, e.g. by a re-ingest; set() closes the old store
+    with _reopen_lock:
+        store = _open_stores.get(path)
+        if store is None or store.mtime != os.path.getmtime(path):
+            store = PageStore(path)
+            _open_stores.set(path, store)
+    return store
@@ -1,10 +1,14 @@
+import multiprocessing
 import os
 import re
+import threading
 import uuid
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from html.parser import HTMLParser
+from typing import Dict, Iterator, List
 from PyPDF2 import PdfReader
 from utils import hash_file_chunked
-from bs4 import BeautifulSoup
 from llama_index.core import Document
 def clean_text(text: str) -> str:
     """
@@ -51,108 +55,418 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> List[st
 
     return chunks
 
-def parse_pdf(
-    file_path: str, 
-    chunk_size: int = 1000, 
-    overlap: int = 100
-) -> List[Document]:
+CHARS_PER_TOKEN = 4  # rough average for English text with OpenAI tokenizers
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c2a52-93b4-4c53-8f43-6d0f4f1d2b7e")
+# Offsets and page range are for citations and merging, not for the embedded or prompted text
+POSITION_METADATA_KEYS = ["page_end", "start_char", "end_char"]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for chunk budgets."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _split_long_piece(text: str, start: int, end: int, max_chars: int):
+    """Split text[start:end] on whitespace into pieces of at most `max_chars`."""
+    while end - start > max_chars:
+        cut = text.rfind(" ", start, start + max_chars + 1)
+        if cut <= start:
+            # A single word longer than the budget: hard split
+            yield start, start + max_chars
+            start += max_chars
+        else:
+            yield start, cut
+            start = cut + 1
+    if end > start:
+        yield start, end
+
+
+def _sentence_spans(text: str, max_chars: int):
+    """Yield (start, end) spans of the sentences of a cleaned page text."""
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        yield from _split_long_piece(text, start, match.start(), max_chars)
+        start = match.end()
+    yield from _split_long_piece(text, start, len(text), max_chars)
+
+
+def iter_chunks(pages, max_tokens: int = 250, overlap_tokens: int = 25, span_pages: bool = False):
     """
-    Parse a PDF file and return a list of LlamaIndex `Document` objects,
-    each containing a chunk of text and associated metadata.
+    Lazily pack page text into chunks of up to `max_tokens`, cutting only on
+    sentence boundaries (or whitespace for overlong sentences).
+
+    Consecutive chunks share up to `overlap_tokens` of trailing whole sentences.
+    Pages are expected to be whitespace-normalized, so a chunk's text is exactly
+    the page text between its offsets.
+
+    :param pages: Page records with "page_number" and "text"
+    :param max_tokens: Token budget per chunk, see `estimate_tokens`
+    :param overlap_tokens: Budget of trailing sentences repeated in the next chunk
+    :param span_pages: Let chunks continue across page boundaries instead of flushing at each page end
+    :return: A generator of {"text", "page_number", "page_end", "start_char", "end_char"};
+             offsets are in the start and end page respectively
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+
+    window = []  # pieces (page_number, start, end, text)
+    length = 0
+    fresh = 0  # pieces not yet emitted in a previous chunk
+
+    def emit():
+        return {
+            "text": " ".join(piece[3] for piece in window),
+            "page_number": window[0][0],
+            "page_end": window[-1][0],
+            "start_char": window[0][1],
+            "end_char": window[-1][2],
+        }
+
+    for page in pages:
+        text = page["text"]
+        for start, end in _sentence_spans(text, max_chars):
+            piece = (page["page_number"], start, end, text[start:end])
+            if window and length + 1 + len(piece[3]) > max_chars:
+                yield emit()
+
+                # Carry trailing whole sentences over as overlap
+                tail = []
+                tail_length = -1
+                for previous in reversed(window):
+                    if tail_length + 1 + len(previous[3]) > overlap_chars:
+                        break
+                    tail.insert(0, previous)
+                    tail_length += 1 + len(previous[3])
+                if tail and tail_length + 1 + len(piece[3]) > max_chars:
+                    tail, tail_length = [], -1
+                window, length, fresh = tail, tail_length, 0
+
+            window.append(piece)
+            length = len(piece[3]) if len(window) == 1 else length + 1 + len(piece[3])
+            fresh += 1
+
+        if not span_pages:
+            if fresh:
+                yield emit()
+            window, length, fresh = [], 0, 0
+
+    if fresh:
+        yield emit()
+
+
+def chunk_id(document_hash: str, chunk: Dict) -> str:
+    """Deterministic chunk id from the document hash and the chunk's position."""
+    position = f"{chunk['page_number']}:{chunk['start_char']}-{chunk['page_end']}:{chunk['end_char']}"
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{document_hash}:{position}"))
+
+PARALLEL_PAGE_THRESHOLD = 64  # PDFs with more pages are extracted in a process pool
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or os.cpu_count() or 1
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    """
+    Process pool shared by all extractions, created on first use.
+
+    Uploads are extracted from ingestion worker threads, and forking a
+    multithreaded process can copy locks held by other threads, so workers
+    are started by a forkserver (or spawned where that is unavailable).
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context(method))
+        return _pdf_pool
+
+
+def _reset_pdf_pool(pool: ProcessPoolExecutor):
+    """Drop a broken pool so the next extraction starts a new one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[Dict]:
+    """
+    Extract and clean the text of pages [start, end) of a PDF.
+    Runs inside pool workers, so it opens its own reader.
+    """
+    return _extract_reader_pages(PdfReader(file_path), start, end)
+
+
+def _extract_reader_pages(reader: PdfReader, start: int, end: int) -> List[Dict]:
+    """Extract and clean the text of pages [start, end) of an open PDF."""
+    pages = []
+    for page_index in range(start, end):
+        raw_text = reader.pages[page_index].extract_text() or ""  # handle empty pages gracefully
+        cleaned_text = clean_text(raw_text)
+        if cleaned_text:  # skip empty or blank pages
+            pages.append({"page_number": page_index + 1, "text": cleaned_text})
+    return pages
+
+
+def extract_pdf_pages(file_path: str) -> List[Dict]:
+    """
+    Read a PDF once and return its cleaned text page by page.
+
+    Small PDFs are extracted with the reader that counted their pages. Large
+    PDFs are split into one contiguous page range per worker of the shared
+    process pool, so each worker opens the PDF once.
 
     :param file_path: Path to the PDF file
-    :param chunk_size: Maximum number of characters in each text chunk
-    :param overlap: Number of overlapping characters between consecutive chunks
-    :return: A list of `Document` objects ready for indexing
+    :return: A list of {"page_number", "text"} records, blank pages omitted
     """
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"PDF file not found: {file_path}")
 
     reader = PdfReader(file_path)
-    documents = []
+    page_count = len(reader.pages)
+    if page_count <= PARALLEL_PAGE_THRESHOLD or PDF_WORKERS < 2:
+        return _extract_reader_pages(reader, 0, page_count)
 
-    for page_index, page in enumerate(reader.pages):
-        raw_text = page.extract_text() or ""  # handle empty pages gracefully
-        cleaned_text = clean_text(raw_text)
+    pages_per_worker = -(-page_count // PDF_WORKERS)
+    ranges = [(start, min(start + pages_per_worker, page_count)) for start in range(0, page_count, pages_per_worker)]
+    pool = _get_pdf_pool()
+    try:
+        futures = [pool.submit(_extract_pdf_page_range, file_path, start, end) for start, end in ranges]
+        pages = []
+        for future in futures:  # keep page order
+            pages.extend(future.result())
+    except BrokenProcessPool:
+        _reset_pdf_pool(pool)
+        raise
+    return pages
 
-        if not cleaned_text:
-            continue  # skip empty or blank pages
-
-        # Split into smaller chunks
-        text_chunks = chunk_text(cleaned_text, chunk_size, overlap)
-
-        # Wrap each chunk in a LlamaIndex Document
-        for chunk in text_chunks:
-            doc_id = str(uuid.uuid4())  # or use any ID logic
-            metadata = {
-                "source": file_path,
-                "page_number": page_index + 1
-            }
-            # Create Document object
-            doc = Document(
-                text=chunk,
-                doc_id=doc_id,
-                extra_info=metadata
-            )
-            documents.append(doc)
-
-    return documents
 
-def parse_html(
-    file_path: str, 
-    chunk_size: int = 1000, 
-    overlap: int = 100
-) -> List[Document]:
+HTML_READ_SIZE = 64 * 1024
+HTML_MAX_SECTION_CHARS = int(os.getenv("HTML_MAX_SECTION_CHARS", "20000"))
+HTML_SECTION_TAGS = {"h1", "h2", "h3"}  # headings that start a new page
+HTML_SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+
+class _SectionTextParser(HTMLParser):
     """
-    Parse an HTML file and return a list of LlamaIndex `Document` objects,
-    each containing a chunk of text and associated metadata.
+    Incremental visible-text extractor.
+
+    Text inside HTML_SKIP_TAGS is dropped. Completed sections are appended to
+    `sections` as the document is fed, so only the current section is buffered.
+    """
+
+    def __init__(self, max_section_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.max_section_chars = max_section_chars
+        self.sections = []
+        self._parts = []
+        self._length = 0
+        self._skip_depth = 0
+
+    def _separate(self):
+        # Text nodes are joined with a space, like BeautifulSoup's get_text(separator=" ").
+        # Separating at tags rather than per handle_data call keeps words whole when
+        # the parser hands over a text node in pieces at a read block boundary.
+        if self._parts and self._parts[-1] != " ":
+            self._parts.append(" ")
+            self._length += 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTML_SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in HTML_SECTION_TAGS and not self._skip_depth:
+            self.flush()
+        self._separate()
+
+    def handle_startendtag(self, tag, attrs):
+        self._separate()  # void elements such as <br/> carry no text
+
+    def handle_endtag(self, tag):
+        if tag in HTML_SKIP_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+        self._separate()
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        self._parts.append(data)
+        self._length += len(data)
+        if self._length >= self.max_section_chars:
+            self._split_oversized()
+
+    def _split_oversized(self):
+        # Cut at the last whitespace before the limit and keep the rest buffered
+        text = "".join(self._parts)
+        while len(text) >= self.max_section_chars:
+            cut = text.rfind(" ", 0, self.max_section_chars)
+            if cut <= 0:
+                cut = self.max_section_chars
+            self._emit(text[:cut])
+            text = text[cut:]
+        self._parts = [text]
+        self._length = len(text)
+
+    def _emit(self, text):
+        cleaned = clean_text(text)
+        if cleaned:
+            self.sections.append(cleaned)
+
+    def flush(self):
+        self._emit("".join(self._parts))
+        self._parts = []
+        self._length = 0
+
+
+def iter_html_pages(file_path: str, max_section_chars: int = HTML_MAX_SECTION_CHARS) -> Iterator[Dict]:
+    """
+    Stream the visible text of an HTML file as section pages.
+
+    The file is read in fixed-size blocks and fed to an incremental parser; a new
+    page starts at every h1-h3 heading, and sections longer than
+    `max_section_chars` are split, so memory use does not grow with the file.
 
     :param file_path: Path to the HTML file
-    :param chunk_size: Max number of characters per text chunk
-    :param overlap: Number of overlapping characters between consecutive chunks
-    :return: A list of `Document` objects ready for indexing
+    :param max_section_chars: Maximum characters per page
+    :return: A generator of {"page_number", "text"} records
     """
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"HTML file not found: {file_path}")
 
+    parser = _SectionTextParser(max_section_chars)
+    page_number = 0
+    with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            block = f.read(HTML_READ_SIZE)
+            if not block:
+                parser.close()
+                parser.flush()
+            else:
+                parser.feed(block)
+
+            for text in parser.sections:
+                page_number += 1
+                yield {"page_number": page_number, "text": text}
+            parser.sections.clear()
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        html_content = f.read()
+            if not block:
+                break
 
-    # Parse with BeautifulSoup
-    soup = BeautifulSoup(html_content, "html.parser")
 
-    # Remove script and style elements
-    for tag in soup(["script", "style", "noscript"]):
-        tag.decompose()
+def extract_html_pages(file_path: str) -> List[Dict]:
+    """
+    Read an HTML file once and return its visible text split into section pages.
+
+    :param file_path: Path to the HTML file
+    :return: A list of {"page_number", "text"} records, empty if there is no text
+    """
+    return list(iter_html_pages(file_path))
 
-    # Extract visible text
-    # Using get_text(separator=" ") merges all text content with a space delimiter
-    raw_text = soup.get_text(separator=" ")
-    cleaned_text = clean_text(raw_text)
 
-    if not cleaned_text:
-        return []
+def iter_pages(file_path: str) -> Iterator[Dict]:
+    """
+    Page text records of a PDF or HTML file; HTML sections are streamed from the file.
+    """
+    file_ext = os.path.splitext(file_path)[1].lower()
+    if file_ext == ".pdf":
+        return iter(extract_pdf_pages(file_path))
+    if file_ext == ".html":
+        return iter_html_pages(file_path)
+    raise ValueError(f"Unsupported file type: {file_ext}")
+
+
+def extract_pages(file_path: str) -> List[Dict]:
+    """
+    Single extraction stage for uploads: page text records for PDF or HTML files.
+    The same records feed both chunking and the keyword search store.
+    """
+    return list(iter_pages(file_path))
+
+
+def iter_documents(
+    pages: List[Dict],
+    source: str,
+    document_hash: str,
+    max_tokens: int = 250,
+    overlap_tokens: int = 25,
+    span_pages: bool = False,
+    file_type: str = "pdf",
+):
+    """
+    Lazily chunk extracted page records into LlamaIndex `Document` objects.
 
-    # Split into chunks
-    text_chunks = chunk_text(cleaned_text, chunk_size, overlap)
+    Ids are derived from the document hash and chunk offsets, so re-ingesting
+    the same file with the same settings upserts the same ids.
 
-    # Wrap each chunk in a LlamaIndex Document
-    documents = []
-    for chunk in text_chunks:
-        doc_id = str(uuid.uuid4())
+    :param pages: Records produced by `extract_pages`
+    :param source: Path of the original file, stored in the metadata
+    :param document_hash: Hash of the file, used for the chunk ids
+    :param max_tokens: Token budget per chunk
+    :param overlap_tokens: Budget of trailing sentences repeated in the next chunk
+    :param span_pages: Allow chunks to continue across pages
+    :param file_type: "pdf" or "html"
+    :return: A generator of `Document` objects ready for indexing
+    """
+    for chunk in iter_chunks(pages, max_tokens, overlap_tokens, span_pages):
         metadata = {
-            "source": file_path,
-            "type": "html"
+            "source": source,
+            "page_number": chunk["page_number"],
+            "page_end": chunk["page_end"],
+            "start_char": chunk["start_char"],
+            "end_char": chunk["end_char"],
         }
-        doc = Document(
-            text=chunk,
-            doc_id=doc_id,
-            extra_info=metadata
+        if file_type == "html":
+            metadata["type"] = "html"
+        yield Document(
+            text=chunk["text"],
+            doc_id=chunk_id(document_hash, chunk),
+            extra_info=metadata,
+            excluded_embed_metadata_keys=list(POSITION_METADATA_KEYS),
+            excluded_llm_metadata_keys=list(POSITION_METADATA_KEYS),
         )
-        documents.append(doc)
 
-    return documents
+
+def parse_pdf(
+    file_path: str, 
+    chunk_size: int = 1000, 
+    overlap: int = 100
+) -> List[Document]:
+    """
+    Parse a PDF file and return a list of LlamaIndex `Document` objects,
+    each containing a chunk of text and associated metadata.
+
+    :param file_path: Path to the PDF file
+    :param chunk_size: Maximum number of characters in each text chunk
+    :param overlap: Number of overlapping characters between consecutive chunks
+    :return: A list of `Document` objects ready for indexing
+    """
+    pages = extract_pdf_pages(file_path)
+    return list(iter_documents(
+        pages, file_path, hash_file_chunked(file_path),
+        max_tokens=chunk_size // CHARS_PER_TOKEN, overlap_tokens=overlap // CHARS_PER_TOKEN, file_type="pdf",
+    ))
+
+def parse_html(
+    file_path: str, 
+    chunk_size: int = 1000, 
+    overlap: int = 100
+) -> List[Document]:
+    """
+    Parse an HTML file and return a list of LlamaIndex `Document` objects,
+    each containing a chunk of text and associated metadata.
+
+    :param file_path: Path to the HTML file
+    :param chunk_size: Max number of characters per text chunk
+    :param overlap: Number of overlapping characters between consecutive chunks
+    :return: A list of `Document` objects ready for indexing
+    """
+    pages = extract_html_pages(file_path)
+    return list(iter_documents(
+        pages, file_path, hash_file_chunked(file_path),
+        max_tokens=chunk_size // CHARS_PER_TOKEN, overlap_tokens=overlap // CHARS_PER_TOKEN, file_type="html",
+    ))
 
 if __name__ == "__main__":
     # Example usage
@@ -1,18 +1,5 @@
-
-
-if __name__ == "__main__":
-    from build_index import build_chroma_index
-    from parse_document import parse_pdf
-
-    pdf_file = "uploads/RAG_target_file.pdf"
-    docs = parse_pdf(pdf_file, chunk_size=1000000, overlap=100)
-
-    # Build the index
-    index = build_chroma_index(docs)
-
-    # Query it
-    query_engine = index.as_query_engine(similarity_top_k=5,streaming=True)
-    questions = [
+# Evaluation questions about the DeepSeek-V3 technical report (uploads/RAG_target_file.pdf)
+QUESTIONS = [
     # General Model Questions
     "What is the total number of parameters in DeepSeek-V3?",
     "How many parameters are activated per token in DeepSeek-V3?",
@@ -46,11 +33,25 @@ if __name__ == "__main__":
     "What are the key hardware requirements for training DeepSeek-V3?",
     "How does DeepSeek-V3 utilize FP8 training for efficiency?",
     "What are the main suggestions for future AI hardware based on DeepSeek-V3’s training needs?"
-    ]
+]
+
+
+if __name__ == "__main__":
+    from build_index import build_chroma_index
+    from parse_document import parse_pdf
+
+    pdf_file = "uploads/RAG_target_file.pdf"
+    docs = parse_pdf(pdf_file, chunk_size=1000000, overlap=100)
+
+    # Build the index
+    index = build_chroma_index(docs)
+
+    # Query it
+    query_engine = index.as_query_engine(similarity_top_k=5,streaming=True)
 
 
 
-    streaming_response = query_engine.query(questions[0])
+    streaming_response = query_engine.query(QUESTIONS[0])
     # streaming_response.print_response_stream()
     # 逐步读取流式输出
     for chunk in streaming_response.response_gen:
@@ -0,0 +1,118 @@
+import math
+from typing import Dict, List
+
+import build_index
+from build_index import (
+    check_chroma_index, collection_name, document_filters, get_chroma_client, get_collection_index, get_embed_model,
+)
+from metrics import timed, count
+
+# Chroma bookkeeping written by the llama-index vector store, not useful to callers
+INTERNAL_METADATA_KEYS = {"_node_content", "_node_type", "doc_id", "document_id", "ref_doc_id"}
+
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """Embed a batch of queries, in one call when the model supports it."""
+    embed_model = get_embed_model()
+    if hasattr(embed_model, "get_query_embeddings"):
+        return embed_model.get_query_embeddings(queries)
+    return [embed_model.get_query_embedding(query) for query in queries]
+
+
+def cosine_similarity_from_distance(distance: float, space: str = "l2") -> float:
+    """
+    Cosine similarity of unit vectors from a Chroma distance.
+
+    Chroma reports squared L2 distance by default (`|a - b|^2 = 2 - 2 cos`),
+    or `1 - a.b` for the "ip" and "cosine" spaces. The embedding models used
+    here return unit vectors, and queries are normalized before searching.
+    """
+    if space == "l2":
+        return 1.0 - distance / 2.0
+    return 1.0 - distance
+
+
+def _unit(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm else list(vector)
+
+
+def _where(document_hash: str):
+    # Per-document collections need no filter
+    if build_index.CHROMA_LAYOUT != "shared":
+        return None
+    return {"document_hash": document_hash}
+
+
+def batch_retrieve(document_hash: str, queries: List[str], top_k: int = 5) -> List[Dict]:
+    """
+    Top-k chunks for each of several queries against one document, without an LLM call.
+
+    All queries are embedded in one batch and searched with a single vector store query.
+
+    :param document_hash: Indexed document to search.
+    :param queries: Questions about the document.
+    :param top_k: Chunks returned per query.
+    :return: One {"query", "nodes"} entry per query; nodes carry id, score, distance, text and metadata.
+        Scores are cosine similarities and distances `1 - score` under either vector backend.
+    """
+    if not check_chroma_index(document_hash):
+        raise LookupError(f"Document {document_hash} is not indexed")
+    if not queries:
+        return []
+
+    with timed("query_embed", queries=len(queries)):
+        embeddings = embed_queries(queries)
+    count("query_embed", len(queries))
+
+    if build_index.VECTOR_BACKEND == "numpy":
+        return _batch_retrieve_numpy(document_hash, queries, embeddings, top_k)
+
+    collection = get_chroma_client().get_or_create_collection(name=collection_name(document_hash))
+    space = (collection.metadata or {}).get("hnsw:space", "l2")
+    with timed("retrieval", search_type="batch", queries=len(queries)):
+        result = collection.query(
+            query_embeddings=[_unit(embedding) for embedding in embeddings],
+            n_results=top_k,
+            where=_where(document_hash),
+            include=["documents", "metadatas", "distances"],
+        )
+
+    batches = []
+    for i, query in enumerate(queries):
+        nodes = []
+        for node_id, text, metadata, distance in zip(
+            result["ids"][i], result["documents"][i], result["metadatas"][i], result["distances"][i]
+        ):
+            metadata = {k: v for k, v in (metadata or {}).items() if k not in INTERNAL_METADATA_KEYS}
+            similarity = cosine_similarity_from_distance(distance, space)
+            nodes.append({
+                "id": node_id,
+                "score": similarity,
+                "distance": 1.0 - similarity,
+                "text": text,
+                "metadata": metadata,
+            })
+        batches.append({"query": query, "nodes": nodes})
+    return batches
+
+
+def _batch_retrieve_numpy(document_hash, queries, embeddings, top_k):
+    store = get_collection_index(collection_name(document_hash)).vector_store
+    with timed("retrieval", search_type="batch", queries=len(queries)):
+        results = store.query_many(embeddings, top_k, filters=document_filters(document_hash))
+
+    batches = []
+    for query, result in zip(queries, results):
+        nodes = []
+        for node, similarity in zip(result.nodes, result.similarities):
+            metadata = {k: v for k, v in node.metadata.items() if k not in INTERNAL_METADATA_KEYS}
+            nodes.append({
+                "id": node.node_id,
+                "score": similarity,  # cosine similarity
+                "distance": 1.0 - similarity,
+                "text": node.get_content(),
+                "metadata": metadata,
+            })
+        batches.append({"query": query, "nodes": nodes})
+    return batches
@@ -0,0 +1,242 @@
+"""
+Per-document sentence-window and auto-merging retrieval.
+
+Each strategy keeps its own vector collection per document (`<hash>-sw`,
+`<hash>-am`) under the configured vector backend, plus a directory under
+`chroma_storage/strategies/<hash>/<strategy>/` with the parser parameters
+and, for auto-merging, the docstore of parent chunks. Nodes are parsed once,
+when the strategy is built in an ingestion job; loading only reopens the
+collection and docstore, and queries never build.
+
+Builders in different processes are serialized with `fcntl.flock`, so on
+platforms without fcntl (Windows) only builds within one process are.
+"""
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List
+
+try:
+    import fcntl
+except ImportError:  # not POSIX
+    fcntl = None
+
+from llama_index.core import Document, StorageContext, VectorStoreIndex
+from llama_index.core.node_parser import HierarchicalNodeParser, SentenceWindowNodeParser, get_leaf_nodes
+from llama_index.core.postprocessor import MetadataReplacementPostProcessor
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import AutoMergingRetriever
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+from build_index import (
+    CHROMA_PATH, INDEX_CACHE_SIZE, INDEX_CACHE_TTL, NUMPY_STORE_DTYPE, NUMPY_STORE_PATH, VECTOR_BACKEND,
+    check_chroma_index, embed_nodes_in_batches, get_chroma_client, get_llm, get_vector_store,
+)
+from cache import LRUCache
+from context_selection import CONTEXT_OVERFETCH, ContextSelector
+from metrics import count, log_event, timed
+from numpy_store import NumpyVectorStore
+from page_store import open_page_store
+
+STRATEGIES = {"sentence_window": "sw", "auto_merging": "am"}  # strategy -> collection suffix
+STRATEGY_DIR = os.path.join(CHROMA_PATH, "strategies")
+SENTENCE_WINDOW_SIZE = int(os.getenv("SENTENCE_WINDOW_SIZE", "3"))
+AUTO_MERGING_CHUNK_SIZES = [int(size) for size in os.getenv("AUTO_MERGING_CHUNK_SIZES", "2048,512,128").split(",")]
+# Strategies built during ingestion; others are built by a job queued on first request
+INGEST_STRATEGIES = [name for name in os.getenv("INGEST_STRATEGIES", "").split(",") if name]
+
+_strategy_index_cache = LRUCache(maxsize=INDEX_CACHE_SIZE, ttl=INDEX_CACHE_TTL)
+_strategy_engine_cache = LRUCache(maxsize=INDEX_CACHE_SIZE, ttl=INDEX_CACHE_TTL)
+# Held while building in this process, striped by (document_hash, strategy) so the set stays bounded
+_build_locks = [threading.Lock() for _ in range(64)]
+
+
+def strategy_params(strategy: str) -> Dict:
+    """Parser settings a persisted strategy was built with; a change triggers a rebuild."""
+    if strategy == "sentence_window":
+        return {"window_size": SENTENCE_WINDOW_SIZE}
+    return {"chunk_sizes": AUTO_MERGING_CHUNK_SIZES}
+
+
+def strategy_dir(document_hash: str, strategy: str) -> str:
+    return os.path.join(STRATEGY_DIR, document_hash, strategy)
+
+
+def strategy_collection_name(document_hash: str, strategy: str) -> str:
+    return f"{document_hash}-{STRATEGIES[strategy]}"
+
+
+def strategy_ready(document_hash: str, strategy: str) -> bool:
+    """True if the strategy was fully built for the document with the current parameters."""
+    path = os.path.join(strategy_dir(document_hash, strategy), "complete.json")
+    if not os.path.isfile(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("params") == strategy_params(strategy)
+
+
+def _node_parser(strategy: str):
+    if strategy == "sentence_window":
+        return SentenceWindowNodeParser.from_defaults(
+            window_size=SENTENCE_WINDOW_SIZE,
+            window_metadata_key="window",
+            original_text_metadata_key="original_text",
+        )
+    return HierarchicalNodeParser.from_defaults(chunk_sizes=AUTO_MERGING_CHUNK_SIZES)
+
+
+def _page_documents(pages, document_hash: str, source: str = None) -> List[Document]:
+    documents = []
+    for page in pages:
+        if not page["text"].strip():
+            continue
+        metadata = {"page_number": page["page_number"]}
+        if source:
+            metadata["source"] = source
+        documents.append(Document(text=page["text"], doc_id=f"{document_hash}:page:{page['page_number']}", extra_info=metadata))
+    return documents
+
+
+def _reset_collection(name: str):
+    """Remove the vectors of an earlier, possibly partial, build."""
+    if VECTOR_BACKEND == "numpy":
+        NumpyVectorStore(os.path.join(NUMPY_STORE_PATH, name), dtype=NUMPY_STORE_DTYPE).clear()
+        return
+    try:
+        get_chroma_client().delete_collection(name)
+    except Exception:
+        pass  # no such collection yet
+
+
+def _build_lock(document_hash: str, strategy: str) -> threading.Lock:
+    return _build_locks[hash((document_hash, strategy)) % len(_build_locks)]
+
+
+def build_strategy_index(document_hash: str, strategy: str, pages=None, source: str = None):
+    """
+    Parse, embed and persist a document for a retrieval strategy.
+
+    Builds of the same document and strategy are serialized across threads and
+    processes; a build that finds the strategy already built loads it instead.
+
+    :param document_hash: Hash of an ingested document.
+    :param strategy: "sentence_window" or "auto_merging".
+    :param pages: Page records of the document, read from its page store if not given.
+    :param source: Path of the original file, stored in the metadata for citations.
+    :return: The strategy's index.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown retrieval strategy: {strategy}")
+
+    lock_dir = os.path.join(STRATEGY_DIR, document_hash)
+    os.makedirs(lock_dir, exist_ok=True)
+    with _build_lock(document_hash, strategy), open(os.path.join(lock_dir, f"{strategy}.lock"), "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # builders in other processes
+        if strategy_ready(document_hash, strategy):
+            return _strategy_index_cache.get_or_create(
+                (document_hash, strategy), lambda: _load_strategy_index(document_hash, strategy)
+            )
+        return _build_strategy_index(document_hash, strategy, pages, source)
+
+
+def _build_strategy_index(document_hash: str, strategy: str, pages, source: str):
+    directory = strategy_dir(document_hash, strategy)
+    name = strategy_collection_name(document_hash, strategy)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    _reset_collection(name)
+    for key in [key for key in _strategy_engine_cache.keys() if key[:2] == (document_hash, strategy)]:
+        _strategy_engine_cache.pop(key)
+
+    documents = _page_documents(pages if pages is not None else open_page_store(document_hash), document_hash, source)
+    with timed("strategy_parse", strategy=strategy):
+        nodes = _node_parser(strategy).get_nodes_from_documents(documents)
+    leaf_nodes = get_leaf_nodes(nodes) if strategy == "auto_merging" else nodes
+    count("strategy_nodes", len(leaf_nodes))
+
+    embed_nodes_in_batches(leaf_nodes)
+    storage_context = StorageContext.from_defaults(vector_store=get_vector_store(name))
+    if strategy == "auto_merging":
+        # Parents are only looked up by id when leaves are merged, they are never embedded
+        storage_context.docstore.add_documents(nodes)
+        storage_context.docstore.persist(os.path.join(directory, "docstore.json"))
+    with timed("index_write", nodes=len(leaf_nodes)):
+        index = VectorStoreIndex(leaf_nodes, storage_context=storage_context)
+
+    # Written last: a crash before this point leaves the strategy unbuilt, not half-built
+    complete_path = os.path.join(directory, "complete.json")
+    with open(f"{complete_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"params": strategy_params(strategy), "nodes": len(nodes), "leaf_nodes": len(leaf_nodes)}, f)
+    os.replace(f"{complete_path}.tmp", complete_path)
+
+    log_event("strategy_built", hash=document_hash, strategy=strategy, nodes=len(nodes), leaf_nodes=len(leaf_nodes))
+    _strategy_index_cache.set((document_hash, strategy), index)
+    return index
+
+
+def _load_strategy_index(document_hash: str, strategy: str):
+    vector_store = get_vector_store(strategy_collection_name(document_hash, strategy))
+    if strategy == "auto_merging":
+        docstore = SimpleDocumentStore.from_persist_path(os.path.join(strategy_dir(document_hash, strategy), "docstore.json"))
+        storage_context = StorageContext.from_defaults(docstore=docstore, vector_store=vector_store)
+    else:
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    return VectorStoreIndex(nodes=[], storage_context=storage_context)
+
+
+def get_strategy_index(document_hash: str, strategy: str):
+    """
+    Index of a document under a retrieval strategy, or None if the document
+    hasn't been indexed or the strategy hasn't been built for it.
+
+    Strategies are built by `build_strategy_index` in an ingestion job, never here.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown retrieval strategy: {strategy}")
+    if not check_chroma_index(document_hash):
+        print(f"Document {document_hash} not found in Chroma.")
+        return None
+
+    def create_index():
+        if not strategy_ready(document_hash, strategy):
+            print(f"Retrieval strategy {strategy} is not built for document {document_hash}")
+            return None
+        return _load_strategy_index(document_hash, strategy)
+
+    return _strategy_index_cache.get_or_create((document_hash, strategy), create_index)
+
+
+def get_strategy_query_engine(document_hash: str, strategy: str, similarity_top_k: int = 5):
+    """
+    Streaming query engine of a document under a retrieval strategy.
+
+    sentence_window retrieves single sentences and replaces each with its
+    surrounding window; auto_merging retrieves leaf chunks and replaces
+    groups of siblings with their parent chunk.
+    """
+    def create_query_engine():
+        index = get_strategy_index(document_hash, strategy)
+        if index is None:
+            return None
+        if strategy == "sentence_window":
+            # Select among sentences, then widen; windows are bounded by the window size
+            return index.as_query_engine(
+                similarity_top_k=similarity_top_k * CONTEXT_OVERFETCH,
+                streaming=True,
+                node_postprocessors=[
+                    ContextSelector(top_k=similarity_top_k, token_budget=None),
+                    MetadataReplacementPostProcessor(target_metadata_key="window"),
+                ],
+            )
+        retriever = AutoMergingRetriever(
+            index.as_retriever(similarity_top_k=similarity_top_k * CONTEXT_OVERFETCH), index.storage_context
+        )
+        # Merged parents were never embedded, so they are picked by score instead of MMR
+        return RetrieverQueryEngine.from_args(
+            retriever, llm=get_llm(), streaming=True,
+            node_postprocessors=[ContextSelector(top_k=similarity_top_k, diversify=False)],
+        )
+
+    return _strategy_engine_cache.get_or_create((document_hash, strategy, similarity_top_k), create_query_engine)
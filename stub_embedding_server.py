@@ -0,0 +1,159 @@
+"""
+Local OpenAI-compatible embedding server for exercising the embedding scheduler offline.
+
+    python stub_embedding_server.py --port 8765 --latency 0.2 --tokens-per-minute 200000
+    EMBED_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python app.py
+
+Serves `POST /v1/embeddings` with deterministic hashed vectors after a fixed
+latency, and answers 429 with a Retry-After header once the tokens of the
+last minute exceed the budget (or on every `--fail-every`-th request).
+`GET /stats` reports requests, throttled requests and peak concurrency.
+"""
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def stub_embedding(text: str, dimensions: int):
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimensions] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class StubState:
+    def __init__(self, latency: float, tokens_per_minute: int, fail_every: int, dimensions: int):
+        self.latency = latency
+        self.tokens_per_minute = tokens_per_minute
+        self.fail_every = fail_every
+        self.dimensions = dimensions
+        self.requests = 0
+        self.throttled = 0
+        self.texts = 0
+        self.concurrent = 0
+        self.peak_concurrency = 0
+        self._window = deque()  # (time, tokens) of accepted requests
+        self._lock = threading.Lock()
+
+    def admit(self, tokens: int):
+        """Seconds the client should wait before retrying, or None if the request is accepted."""
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._window and self._window[0][0] <= now - 60:
+                self._window.popleft()
+            used = sum(spent for _, spent in self._window)
+            if self.fail_every and self.requests % self.fail_every == 0:
+                self.throttled += 1
+                return 1.0
+            if self.tokens_per_minute and self._window and used + tokens > self.tokens_per_minute:
+                self.throttled += 1
+                return self._window[0][0] + 60 - now
+            self._window.append((now, tokens))
+            self.concurrent += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.concurrent)
+            return None
+
+    def done(self, texts: int):
+        with self._lock:
+            self.concurrent -= 1
+            self.texts += texts
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "texts": self.texts,
+                "peak_concurrency": self.peak_concurrency,
+            }
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status: int, body: dict, headers=None):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, state.stats())
+            else:
+                self._send_json(404, {"error": {"message": "Not found"}})
+
+        def do_POST(self):
+            if self.path not in ("/v1/embeddings", "/embeddings"):
+                self._send_json(404, {"error": {"message": "Not found"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            texts = request.get("input") or []
+            if isinstance(texts, str):
+                texts = [texts]
+            tokens = sum((len(text) + 3) // 4 for text in texts)
+
+            wait = state.admit(tokens)
+            if wait is not None:
+                self._send_json(
+                    429, {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                    headers={"Retry-After": f"{max(wait, 0.0):.3f}"},
+                )
+                return
+            try:
+                time.sleep(state.latency)
+                dimensions = int(request.get("dimensions") or state.dimensions)
+                self._send_json(200, {
+                    "object": "list",
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": stub_embedding(text, dimensions)}
+                        for i, text in enumerate(texts)
+                    ],
+                    "model": request.get("model", "stub"),
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+            finally:
+                state.done(len(texts))
+
+        def log_message(self, format, *args):
+            pass  # one line per request drowns the client's logs
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1, help="Seconds per request")
+    parser.add_argument("--tokens-per-minute", type=int, default=0, help="Budget before answering 429, 0 for none")
+    parser.add_argument("--fail-every", type=int, default=0, help="Answer 429 to every n-th request")
+    parser.add_argument("--dimensions", type=int, default=256)
+    args = parser.parse_args()
+
+    state = StubState(args.latency, args.tokens_per_minute, args.fail_every, args.dimensions)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f"Stub embedding server on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(state.stats()))
+
+
+if __name__ == "__main__":
+    main()
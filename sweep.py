@@ -0,0 +1,266 @@
+"""
+Parameter sweep over chunk size, chunk overlap and top-k.
+
+Each document is re-ingested once per (chunk size, overlap) into its own
+collection, then every golden question is retrieved at each top-k. The report
+lists chunks, embedded texts and tokens, index bytes, retrieval latency and
+recall@k per configuration, so defaults can be picked from data.
+
+Golden sets map questions to the pages that answer them:
+
+    {"questions": [{"question": "...", "document_hash": "...", "pages": [12, 13]}]}
+
+A first draft can be seeded from the DeepSeek-V3 question list in
+query_index.py; the seeded pages are the top BM25 pages and must be reviewed:
+
+    python sweep.py uploads/RAG_target_file.pdf --seed-golden golden.json
+    python sweep.py uploads/RAG_target_file.pdf --golden golden.json --output sweep.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+
+from benchmark import git_commit, percentiles, setup_offline_backends
+
+
+def parse_int_list(value: str):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def directory_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def chroma_store_bytes(path: str) -> int:
+    """
+    Bytes of Chroma's own storage under `path`: its SQLite database and the
+    per-segment directories named by UUID. The embedding cache, manifests
+    and other stores that share the directory are not counted.
+    """
+    total = 0
+    for entry in os.scandir(path) if os.path.isdir(path) else []:
+        if entry.is_file() and entry.name.startswith("chroma.sqlite3"):
+            total += entry.stat().st_size
+        elif entry.is_dir():
+            try:
+                uuid.UUID(entry.name)
+            except ValueError:
+                continue
+            total += directory_bytes(entry.path)
+    return total
+
+
+def seed_golden(files, questions, pages_per_question: int = 2):
+    """
+    Draft golden set: for each question, the top BM25 pages of each document.
+    Only content words are matched, the result is a starting point for manual review.
+    """
+    from keyword_search import build_keyword_index, bm25_search
+    from parse_document import extract_pages, hash_file_chunked
+
+    stopwords = {
+        "what", "how", "does", "is", "the", "are", "in", "of", "to", "and", "a", "an", "it", "its",
+        "used", "use", "which", "on", "for", "by", "was", "why", "like", "based", "main", "key",
+    }
+    golden = []
+    for file_path in files:
+        document_hash = hash_file_chunked(file_path)
+        index = build_keyword_index(extract_pages(file_path))
+        for question in questions:
+            terms = [term for term in question.replace("?", " ").split() if term.lower() not in stopwords]
+            results = bm25_search(index, " ".join(terms), top_k=pages_per_question)
+            golden.append({
+                "question": question,
+                "document": os.path.basename(file_path),
+                "document_hash": document_hash,
+                "pages": [page_number for page_number, _, _ in results],
+                "seeded": True,
+            })
+    return {"questions": golden}
+
+
+def ingest(file_path, pages, document_hash, name, max_tokens, overlap_tokens):
+    """Chunk, embed and write a document into a fresh collection, returning the index and ingestion stats."""
+    import build_index
+    from build_index import (
+        document_to_node, embed_nodes_in_batches, get_chroma_client, get_embed_model, get_vector_store,
+    )
+    from llama_index.core import VectorStoreIndex
+    from parse_document import estimate_tokens, iter_documents
+
+    if build_index.VECTOR_BACKEND == "numpy":
+        store_path = os.path.join(build_index.NUMPY_STORE_PATH, name)
+        shutil.rmtree(store_path, ignore_errors=True)
+    else:
+        store_path = build_index.CHROMA_PATH
+        try:
+            get_chroma_client().delete_collection(name)
+        except Exception:
+            pass
+    # Chroma shares its directory with all collections; only the growth of its storage is this collection's
+    store_bytes = directory_bytes if build_index.VECTOR_BACKEND == "numpy" else chroma_store_bytes
+    bytes_before = store_bytes(store_path)
+
+    embed_model = get_embed_model()
+    misses_before = embed_model.stats()["misses"] if hasattr(embed_model, "stats") else None
+
+    index = VectorStoreIndex.from_vector_store(get_vector_store(name))
+    documents = list(iter_documents(
+        pages, file_path, document_hash, max_tokens=max_tokens, overlap_tokens=overlap_tokens,
+        file_type=os.path.splitext(file_path)[1].lower()[1:],
+    ))
+    nodes = [document_to_node(doc, document_hash) for doc in documents]
+
+    start = time.perf_counter()
+    embed_nodes_in_batches(nodes)
+    embed_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    index.insert_nodes(nodes)
+    write_seconds = time.perf_counter() - start
+
+    stats = {
+        "chunks": len(nodes),
+        "chunk_tokens": sum(estimate_tokens(doc.text) for doc in documents),
+        "embed_seconds": embed_seconds,
+        "write_seconds": write_seconds,
+        "index_bytes": store_bytes(store_path) - bytes_before,
+    }
+    if misses_before is not None:
+        stats["embedded_texts"] = embed_model.stats()["misses"] - misses_before  # texts sent to the model
+    return index, stats
+
+
+def evaluate(index, golden, document_hash, top_k):
+    """Retrieval latency and recall@k of the golden questions of one document."""
+    retriever = index.as_retriever(similarity_top_k=top_k)
+    latencies, recalls, hits = [], [], []
+    for item in golden:
+        if item["document_hash"] != document_hash or not item["pages"]:
+            continue
+        start = time.perf_counter()
+        results = retriever.retrieve(item["question"])
+        latencies.append(time.perf_counter() - start)
+
+        retrieved_pages = set()
+        for result in results:
+            metadata = result.node.metadata
+            first = metadata.get("page_number")
+            last = metadata.get("page_end") or first
+            if first is not None:
+                retrieved_pages.update(range(first, last + 1))
+        expected = set(item["pages"])
+        found = len(expected & retrieved_pages)
+        recalls.append(found / len(expected))
+        hits.append(1.0 if found else 0.0)
+
+    return {
+        "questions": len(latencies),
+        "recall_at_k": sum(recalls) / len(recalls) if recalls else None,
+        "hit_rate": sum(hits) / len(hits) if hits else None,
+        "latency": percentiles(latencies),
+    }
+
+
+def format_table(rows):
+    columns = [
+        ("document", "{}"), ("chunk_tokens", "{}"), ("overlap", "{}"), ("top_k", "{}"),
+        ("chunks", "{}"), ("embedded_texts", "{}"), ("index_bytes", "{}"),
+        ("p95_ms", "{:.2f}"), ("recall_at_k", "{:.3f}"), ("hit_rate", "{:.3f}"),
+    ]
+    cells = [[name for name, _ in columns]]
+    for row in rows:
+        cells.append([
+            "-" if row.get(name) is None else fmt.format(row[name]) for name, fmt in columns
+        ])
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(line, widths)) for line in cells)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chunking and retrieval parameter sweep")
+    parser.add_argument("files", nargs="+", help="PDF or HTML documents")
+    parser.add_argument("--golden", help="golden question -> pages JSON file")
+    parser.add_argument("--seed-golden", help="write a BM25-seeded golden file for review and exit")
+    parser.add_argument("--chunk-tokens", type=parse_int_list, default=[150, 250, 400])
+    parser.add_argument("--overlaps", type=parse_int_list, default=[0, 25, 50])
+    parser.add_argument("--top-k", type=parse_int_list, default=[3, 5, 10])
+    parser.add_argument("--embed-backend", choices=["local", "openai"], default="local",
+                        help="local hash embedding (offline) or OpenAI through the embedding cache")
+    parser.add_argument("--vector-backend", choices=["numpy", "chroma"], default="numpy")
+    parser.add_argument("--workdir", default=None, help="directory for indexes (default: sweep_workdir)")
+    parser.add_argument("--output", default=None, help="write the JSON report here")
+    args = parser.parse_args(argv)
+
+    files = [os.path.abspath(path) for path in args.files]
+    golden_path = os.path.abspath(args.golden) if args.golden else None
+    seed_path = os.path.abspath(args.seed_golden) if args.seed_golden else None
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir or "sweep_workdir")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    os.environ["VECTOR_BACKEND"] = args.vector_backend
+    setup_offline_backends(workdir, embed_backend=args.embed_backend)
+
+    if seed_path:
+        from query_index import QUESTIONS
+
+        golden = seed_golden(files, QUESTIONS)
+        with open(seed_path, "w", encoding="utf-8") as f:
+            json.dump(golden, f, ensure_ascii=False, indent=2)
+        print(f"Seeded {len(golden['questions'])} golden questions to {seed_path}, review the pages before use")
+        return golden
+
+    if not golden_path:
+        parser.error("--golden is required unless --seed-golden is given")
+    with open(golden_path, "r", encoding="utf-8") as f:
+        golden = json.load(f)["questions"]
+
+    from parse_document import extract_pages, hash_file_chunked
+
+    rows = []
+    for file_path in files:
+        document_hash = hash_file_chunked(file_path)
+        pages = extract_pages(file_path)
+        for chunk_tokens, overlap in itertools.product(args.chunk_tokens, args.overlaps):
+            if overlap >= chunk_tokens:
+                continue
+            name = f"sweep-{document_hash[:12]}-{chunk_tokens}-{overlap}"
+            index, stats = ingest(file_path, pages, document_hash, name, chunk_tokens, overlap)
+            for top_k in args.top_k:
+                result = evaluate(index, golden, document_hash, top_k)
+                rows.append({
+                    "document": os.path.basename(file_path),
+                    "chunk_tokens": chunk_tokens,
+                    "overlap": overlap,
+                    "top_k": top_k,
+                    **stats,
+                    "p95_ms": result["latency"].get("p95_ms"),
+                    "recall_at_k": result["recall_at_k"],
+                    "hit_rate": result["hit_rate"],
+                    "latency": result["latency"],
+                    "questions": result["questions"],
+                })
+
+    print(format_table(rows))
+    report = {
+        "commit": git_commit(),
+        "parameters": vars(args),
+        "rows": rows,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import app
+from answer_cache import AnswerCache, normalize_query
+
+
+class KeywordEmbedding:
+    """Query embeddings from a fixed vocabulary, so similar questions get close vectors."""
+
+    VOCABULARY = ["retrieval", "generation", "chunk", "size"]
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_query_embedding(self, query):
+        self.calls += 1
+        return [float(word in query.lower()) for word in self.VOCABULARY]
+
+
+def test_identical_questions_hit_after_normalization():
+    cache = AnswerCache(maxsize=8)
+    cache.store("doc-a", "What is retrieval?", ("semantic", 5), "An answer.")
+
+    assert normalize_query("  What   is RETRIEVAL ?! ") == "what is retrieval"
+    assert cache.lookup("doc-a", "what is   retrieval", ("semantic", 5)) == "An answer."
+    assert cache.lookup("doc-b", "What is retrieval?", ("semantic", 5)) is None
+    assert cache.lookup("doc-a", "What is generation?", ("semantic", 5)) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+
+
+def test_changing_strategy_or_top_k_misses():
+    cache = AnswerCache(maxsize=8)
+    cache.store("doc-a", "What is retrieval?", ("semantic", 5), "semantic answer")
+
+    assert cache.lookup("doc-a", "What is retrieval?", ("sentence_window", 5)) is None
+    assert cache.lookup("doc-a", "What is retrieval?", ("semantic", 3)) is None
+    cache.store("doc-a", "What is retrieval?", ("sentence_window", 5), "window answer")
+    assert cache.lookup("doc-a", "What is retrieval?", ("sentence_window", 5)) == "window answer"
+    assert cache.lookup("doc-a", "What is retrieval?", ("semantic", 5)) == "semantic answer"
+
+
+def test_invalidate_drops_only_that_document():
+    embed_model = KeywordEmbedding()
+    cache = AnswerCache(maxsize=8, similarity_threshold=0.9, embed_model=embed_model)
+    cache.store("doc-a", "What is retrieval?", ("semantic", 5), "a")
+    cache.store("doc-b", "What is retrieval?", ("semantic", 5), "b")
+
+    cache.invalidate("doc-a")
+    assert cache.lookup("doc-a", "What is retrieval?", ("semantic", 5)) is None
+    assert cache.lookup("doc-a", "Explain retrieval", ("semantic", 5)) is None  # no near-duplicate left either
+    assert cache.lookup("doc-b", "What is retrieval?", ("semantic", 5)) == "b"
+
+
+def test_near_duplicate_questions_hit_above_the_threshold():
+    embed_model = KeywordEmbedding()
+    cache = AnswerCache(maxsize=8, similarity_threshold=0.9, embed_model=lambda: embed_model)
+    cache.store("doc-a", "How does retrieval work?", ("semantic", 5), "answer")
+
+    assert cache.lookup("doc-a", "Explain retrieval", ("semantic", 5)) == "answer"
+    assert cache.lookup("doc-a", "Explain retrieval generation", ("semantic", 5)) is None  # cosine 0.71
+    assert cache.lookup("doc-a", "Explain retrieval", ("hybrid", 5)) is None
+    assert embed_model.calls == 3  # the params miss has no candidates to compare against
+
+
+def test_record_stores_complete_streams_only():
+    cache = AnswerCache(maxsize=8)
+    stream = cache.record("doc-a", "q", ("semantic", 5), iter(["An ", "answer."]))
+    assert list(stream) == ["An ", "answer."]
+    assert cache.lookup("doc-a", "q", ("semantic", 5)) == "An answer."
+
+    interrupted = cache.record("doc-a", "other", ("semantic", 5), iter(["partial ", "answer"]))
+    assert next(interrupted) == "partial "
+    interrupted.close()
+    assert cache.lookup("doc-a", "other", ("semantic", 5)) is None
+
+
+def test_strategy_build_invalidates_cached_answers(monkeypatch):
+    cache = AnswerCache(maxsize=8)
+    cache.store("doc-a", "q", ("sentence_window", 5), "stale")
+    monkeypatch.setattr(app, "answer_cache", cache)
+    monkeypatch.setattr(app, "build_strategy_index", lambda *args, **kwargs: None)
+
+    app.build_strategy_worker("doc-a", "sentence_window")
+    assert cache.lookup("doc-a", "q", ("sentence_window", 5)) is None
@@ -0,0 +1,67 @@
+from parse_document import CHARS_PER_TOKEN, chunk_id, iter_chunks
+
+# Ten sentences of 20 characters each, "Sentence number 00." ... "Sentence number 09."
+SENTENCES = [f"Sentence number {i:02d}." for i in range(10)]
+
+
+def page(number, sentences):
+    return {"page_number": number, "text": " ".join(sentences)}
+
+
+def test_chunks_cut_on_sentences_and_match_their_offsets():
+    pages = [page(1, SENTENCES)]
+    chunks = list(iter_chunks(pages, max_tokens=16, overlap_tokens=0))  # 64 characters: three sentences
+
+    assert [chunk["text"] for chunk in chunks] == [
+        " ".join(SENTENCES[0:3]), " ".join(SENTENCES[3:6]), " ".join(SENTENCES[6:9]), SENTENCES[9],
+    ]
+    for chunk in chunks:
+        assert len(chunk["text"]) <= 16 * CHARS_PER_TOKEN
+        assert chunk["text"] == pages[0]["text"][chunk["start_char"]:chunk["end_char"]]
+        assert chunk["page_number"] == chunk["page_end"] == 1
+
+
+def test_consecutive_chunks_share_trailing_sentences():
+    chunks = list(iter_chunks([page(1, SENTENCES)], max_tokens=16, overlap_tokens=6))  # 24 characters of overlap
+
+    assert [chunk["text"] for chunk in chunks] == [
+        " ".join(SENTENCES[0:3]), " ".join(SENTENCES[2:5]), " ".join(SENTENCES[4:7]),
+        " ".join(SENTENCES[6:9]), " ".join(SENTENCES[8:10]),
+    ]
+    # The overlap is whole sentences, so each chunk starts where a sentence of the previous one did
+    for previous, current in zip(chunks, chunks[1:]):
+        assert previous["start_char"] < current["start_char"] < previous["end_char"]
+
+
+def test_chunks_stop_at_page_ends_unless_spanning_pages():
+    pages = [page(1, SENTENCES[:4]), page(2, SENTENCES[4:6])]
+
+    per_page = list(iter_chunks(pages, max_tokens=16, overlap_tokens=0))
+    assert [(c["page_number"], c["page_end"], c["text"]) for c in per_page] == [
+        (1, 1, " ".join(SENTENCES[0:3])), (1, 1, SENTENCES[3]), (2, 2, " ".join(SENTENCES[4:6])),
+    ]
+
+    spanning = list(iter_chunks(pages, max_tokens=16, overlap_tokens=0, span_pages=True))
+    crossing = spanning[1]
+    assert crossing["text"] == " ".join(SENTENCES[3:6])
+    assert (crossing["page_number"], crossing["page_end"]) == (1, 2)
+    # Offsets are in the start and end page respectively
+    assert crossing["start_char"] == pages[0]["text"].index(SENTENCES[3])
+    assert crossing["end_char"] == len(pages[1]["text"])
+
+
+def test_overlong_sentences_are_split_on_whitespace():
+    words = " ".join(["word"] * 30) + "."  # 150 characters without a sentence break
+    chunks = list(iter_chunks([{"page_number": 3, "text": words}], max_tokens=10, overlap_tokens=0))
+
+    assert len(chunks) > 1
+    assert all(len(chunk["text"]) <= 10 * CHARS_PER_TOKEN for chunk in chunks)
+    assert " ".join(chunk["text"] for chunk in chunks) == words
+
+
+def test_chunk_ids_depend_on_document_and_position_only():
+    chunk = next(iter_chunks([page(1, SENTENCES)], max_tokens=16, overlap_tokens=0))
+    same_position = dict(chunk, text="edited text")
+    assert chunk_id("hash-a", chunk) == chunk_id("hash-a", same_position)
+    assert chunk_id("hash-a", chunk) != chunk_id("hash-b", chunk)
+    assert chunk_id("hash-a", chunk) != chunk_id("hash-a", dict(chunk, end_char=chunk["end_char"] - 1))
@@ -0,0 +1,60 @@
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from context_selection import ContextMerger, merge_adjacent_nodes
+
+PAGE_ONE = "Retrieval augmented generation combines a retriever with a generator model."
+PAGE_TWO = "The generator conditions on passages fetched from an index of documents."
+
+
+def chunk(node_id, text, page, start, end, score, document="doc-a", page_end=None):
+    metadata = {"document_hash": document, "source": f"{document}.pdf", "page_number": page, "start_char": start, "end_char": end}
+    if page_end is not None:
+        metadata["page_end"] = page_end
+    return NodeWithScore(node=TextNode(id_=node_id, text=text, metadata=metadata), score=score)
+
+
+def test_overlapping_spans_merge_without_duplicated_text():
+    first = chunk("a", PAGE_ONE[:40], 1, 0, 40, 0.5)
+    second = chunk("b", PAGE_ONE[25:], 1, 25, len(PAGE_ONE), 0.9)
+    [merged] = merge_adjacent_nodes([second, first])
+
+    assert merged.node.get_content() == PAGE_ONE
+    assert merged.score == 0.9
+    metadata = merged.node.metadata
+    assert (metadata["page_number"], metadata["page_end"]) == (1, 1)
+    assert (metadata["start_char"], metadata["end_char"]) == (0, len(PAGE_ONE))
+    assert metadata["merged_chunks"] == 2
+    assert "page_end" in merged.node.excluded_llm_metadata_keys
+
+
+def test_adjacent_chunks_on_consecutive_pages_merge_into_a_page_range():
+    # A chunk ending on page 2 followed by one starting where it ended
+    crossing = chunk("a", PAGE_ONE + " " + PAGE_TWO[:30], 1, 0, 30, 0.4, page_end=2)
+    following = chunk("b", PAGE_TWO[30:], 2, 30, len(PAGE_TWO), 0.6)
+    [merged] = merge_adjacent_nodes([crossing, following])
+
+    assert merged.node.get_content() == PAGE_ONE + " " + PAGE_TWO[:30] + " " + PAGE_TWO[30:]
+    assert (merged.node.metadata["page_number"], merged.node.metadata["page_end"]) == (1, 2)
+    assert "page_end" not in merged.node.excluded_llm_metadata_keys
+
+
+def test_chunks_on_different_pages_with_a_gap_stay_apart():
+    end_of_page_one = chunk("a", PAGE_ONE[40:], 1, 40, len(PAGE_ONE), 0.3)
+    start_of_page_two = chunk("b", PAGE_TWO[:30], 2, 0, 30, 0.8)
+    passages = merge_adjacent_nodes([end_of_page_one, start_of_page_two])
+    assert [p.node.node_id for p in passages] == ["b", "a"]
+
+
+def test_chunks_of_different_documents_are_never_merged():
+    left = chunk("a", PAGE_ONE[:40], 1, 0, 40, 0.7, document="doc-a")
+    right = chunk("b", PAGE_ONE[25:], 1, 25, len(PAGE_ONE), 0.8, document="doc-b")
+    passages = merge_adjacent_nodes([left, right])
+    assert [p.node.node_id for p in passages] == ["b", "a"]
+    assert all("merged_chunks" not in p.node.metadata for p in passages)
+
+
+def test_nodes_without_positions_pass_through():
+    plain = NodeWithScore(node=TextNode(id_="plain", text="no offsets"), score=0.95)
+    positioned = chunk("a", PAGE_ONE, 1, 0, len(PAGE_ONE), 0.5)
+    passages = ContextMerger().postprocess_nodes([positioned, plain])
+    assert [p.node.node_id for p in passages] == ["plain", "a"]
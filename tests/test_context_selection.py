@@ -0,0 +1,88 @@
+import pytest
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+import build_index
+from context_selection import ContextSelector, mmr_select, score_select
+
+QUERY = [1.0, 0.0, 0.0]
+BEST = [1.0, 0.1, 0.0]
+NEAR_DUPLICATE = [1.0, 0.1, 0.0]
+DIVERSE = [0.6, 0.0, 0.8]
+
+
+def test_mmr_prefers_a_diverse_candidate_over_a_near_duplicate():
+    embeddings = [BEST, NEAR_DUPLICATE, DIVERSE]
+    assert mmr_select(QUERY, embeddings, 3, [1, 1, 1], mmr_lambda=1.0) == [0, 1, 2]
+    assert mmr_select(QUERY, embeddings, 3, [1, 1, 1], mmr_lambda=0.3) == [0, 2, 1]
+    assert mmr_select(QUERY, embeddings, 2, [1, 1, 1], mmr_lambda=0.3) == [0, 2]
+
+
+def test_mmr_token_budget_skips_candidates_that_no_longer_fit():
+    embeddings = [BEST, [0.9, 0.3, 0.0], [0.8, 0.0, 0.5]]
+    assert mmr_select(QUERY, embeddings, 3, [10, 20, 5], token_budget=16, mmr_lambda=1.0) == [0, 2]
+    # The best candidate is kept even when it alone exceeds the budget
+    assert mmr_select(QUERY, embeddings, 3, [50, 20, 20], token_budget=10, mmr_lambda=1.0) == [0]
+
+
+def test_mmr_relative_cutoff_drops_weak_candidates():
+    embeddings = [QUERY, [0.9, 0.43589, 0.0], [0.5, 0.86603, 0.0]]  # similarities 1.0, 0.9, 0.5
+    assert mmr_select(QUERY, embeddings, 3, [1, 1, 1], mmr_lambda=1.0, relative_cutoff=0.8) == [0, 1]
+    assert mmr_select(QUERY, embeddings, 3, [1, 1, 1], mmr_lambda=1.0, min_similarity=0.95) == [0]
+    assert mmr_select(QUERY, embeddings, 3, [1, 1, 1], mmr_lambda=1.0) == [0, 1, 2]
+
+
+def test_score_select_orders_by_score_within_the_limits():
+    scores = [0.5, 0.9, 0.85, 0.3]
+    assert score_select(scores, 4, [1, 1, 1, 1]) == [1, 2, 0, 3]
+    assert score_select(scores, 4, [1, 1, 1, 1], relative_cutoff=0.5) == [1, 2, 0]
+    assert score_select(scores, 4, [10, 10, 10, 1], token_budget=12) == [1, 3]
+    assert score_select(scores, 2, [1, 1, 1, 1]) == [1, 2]
+
+
+class RecordingEmbedding:
+    def __init__(self):
+        self.batches = []
+
+    def get_text_embedding_batch(self, texts):
+        self.batches.append(texts)
+        return [DIVERSE for _ in texts]
+
+
+def node(node_id, embedding=None, score=1.0):
+    return NodeWithScore(node=TextNode(id_=node_id, text=f"text of {node_id}", embedding=embedding), score=score)
+
+
+def test_selector_reuses_retrieved_and_stored_vectors(monkeypatch):
+    embed_model = RecordingEmbedding()
+    lookups = []
+
+    def stored_embeddings(nodes):
+        lookups.append([node.node_id for node in nodes])
+        return {"stored": NEAR_DUPLICATE}
+
+    monkeypatch.setattr(build_index, "get_embed_model", lambda: embed_model)
+    monkeypatch.setattr(build_index, "stored_embeddings", stored_embeddings)
+    selector = ContextSelector(top_k=2, token_budget=None, mmr_lambda=0.3, relative_cutoff=0.0)
+    query = QueryBundle(query_str="question", embedding=QUERY)
+
+    picked = selector.postprocess_nodes([node("retrieved", BEST), node("stored")], query_bundle=query)
+    assert [n.node.node_id for n in picked] == ["retrieved", "stored"]
+    assert lookups == [["stored"]]
+    assert embed_model.batches == []
+
+    # Only candidates neither retrieved with a vector nor in the store are embedded
+    picked = selector.postprocess_nodes(
+        [node("retrieved", BEST), node("stored"), node("unknown")], query_bundle=query
+    )
+    assert [n.node.node_id for n in picked] == ["retrieved", "unknown"]
+    assert embed_model.batches == [["text of unknown"]]
+
+
+def test_selector_without_diversity_never_embeds(monkeypatch):
+    monkeypatch.setattr(build_index, "get_embed_model", pytest.fail)
+    selector = ContextSelector(top_k=2, token_budget=None, relative_cutoff=0.0, diversify=False)
+    picked = selector.postprocess_nodes(
+        [node("a", score=0.2), node("b", score=0.9), node("c", score=0.5)],
+        query_bundle=QueryBundle(query_str="question"),
+    )
+    assert [n.node.node_id for n in picked] == ["b", "c"]
@@ -0,0 +1,37 @@
+import pytest
+from starlette.testclient import TestClient
+
+import app
+import asgi
+import build_index
+from corpus_search import CorpusScopeError, check_corpus_scope
+
+
+@pytest.fixture(autouse=True)
+def per_document_layout(monkeypatch):
+    monkeypatch.setattr(build_index, "CHROMA_LAYOUT", "per_document")
+
+
+@pytest.mark.parametrize("hashes", [[], ["hash-a", "hash-b"]])
+def test_tenant_is_rejected_in_the_per_document_layout(hashes):
+    with pytest.raises(CorpusScopeError):
+        check_corpus_scope(hashes, tenant="acme")
+    check_corpus_scope(hashes, tenant=None)
+
+
+def test_tenant_is_accepted_in_the_shared_layout(monkeypatch):
+    monkeypatch.setattr(build_index, "CHROMA_LAYOUT", "shared")
+    check_corpus_scope(["hash-a"], tenant="acme")
+
+
+@pytest.mark.parametrize("hashes", [[], ["hash-a"]])
+def test_search_answers_400_for_an_unsupported_scope(hashes):
+    body = {"query": "What is RAG?", "hashes": hashes, "tenant": "acme"}
+
+    flask_response = app.app.test_client().post("/search", json=body)
+    assert flask_response.status_code == 400
+    assert "CHROMA_LAYOUT=shared" in flask_response.get_json()["error"]
+
+    asgi_response = TestClient(asgi.app).post("/search", json=body)
+    assert asgi_response.status_code == 400
+    assert "CHROMA_LAYOUT=shared" in asgi_response.json()["error"]
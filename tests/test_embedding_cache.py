@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+import embedding_cache
+from embedding_cache import CachedEmbedding, EmbeddingStore, LocalHashEmbedding
+
+
+def last_used(path):
+    with sqlite3.connect(path) as conn:
+        return dict(conn.execute("SELECT key, last_used FROM embeddings"))
+
+
+def test_hits_buffer_access_times_until_flushed(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    store = EmbeddingStore(path)
+    store.put_many({"a": [1.0, 0.0], "b": [0.0, 1.0]})
+    stored = last_used(path)
+
+    changes = store._conn.total_changes
+    assert store.get_many(["a", "b", "missing"]) == {"a": [1.0, 0.0], "b": [0.0, 1.0]}
+    assert store._conn.total_changes == changes  # a read writes nothing
+    assert last_used(path) == stored
+
+    store.flush()
+    assert all(last_used(path)[key] > stored[key] for key in ("a", "b"))
+    stats = store.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 2, 1)
+
+
+def test_buffered_access_times_are_flushed_once_enough_accumulate(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "TOUCH_FLUSH_SIZE", 3)
+    path = str(tmp_path / "cache.sqlite3")
+    store = EmbeddingStore(path)
+    store.put_many({key: [1.0] for key in "abc"})
+    stored = last_used(path)
+
+    store.get_many(["a", "b"])
+    assert last_used(path) == stored
+    store.get_many(["c"])
+    assert all(last_used(path)[key] > stored[key] for key in "abc")
+
+
+def test_eviction_drops_least_recently_used_rows(tmp_path, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "EVICT_SLACK", 0.0)
+    path = str(tmp_path / "cache.sqlite3")
+    store = EmbeddingStore(path, max_entries=3)
+    store.put_many({"a": [1.0]})
+    store.put_many({"b": [2.0]})
+    store.put_many({"c": [3.0]})
+    store.put_many({"a": [1.0]})  # already stored: not counted twice
+    assert store.stats()["entries"] == 3
+
+    store.get_many(["a"])  # buffered, written with the next put
+    store.put_many({"d": [4.0]})
+    assert sorted(last_used(path)) == ["a", "c", "d"]
+    assert store.stats()["entries"] == 3
+
+    # Rows written by another process are picked up when the cap is reached
+    with sqlite3.connect(path) as conn:
+        conn.execute("INSERT INTO embeddings VALUES ('other', x'0000803f', 0)")
+    assert EmbeddingStore(path, max_entries=3).stats()["entries"] == 4
+    store.put_many({"e": [5.0]})
+    assert len(last_used(path)) == 3 and "other" not in last_used(path)
+
+
+def test_cached_embedding_only_embeds_missing_texts(tmp_path):
+    inner = LocalHashEmbedding()
+    calls = []
+    batch = inner.get_text_embedding_batch
+
+    class Recording(LocalHashEmbedding):
+        def _get_text_embeddings(self, texts):
+            calls.append(list(texts))
+            return batch(texts)
+
+    model = CachedEmbedding(Recording(), EmbeddingStore(str(tmp_path / "cache.sqlite3")))
+    first = model.get_text_embedding_batch(["alpha", "beta"])
+    second = model.get_text_embedding_batch(["beta", "gamma", "alpha"])
+    assert calls == [["alpha", "beta"], ["gamma"]]
+    assert second[0] == pytest.approx(first[1]) and second[2] == pytest.approx(first[0])
@@ -0,0 +1,212 @@
+import os
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from embedding_scheduler import EmbeddingScheduler
+
+
+def vector(text):
+    return [float(len(text)), 1.0]
+
+
+class RateLimited(Exception):
+    """Shaped like an HTTP 429 of the OpenAI SDK or httpx."""
+
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Rate limit reached")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"retry-after": str(retry_after)}})()
+
+
+class BadRequest(Exception):
+    status_code = 400
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+def test_concurrent_callers_are_coalesced_into_one_batch():
+    batches = []
+
+    def embed_batch(texts):
+        batches.append(list(texts))
+        return [vector(text) for text in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=4, max_wait=5.0)
+    results = {}
+    callers = [
+        threading.Thread(target=lambda name=name, texts=texts: results.__setitem__(name, scheduler.embed(texts)))
+        for name, texts in [("a", ["a", "aa"]), ("b", ["bbb"]), ("c", ["cccc"])]
+    ]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(timeout=5)
+
+    assert [len(batch) for batch in batches] == [4]
+    assert results == {"a": [vector("a"), vector("aa")], "b": [vector("bbb")], "c": [vector("cccc")]}
+    assert scheduler.stats()["batches"] == 1
+
+
+def test_urgent_texts_skip_queued_ingestion_work():
+    batches = []
+    gate = threading.Event()
+
+    def embed_batch(texts):
+        batches.append(list(texts))
+        gate.wait(5)
+        return [vector(text) for text in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=2, max_in_flight=1, max_wait=0.0)
+    threads = [threading.Thread(target=scheduler.embed, args=(["doc-1", "doc-2"],))]
+    threads[0].start()
+    wait_until(lambda: len(batches) == 1)  # the only slot is taken
+
+    threads.append(threading.Thread(target=scheduler.embed, args=(["doc-3", "doc-4", "doc-5", "doc-6"],)))
+    threads[1].start()
+    wait_until(lambda: scheduler.stats()["queue_depth"] == 4)
+    threads.append(threading.Thread(target=scheduler.embed, args=(["query"],), kwargs={"urgent": True}))
+    threads[2].start()
+    wait_until(lambda: scheduler.stats()["queue_depth"] == 5)
+
+    gate.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert batches[1][0] == "query"
+    assert sorted(text for batch in batches for text in batch) == sorted(
+        ["doc-1", "doc-2", "doc-3", "doc-4", "doc-5", "doc-6", "query"]
+    )
+
+
+def test_rate_limit_pauses_retries_and_halves_the_concurrency_limit():
+    calls = []
+
+    def embed_batch(texts):
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise RateLimited(retry_after=0.2)
+        return [vector(text) for text in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=2, max_in_flight=4, max_wait=0.0)
+    assert scheduler.embed(["a", "bb"]) == [vector("a"), vector("bb")]
+
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 0.2  # Retry-After is honoured
+    stats = scheduler.stats()
+    assert stats["throttled"] == 1
+    assert stats["retries"] == 1
+    assert stats["concurrency_limit"] == 2
+
+
+def test_failed_batches_raise_after_the_last_retry():
+    def embed_batch(texts):
+        raise RuntimeError("connection reset")
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=2, max_wait=0.0, max_retries=1, backoff=0.01)
+    with pytest.raises(RuntimeError, match="connection reset"):
+        scheduler.embed(["a", "b"])
+    assert scheduler.stats()["errors"] == 1
+
+
+def test_fewer_vectors_than_texts_fails_instead_of_hanging():
+    scheduler = EmbeddingScheduler(lambda texts: [vector(texts[0])], batch_size=3, max_wait=0.0, max_retries=0)
+    with pytest.raises(ValueError, match="1 vectors for 3 texts"):
+        scheduler.embed(["a", "b", "c"])
+
+
+def test_bad_input_of_one_caller_does_not_fail_coalesced_callers():
+    batches = []
+
+    def embed_batch(texts):
+        batches.append(list(texts))
+        if "bad" in texts:
+            raise BadRequest("invalid input")
+        return [vector(text) for text in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=3, max_wait=5.0, backoff=30.0)
+    results = {}
+
+    def call(name, texts):
+        try:
+            results[name] = scheduler.embed(texts)
+        except Exception as e:
+            results[name] = e
+
+    callers = [threading.Thread(target=call, args=args) for args in [("good", ["a", "bb"]), ("bad", ["bad"])]]
+    start = time.monotonic()
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join(timeout=5)
+
+    assert time.monotonic() - start < 5  # neither split retries nor a 4xx wait for the backoff
+    assert results["good"] == [vector("a"), vector("bb")]
+    assert isinstance(results["bad"], BadRequest)
+    assert len(batches[0]) == 3 and sorted(map(len, batches[1:])) == [1, 2]
+    assert scheduler.stats()["throttled"] == 0
+
+
+def test_failing_batches_do_not_hold_back_urgent_queries():
+    def embed_batch(texts):
+        if "doc" in texts:
+            raise ConnectionError("upstream reset")
+        return [vector(text) for text in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=2, max_wait=0.0, backoff=30.0)
+    threading.Thread(target=lambda: pytest.raises(Exception, scheduler.embed, ["doc"]), daemon=True).start()
+    wait_until(lambda: scheduler.stats()["retries"] == 1)  # waiting out its backoff
+
+    start = time.monotonic()
+    assert scheduler.embed(["query"], urgent=True) == [vector("query")]
+    assert time.monotonic() - start < 1
+    scheduler.close()
+
+
+def test_close_fails_queued_texts_and_new_calls():
+    gate = threading.Event()
+
+    def embed_batch(texts):
+        gate.wait(5)
+        return [vector(text) for text in texts]
+
+    scheduler = EmbeddingScheduler(embed_batch, batch_size=1, max_in_flight=1, max_wait=0.0)
+    errors = []
+    thread = threading.Thread(target=lambda: errors.append(pytest.raises(RuntimeError, scheduler.embed, ["a", "b", "c"])))
+    thread.start()
+    wait_until(lambda: scheduler.stats()["queue_depth"] == 2)
+
+    scheduler.close()
+    gate.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive() and errors
+    with pytest.raises(RuntimeError, match="closed"):
+        scheduler.embed(["d"])
+
+
+def test_interpreter_exit_does_not_hang_on_queued_texts():
+    script = textwrap.dedent("""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from embedding_scheduler import EmbeddingScheduler
+
+        def embed_batch(texts):
+            time.sleep(0.2)
+            return [[1.0] for _ in texts]
+
+        scheduler = EmbeddingScheduler(embed_batch, batch_size=2, max_in_flight=1, max_wait=0.0)
+        ThreadPoolExecutor(1).submit(scheduler.embed, [str(i) for i in range(20)])
+        time.sleep(0.05)
+    """)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script], cwd=root, timeout=20, check=True, capture_output=True)
@@ -0,0 +1,90 @@
+import builtins
+
+import pytest
+
+import parse_document
+from parse_document import extract_html_pages, iter_html_pages, iter_pages
+
+DOCUMENT = """<!DOCTYPE html>
+<html><head><title>Guide</title><style>body { color: red; }</style></head>
+<body>
+<p>Intro before any heading.</p>
+<h1>Retrieval</h1><p>Dense &amp; sparse retrievers.</p>
+<script>var ignored = "<h2>not a heading</h2>";</script>
+<h2>Chunking</h2><p>Split on<br/>sentences.</p>
+<h4>Details</h4><p>Minor headings stay in their section.</p>
+<h3>Ranking</h3><p>Fuse the lists.</p>
+</body></html>
+"""
+
+EXPECTED = [
+    "Guide Intro before any heading.",
+    "Retrieval Dense & sparse retrievers.",
+    "Chunking Split on sentences. Details Minor headings stay in their section.",
+    "Ranking Fuse the lists.",
+]
+
+
+@pytest.fixture
+def html_file(tmp_path):
+    path = tmp_path / "guide.html"
+    path.write_text(DOCUMENT, encoding="utf-8")
+    return str(path)
+
+
+def test_sections_start_at_h1_to_h3(html_file):
+    pages = extract_html_pages(html_file)
+    assert [page["text"] for page in pages] == EXPECTED
+    assert [page["page_number"] for page in pages] == [1, 2, 3, 4]
+    assert list(iter_pages(html_file)) == pages
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 50])
+def test_tags_and_entities_split_across_blocks(html_file, monkeypatch, read_size):
+    monkeypatch.setattr(parse_document, "HTML_READ_SIZE", read_size)
+    assert [page["text"] for page in iter_html_pages(html_file)] == EXPECTED
+
+
+def test_long_sections_are_split_on_whitespace(tmp_path):
+    path = tmp_path / "long.html"
+    words = " ".join(f"word{i:03d}" for i in range(100))  # 799 characters
+    path.write_text(f"<h1>Long</h1><p>{words}</p>", encoding="utf-8")
+
+    pages = list(iter_html_pages(str(path), max_section_chars=100))
+    assert len(pages) > 7
+    assert all(len(page["text"]) <= 100 for page in pages)
+    assert " ".join(page["text"] for page in pages) == f"Long {words}"
+
+
+def test_pages_are_yielded_before_the_whole_file_is_read(tmp_path, monkeypatch):
+    path = tmp_path / "big.html"
+    path.write_text("".join(f"<h2>Section {i}</h2><p>Body {i}.</p>" for i in range(2000)), encoding="utf-8")
+    read = []
+
+    class CountingFile:
+        def __init__(self, f):
+            self.f = f
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.f.close()
+
+        def read(self, size):
+            block = self.f.read(size)
+            read.append(len(block))
+            return block
+
+    monkeypatch.setattr(parse_document, "HTML_READ_SIZE", 1024)
+    monkeypatch.setattr(parse_document, "open", lambda *a, **kw: CountingFile(builtins.open(*a, **kw)), raising=False)
+
+    pages = iter_html_pages(str(path))
+    assert next(pages) == {"page_number": 1, "text": "Section 0 Body 0."}
+    assert sum(read) == 1024
+    assert sum(1 for _ in pages) == 1999
+
+
+def test_missing_file_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        next(iter_html_pages(str(tmp_path / "missing.html")))
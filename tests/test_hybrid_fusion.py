@@ -0,0 +1,29 @@
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from hybrid_search import reciprocal_rank_fusion
+
+
+def ranked(*node_ids, source="keyword"):
+    return [NodeWithScore(node=TextNode(id_=node_id, text=f"{source} {node_id}"), score=1.0) for node_id in node_ids]
+
+
+def test_fused_scores_sum_reciprocal_ranks():
+    fused = reciprocal_rank_fusion([ranked("a", "b", "c"), ranked("b", "d", "a", source="vector")], top_k=10, k=60)
+
+    assert [node.node.node_id for node in fused] == ["b", "a", "d", "c"]
+    assert [node.score for node in fused] == pytest.approx([1 / 62 + 1 / 61, 1 / 61 + 1 / 63, 1 / 62, 1 / 63])
+    # A node found by both retrievers keeps the first list's copy
+    assert fused[0].node.get_content() == "keyword b"
+
+
+def test_ties_keep_first_seen_order_and_top_k_truncates():
+    fused = reciprocal_rank_fusion([ranked("x", "y"), ranked("z", "w", source="vector")], top_k=3, k=60)
+    assert [node.node.node_id for node in fused] == ["x", "z", "y"]
+    assert [node.score for node in fused] == pytest.approx([1 / 61, 1 / 61, 1 / 62])
+
+
+def test_rank_constant_damps_top_ranks():
+    lists = [ranked("a", "b"), ranked("b", "c", source="vector")]
+    assert reciprocal_rank_fusion(lists, top_k=1, k=0)[0].score == pytest.approx(1 / 2 + 1)
+    assert reciprocal_rank_fusion(lists, top_k=1, k=1000)[0].score == pytest.approx(1 / 1002 + 1 / 1001)
@@ -0,0 +1,12 @@
+import importlib
+
+import pytest
+
+# Entry points that must import without network access, API keys or optional
+# serving dependencies; clients and models are created lazily on first use.
+ENTRY_MODULES = ["app", "asgi", "benchmark", "sweep", "retrieval_strategies", "stub_embedding_server"]
+
+
+@pytest.mark.parametrize("module", ENTRY_MODULES)
+def test_entry_module_imports(module):
+    importlib.import_module(module)
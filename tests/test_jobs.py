@@ -0,0 +1,110 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobQueue, QueueFullError
+
+
+def wait_for(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.status not in ("succeeded", "failed"):
+        assert time.monotonic() < deadline, f"job still {job.status}"
+        time.sleep(0.005)
+    return job
+
+
+def wait_until_inactive(queue, document_hash, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while queue.active_job(document_hash) is not None:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_jobs_for_the_same_document_are_single_flight():
+    queue = JobQueue(max_workers=2)
+    release = threading.Event()
+    runs = []
+
+    def worker(name, progress=None):
+        runs.append(name)
+        progress("parse", 1.0)
+        release.wait(5)
+
+    job, created = queue.submit("hash-a", "a.pdf", worker, "first")
+    duplicate, duplicate_created = queue.submit("hash-a", "a.pdf", worker, "second")
+    other, other_created = queue.submit("hash-b", "b.pdf", worker, "other")
+    assert created and other_created and not duplicate_created
+    assert duplicate is job
+    assert queue.active_job("hash-a") is job
+
+    release.set()
+    wait_for(job)
+    wait_for(other)
+    assert job.status == "succeeded"
+    assert job.to_dict()["stages"]["parse"] == {"status": "done", "progress": 1.0}
+    assert sorted(runs) == ["first", "other"]
+
+    # A finished job no longer blocks a new one for the same document
+    wait_until_inactive(queue, "hash-a")
+    again, created = queue.submit("hash-a", "a.pdf", worker, "again")
+    assert created and again.id != job.id
+    assert queue.get(job.id) is job
+    wait_for(again)
+
+
+def test_submissions_beyond_max_pending_are_rejected():
+    queue = JobQueue(max_workers=1, max_pending=1)
+    release = threading.Event()
+    job, _ = queue.submit("hash-a", "a.pdf", lambda progress=None: release.wait(5))
+    with pytest.raises(QueueFullError):
+        queue.submit("hash-b", "b.pdf", lambda progress=None: None)
+    release.set()
+    wait_for(job)
+
+
+def test_failed_attempts_are_retried():
+    queue = JobQueue(max_workers=1, max_attempts=3, retry_backoff=0.0)
+    attempts = []
+
+    def flaky(progress=None):
+        attempts.append(len(attempts) + 1)
+        if len(attempts) < 3:
+            raise RuntimeError(f"attempt {len(attempts)} failed")
+
+    job, _ = queue.submit("hash-a", "a.pdf", flaky)
+    wait_for(job)
+    assert job.status == "succeeded"
+    assert job.attempts == 3
+    assert attempts == [1, 2, 3]
+
+
+def test_job_fails_with_the_last_error_after_max_attempts():
+    queue = JobQueue(max_workers=1, max_attempts=2, retry_backoff=0.0)
+
+    def broken(progress=None):
+        raise RuntimeError("parse error")
+
+    job, _ = queue.submit("hash-a", "a.pdf", broken)
+    wait_for(job)
+    assert job.status == "failed"
+    assert job.attempts == 2
+    assert job.error == "parse error"
+
+
+def test_jobs_with_their_own_key_run_beside_the_document_job():
+    queue = JobQueue(max_workers=3)
+    release = threading.Event()
+    worker = lambda progress=None: release.wait(5)
+
+    ingestion, _ = queue.submit("hash-a", "a.pdf", worker)
+    sentence_window, created_sw = queue.submit("hash-a", "a.pdf", worker, key="hash-a:sentence_window")
+    auto_merging, created_am = queue.submit("hash-a", "a.pdf", worker, key="hash-a:auto_merging")
+    assert created_sw and created_am
+    assert len({ingestion.id, sentence_window.id, auto_merging.id}) == 3
+    assert queue.active_job("hash-a") is ingestion
+    assert queue.active_job("hash-a:auto_merging") is auto_merging
+
+    release.set()
+    for job in (ingestion, sentence_window, auto_merging):
+        wait_for(job)
@@ -0,0 +1,67 @@
+import pytest
+
+from keyword_search import bm25_search, build_keyword_index, load_keyword_index, parse_query, save_keyword_index
+
+PAGES = [
+    {"page_number": 1, "text": "Retrieval augmented generation combines retrieval with generation."},
+    {"page_number": 2, "text": "Deep learning models. Deep reinforcement learning is different."},
+    {"page_number": 3, "text": "Retrieval, retrieval and more retrieval: a page about retrieval only."},
+    {"page_number": 4, "text": "Deep-learning, deep   learning and DEEP LEARNING are the same phrase."},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return build_keyword_index(PAGES)
+
+
+def test_pages_rank_by_bm25_term_frequency(index):
+    results = bm25_search(index, "retrieval")
+    assert [page for page, _, _ in results] == [3, 1]
+    assert results[0][1] > results[1][1] > 0
+    assert len(results[0][2]) == 4  # every occurrence is a match span
+
+
+def test_rarer_terms_weigh_more(index):
+    results = bm25_search(index, "generation deep")
+    scores = {page: score for page, score, _ in results}
+    # "generation" only occurs on one page, "deep" on two
+    assert scores[1] > scores[2]
+
+
+def test_phrases_require_adjacent_tokens(index):
+    results = bm25_search(index, '"deep learning"')
+    pages = {page: spans for page, _, spans in results}
+    # Page 2 has "Deep learning" once; "deep reinforcement learning" has a token in between
+    assert len(pages[2]) == 1
+    # Punctuation and whitespace between tokens don't break a phrase, case is folded
+    assert len(pages[4]) == 3
+    text = PAGES[3]["text"]
+    assert [text[start:end] for start, end in pages[4]] == ["Deep-learning", "deep   learning", "DEEP LEARNING"]
+
+
+def test_bare_words_are_split_into_phrases(index):
+    assert parse_query('deep "augmented generation" DeepSeek-V3') == [
+        ["deep"], ["augmented", "generation"], ["deepseek", "v3"],
+    ]
+    assert [page for page, _, _ in bm25_search(index, '"augmented generation"')] == [1]
+
+
+def test_top_k_limits_results(index):
+    assert len(bm25_search(index, "retrieval deep", top_k=2)) == 2
+
+
+@pytest.mark.parametrize("query", ["", "   ", '""', "!!!"])
+def test_empty_queries_match_nothing(index, query):
+    assert bm25_search(index, query) == []
+
+
+def test_unknown_terms_and_phrases_match_nothing(index):
+    assert bm25_search(index, "transformer") == []
+    assert bm25_search(index, '"generation retrieval"') == []  # both terms on page 1, never in this order
+
+
+def test_saved_index_answers_the_same(index, tmp_path):
+    path = str(tmp_path / "doc.index.json")
+    save_keyword_index(index, path)
+    assert bm25_search(load_keyword_index(path), '"deep learning" retrieval') == bm25_search(index, '"deep learning" retrieval')
@@ -0,0 +1,76 @@
+import json
+
+from keyword_search import MultiPatternMatcher, keyword_search_records, paginated_keyword_search, query_patterns
+
+
+def occurrences(matcher, text):
+    return sorted((text[start:end], matcher.patterns[pattern_id]) for start, end, pattern_id in matcher.finditer(text))
+
+
+def test_overlapping_and_nested_patterns_are_all_reported():
+    matcher = MultiPatternMatcher(["he", "she", "hers", "his"])
+    assert occurrences(matcher, "ushers") == [("he", "he"), ("hers", "hers"), ("she", "she")]
+
+
+def test_matching_folds_case_and_keeps_offsets_into_the_original_text():
+    matcher = MultiPatternMatcher(["RAG", "rag"])  # duplicates after folding collapse into one pattern
+    assert matcher.patterns == ["rag"]
+    text = "İstanbul RAG and Rag"  # "İ" lowercases to two characters
+    assert [text[start:end] for start, end, _ in matcher.finditer(text)] == ["RAG", "Rag"]
+
+
+def test_whole_words_drops_hits_inside_words():
+    text = "The bandwidth ID is set for id_x, (ID) and user-id."
+    loose = MultiPatternMatcher(["id"])
+    strict = MultiPatternMatcher(["id"], whole_words=True)
+    assert len(list(loose.finditer(text))) == 5
+    assert [text[start:end] for start, end, _ in strict.finditer(text)] == ["ID", "ID", "id"]
+
+
+def test_whole_words_checks_only_word_character_ends():
+    text = "C++ and c++11, a (note) and notes"
+    strict = MultiPatternMatcher(["c++", "(note"], whole_words=True)
+    assert [text[start:end] for start, end, _ in strict.finditer(text)] == ["C++", "c++", "(note"]
+
+
+def test_query_patterns_keep_quoted_phrases():
+    assert query_patterns('rag "vector   store" BM25') == ["rag", "vector store", "BM25"]
+
+
+def test_nearby_hits_share_one_snippet_with_highlights():
+    pages = [{"page_number": 3, "text": "alpha beta gamma " + "x" * 200 + " beta"}]
+    records = list(keyword_search_records(pages, "alpha beta", context_window=5))
+    assert len(records) == 2
+    first = records[0]
+    assert first["page_number"] == 3 and first["terms"] == ["alpha", "beta"]
+    assert [first["snippet"][start:end] for start, end in first["highlights"]] == ["alpha", "beta"]
+
+
+def pages_with_hits(count):
+    return [{"page_number": n, "text": f"page {n} mentions the keyword once"} for n in range(1, count + 1)]
+
+
+def read_page(pages, page, page_size):
+    lines = [json.loads(line) for line in paginated_keyword_search(pages, "keyword", page=page, page_size=page_size)]
+    return [line["page_number"] for line in lines[:-1]], lines[-1]
+
+
+def test_pagination_walks_all_records_and_ends_on_a_partial_page():
+    pages = pages_with_hits(7)
+    assert read_page(pages, 1, 3) == ([1, 2, 3], {"type": "page", "page": 1, "page_size": 3, "returned": 3, "has_more": True})
+    assert read_page(pages, 2, 3)[0] == [4, 5, 6]
+    assert read_page(pages, 3, 3) == ([7], {"type": "page", "page": 3, "page_size": 3, "returned": 1, "has_more": False})
+    assert read_page(pages, 4, 3)[1]["returned"] == 0
+
+
+def test_pagination_stops_reading_pages_once_full():
+    read = []
+
+    def lazy_pages():
+        for page in pages_with_hits(100):
+            read.append(page["page_number"])
+            yield page
+
+    records, summary = read_page(lazy_pages(), 1, 2)
+    assert records == [1, 2] and summary["has_more"]
+    assert read == [1, 2, 3]  # one extra record tells whether another page exists
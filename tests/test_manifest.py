@@ -0,0 +1,123 @@
+import os
+from typing import List
+
+import pytest
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.llms import MockLLM
+
+import build_index
+from embedding_cache import LocalHashEmbedding
+from manifest import IngestionManifest
+from parse_document import iter_documents
+
+
+class CountingEmbedding(LocalHashEmbedding):
+    """Offline embedding that records every text it embeds."""
+
+    embedded: List[str] = Field(default_factory=list)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return super()._get_text_embeddings(texts)
+
+
+@pytest.fixture
+def offline_index(tmp_path, monkeypatch):
+    """build_index writing to a numpy store and manifests under tmp_path, with offline models."""
+    embed_model = CountingEmbedding(embed_batch_size=2)
+    llm = MockLLM()
+    monkeypatch.setattr(build_index, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(build_index, "NUMPY_STORE_PATH", str(tmp_path / "numpy"))
+    monkeypatch.setattr(build_index, "MANIFEST_DIR", str(tmp_path / "manifests"))
+    monkeypatch.setattr(build_index, "_embed_model", embed_model)
+    monkeypatch.setattr(build_index, "_llm", llm)
+    monkeypatch.setattr(Settings, "_embed_model", embed_model)
+    monkeypatch.setattr(Settings, "_llm", llm)
+    return embed_model
+
+
+def documents(document_hash, pages=10, max_tokens=250):
+    records = [{"page_number": n, "text": f"Page {n} talks about topic {n}. It has two sentences."} for n in range(1, pages + 1)]
+    return list(iter_documents(records, "doc.pdf", document_hash, max_tokens=max_tokens))
+
+
+def interrupted(docs, after):
+    """Yield the first `after` documents, then fail like a crashed ingestion."""
+    for doc in docs[:after]:
+        yield doc
+    raise RuntimeError("worker killed")
+
+
+def test_manifest_round_trip(tmp_path):
+    path = IngestionManifest.path_for(str(tmp_path), "hash")
+    manifest = IngestionManifest(path, "hash", ["a", "b", "c"], params={"max_tokens": 250})
+    manifest.mark_written(["a", "c"])
+
+    loaded = IngestionManifest.load(str(tmp_path), "hash")
+    assert loaded.written_ids == {"a", "c"}
+    assert loaded.missing_ids() == ["b"]
+    assert loaded.progress() == pytest.approx(2 / 3)
+    assert not loaded.is_complete
+    assert loaded.params == {"max_tokens": 250}
+    assert loaded.stale_ids(["a", "b"]) == ["c"]
+
+    loaded.mark_written(["b"])
+    assert IngestionManifest.load(str(tmp_path), "hash").is_complete
+    assert IngestionManifest.load(str(tmp_path), "missing") is None
+
+
+def test_failed_save_keeps_the_previous_manifest(tmp_path, monkeypatch):
+    manifest = IngestionManifest(IngestionManifest.path_for(str(tmp_path), "hash"), "hash", ["a", "b"])
+    manifest.mark_written(["a"])
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("manifest.json.dump", crash)
+    with pytest.raises(OSError):
+        manifest.mark_written(["b"])
+
+    assert IngestionManifest.load(str(tmp_path), "hash").written_ids == {"a"}
+    assert os.listdir(tmp_path) == ["hash.json"]  # no temp file left behind
+
+
+def test_interrupted_ingestion_resumes_with_missing_chunks(offline_index):
+    docs = documents("resume-hash")
+    expected_ids = [doc.doc_id for doc in docs]
+
+    with pytest.raises(RuntimeError, match="worker killed"):
+        build_index.build_chroma_index(interrupted(docs, 5), "resume-hash", expected_ids=expected_ids)
+
+    manifest = IngestionManifest.load(build_index.MANIFEST_DIR, "resume-hash")
+    assert manifest.written_ids == set(expected_ids[:4])  # the fifth chunk was still in an unsent batch
+    assert not build_index.check_chroma_index("resume-hash")
+
+    offline_index.embedded.clear()
+    build_index.build_chroma_index(docs, "resume-hash", expected_ids=expected_ids)
+
+    assert len(offline_index.embedded) == len(docs) - 4
+    assert build_index.check_chroma_index("resume-hash")
+    assert IngestionManifest.load(build_index.MANIFEST_DIR, "resume-hash").is_complete
+    store = build_index.get_vector_store(build_index.collection_name("resume-hash"))
+    assert store.count() == len(docs)
+
+
+def test_changed_chunking_removes_stale_chunks(offline_index):
+    old_docs = documents("stale-hash", pages=3)
+    old_ids = [doc.doc_id for doc in old_docs]
+    with pytest.raises(RuntimeError):
+        build_index.build_chroma_index(interrupted(old_docs, 2), "stale-hash", expected_ids=old_ids)
+
+    # Chunks spanning pages get new ids, so the chunks of the first run are stale
+    records = [{"page_number": n, "text": f"Page {n} talks about topic {n}. It has two sentences."} for n in range(1, 4)]
+    new_docs = list(iter_documents(records, "doc.pdf", "stale-hash", span_pages=True))
+    new_ids = [doc.doc_id for doc in new_docs]
+    assert not set(new_ids) & set(old_ids[:2])
+
+    build_index.build_chroma_index(new_docs, "stale-hash", expected_ids=new_ids)
+
+    store = build_index.get_vector_store(build_index.collection_name("stale-hash"))
+    assert store.count() == len(new_ids)
+    manifest = IngestionManifest.load(build_index.MANIFEST_DIR, "stale-hash")
+    assert manifest.expected_ids == new_ids and manifest.is_complete
@@ -0,0 +1,140 @@
+import threading
+
+import numpy as np
+import pytest
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import FilterOperator, MetadataFilter, MetadataFilters, VectorStoreQuery
+
+import numpy_store
+from numpy_store import NUMPY_DTYPES, NumpyVectorStore, quantize
+
+# Worst-case cosine error of a stored row, per dtype
+TOLERANCE = {"float32": 1e-5, "float16": 1e-3, "int8": 2e-2}
+
+
+def make_nodes(count, dim=32, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    nodes = [
+        TextNode(id_=f"node-{i}", text=f"chunk {i}", metadata={"page_number": i % 3}, embedding=vectors[i].tolist())
+        for i in range(count)
+    ]
+    return nodes, vectors
+
+
+def cosine(matrix, query):
+    return matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+
+
+@pytest.mark.parametrize("dtype", NUMPY_DTYPES)
+def test_quantized_rows_round_trip_cosine_similarity(dtype):
+    _, vectors = make_nodes(50)
+    rows, scales = quantize(vectors, dtype)
+    assert rows.dtype == np.dtype(dtype)
+    query = vectors[0] / np.linalg.norm(vectors[0])
+    approx = (rows.astype(np.float32) @ query) * scales
+    assert np.abs(approx - cosine(vectors, vectors[0])).max() < TOLERANCE[dtype]
+
+
+@pytest.mark.parametrize("dtype", NUMPY_DTYPES)
+def test_query_returns_exact_top_k_after_reopening(tmp_path, dtype):
+    nodes, vectors = make_nodes(50)
+    NumpyVectorStore(str(tmp_path), dtype=dtype).add(nodes)
+
+    store = NumpyVectorStore(str(tmp_path))  # an existing collection keeps its dtype
+    assert store.dtype == dtype
+    result = store.query(VectorStoreQuery(query_embedding=vectors[7].tolist(), similarity_top_k=5))
+
+    expected = np.argsort(-cosine(vectors, vectors[7]))[:5]
+    assert result.ids[0] == "node-7"
+    assert result.similarities[0] == pytest.approx(1.0, abs=TOLERANCE[dtype])
+    assert set(result.ids[:3]) == {f"node-{i}" for i in expected[:3]}
+    assert result.nodes[0].get_content() == "chunk 7"
+    assert result.nodes[0].metadata["page_number"] == 7 % 3
+
+
+def test_deleted_and_replaced_rows(tmp_path):
+    nodes, vectors = make_nodes(10)
+    store = NumpyVectorStore(str(tmp_path))
+    store.add(nodes)
+
+    store.delete_nodes(["node-1", "node-2"])
+    assert store.count() == 8
+    result = store.query(VectorStoreQuery(query_embedding=vectors[1].tolist(), similarity_top_k=10))
+    assert "node-1" not in result.ids and "node-2" not in result.ids
+
+    # Writing a deleted id again brings it back, once
+    store.add([nodes[1]])
+    assert NumpyVectorStore(str(tmp_path)).count() == 9
+    result = store.query(VectorStoreQuery(query_embedding=vectors[1].tolist(), similarity_top_k=1))
+    assert result.ids == ["node-1"]
+
+    store.clear()
+    assert store.count() == 0
+
+
+def test_results_and_lookups_carry_the_stored_vectors(tmp_path):
+    nodes, vectors = make_nodes(10)
+    store = NumpyVectorStore(str(tmp_path), dtype="float32")
+    store.add(nodes)
+    store.delete_nodes(["node-4"])
+
+    result = store.query(VectorStoreQuery(query_embedding=vectors[3].tolist(), similarity_top_k=2))
+    assert result.nodes[0].node_id == "node-3"
+    assert cosine(np.asarray([result.nodes[0].embedding]), vectors[3])[0] == pytest.approx(1.0, abs=1e-5)
+
+    stored = store.get_embeddings(["node-2", "node-4", "missing"])
+    assert set(stored) == {"node-2"}
+    assert np.linalg.norm(stored["node-2"]) == pytest.approx(1.0, abs=1e-5)
+    assert cosine(np.asarray([stored["node-2"]]), vectors[2])[0] == pytest.approx(1.0, abs=1e-5)
+
+def test_metadata_filters(tmp_path):
+    nodes, vectors = make_nodes(12)
+    store = NumpyVectorStore(str(tmp_path))
+    store.add(nodes)
+
+    filters = MetadataFilters(filters=[MetadataFilter(key="page_number", value=1)])
+    assert store.count(filters=filters) == 4
+    result = store.query(VectorStoreQuery(query_embedding=vectors[0].tolist(), similarity_top_k=12, filters=filters))
+    assert sorted(result.ids) == sorted(f"node-{i}" for i in range(12) if i % 3 == 1)
+
+    excluded = MetadataFilters(filters=[MetadataFilter(key="page_number", value=[0, 1], operator=FilterOperator.NIN)])
+    assert store.count(filters=excluded) == 4
+
+
+def test_rejects_mismatched_dimensions_and_unknown_dtypes(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "store"))
+    store.add(make_nodes(2, dim=8)[0])
+    with pytest.raises(ValueError, match="dimension"):
+        store.add(make_nodes(2, dim=16)[0])
+    with pytest.raises(ValueError, match="Unsupported vector dtype"):
+        NumpyVectorStore(str(tmp_path / "other"), dtype="float64")
+
+
+def test_queries_during_concurrent_writes_see_consistent_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(numpy_store, "SCORE_BLOCK_ROWS", 8)  # long scoring loops give writers a chance to interleave
+    nodes, vectors = make_nodes(400)
+    store = NumpyVectorStore(str(tmp_path))
+    store.add(nodes[:10])
+    errors = []
+
+    def write():
+        for start in range(10, 400, 5):
+            store.add(nodes[start:start + 5])
+
+    def read():
+        filters = MetadataFilters(filters=[MetadataFilter(key="page_number", value=1)])
+        try:
+            for _ in range(200):
+                result = store.query(VectorStoreQuery(query_embedding=vectors[1].tolist(), similarity_top_k=3, filters=filters))
+                assert result.ids[0] == "node-1"
+                assert all(int(node_id.split("-")[1]) % 3 == 1 for node_id in result.ids)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    assert not errors
+    assert store.count() == 400
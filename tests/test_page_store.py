@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+import page_store
+from cache import LRUCache
+from page_store import PageStore, open_page_store, page_store_path, write_page_store
+
+PAGES = [
+    {"page_number": 1, "text": "First page."},
+    {"page_number": 2, "text": "Zweite Seite – mit Umlauten äöü."},
+    {"page_number": 4, "text": ""},
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache(monkeypatch):
+    cache = LRUCache(maxsize=2, on_evict=PageStore.close)
+    monkeypatch.setattr(page_store, "_open_stores", cache)
+    return cache
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_binary_round_trip(tmp_path, compress):
+    path = str(tmp_path / "doc.pages")
+    write_page_store(iter(PAGES), path, compress=compress)
+
+    store = PageStore(path)
+    assert store.compressed == compress
+    assert len(store) == 3
+    assert list(store) == PAGES
+    assert store.page_numbers() == [1, 2, 4]
+    assert store.get_text(2) == PAGES[1]["text"]
+    assert store.get_text(3, default=None) is None
+    assert os.listdir(tmp_path) == ["doc.pages"]  # no temp files left behind
+    store.close()
+
+
+def test_json_pages_are_migrated_on_first_open(tmp_path):
+    json_path = tmp_path / "hash-a.json"
+    json_path.write_text(json.dumps(PAGES), encoding="utf-8")
+
+    store = open_page_store("hash-a", str(tmp_path))
+    assert list(store) == PAGES
+    assert not json_path.exists()
+    assert os.path.isfile(page_store_path("hash-a", str(tmp_path)))
+    assert open_page_store("hash-a", str(tmp_path)) is store
+
+    with pytest.raises(FileNotFoundError):
+        open_page_store("hash-b", str(tmp_path))
+
+
+def test_rewritten_store_is_reopened_and_the_old_one_closed(tmp_path):
+    path = page_store_path("hash-a", str(tmp_path))
+    write_page_store(PAGES, path)
+    old = open_page_store("hash-a", str(tmp_path))
+
+    write_page_store([{"page_number": 1, "text": "Re-ingested."}], path)
+    os.utime(path, (old.mtime + 10, old.mtime + 10))
+    new = open_page_store("hash-a", str(tmp_path))
+
+    assert new is not old
+    assert list(new) == [{"page_number": 1, "text": "Re-ingested."}]
+    assert open_page_store("hash-a", str(tmp_path)) is new
+    with pytest.raises(ValueError):
+        old.get_text(1)
+
+
+def test_evicted_stores_close_after_reads_in_progress(tmp_path):
+    for name in ("a", "b", "c"):
+        write_page_store(PAGES, page_store_path(name, str(tmp_path)))
+
+    first = open_page_store("a", str(tmp_path))
+    pages = iter(first)
+    assert next(pages) == PAGES[0]
+
+    open_page_store("b", str(tmp_path))
+    open_page_store("c", str(tmp_path))  # evicts "a" from the two-entry cache
+    assert not first._mmap.closed  # the iterator still reads from it
+    assert list(pages) == PAGES[1:]
+    assert first._mmap.closed
+    with pytest.raises(ValueError):
+        list(first)
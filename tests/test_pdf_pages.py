@@ -0,0 +1,57 @@
+import pytest
+
+import parse_document
+from parse_document import extract_pdf_pages
+
+
+def write_pdf(path, page_texts):
+    """Minimal PDF with one line of Helvetica text per page."""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % len(objects)
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(data))
+    return str(path)
+
+
+@pytest.fixture
+def counted_readers(monkeypatch):
+    opened = []
+    reader_class = parse_document.PdfReader
+
+    def counting_reader(*args, **kwargs):
+        opened.append(args[0])
+        return reader_class(*args, **kwargs)
+
+    monkeypatch.setattr(parse_document, "PdfReader", counting_reader)
+    return opened
+
+
+def test_small_pdfs_are_read_with_a_single_reader(tmp_path, counted_readers):
+    path = write_pdf(tmp_path / "small.pdf", ["First page", "  ", "Third   page"])
+
+    pages = extract_pdf_pages(path)
+    assert pages == [{"page_number": 1, "text": "First page"}, {"page_number": 3, "text": "Third page"}]
+    assert counted_readers == [path]
+
+
+def test_missing_pdf_raises(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        extract_pdf_pages(str(tmp_path / "missing.pdf"))
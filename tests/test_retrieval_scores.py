@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from retrieval import cosine_similarity_from_distance
+
+
+@pytest.fixture
+def unit_pair():
+    rng = np.random.default_rng(0)
+    a, b = rng.normal(size=(2, 16))
+    return a / np.linalg.norm(a), b / np.linalg.norm(b)
+
+
+def test_l2_distance_maps_to_cosine_similarity(unit_pair):
+    a, b = unit_pair
+    squared_l2 = float(np.sum((a - b) ** 2))
+    assert cosine_similarity_from_distance(squared_l2) == pytest.approx(float(a @ b))
+    assert cosine_similarity_from_distance(0.0) == 1.0
+    assert cosine_similarity_from_distance(4.0) == -1.0  # opposite vectors
+
+
+@pytest.mark.parametrize("space", ["ip", "cosine"])
+def test_inner_product_distances_map_to_cosine_similarity(unit_pair, space):
+    a, b = unit_pair
+    assert cosine_similarity_from_distance(1.0 - float(a @ b), space) == pytest.approx(float(a @ b))
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+import app
+import retrieval_strategies
+from jobs import JobQueue
+
+
+@pytest.fixture
+def strategy_queue(monkeypatch):
+    """A fresh job queue whose strategy builds block until released."""
+    release = threading.Event()
+    monkeypatch.setattr(app, "ingestion_queue", JobQueue(max_workers=4))
+    monkeypatch.setattr(app, "check_chroma_index", lambda document_hash: True)
+    monkeypatch.setattr(app, "build_strategy_worker", lambda *args, progress=None, **kwargs: release.wait(5))
+    yield app.ingestion_queue
+    release.set()
+
+
+def test_each_strategy_gets_its_own_build_job(strategy_queue):
+    body, status = app.queue_strategy_build("hash-a", "sentence_window")
+    assert status == 202 and body["strategy"] == "sentence_window"
+
+    other, other_status = app.queue_strategy_build("hash-a", "auto_merging")
+    assert other_status == 202
+    assert other["job_id"] != body["job_id"]
+
+    again, _ = app.queue_strategy_build("hash-a", "sentence_window")
+    assert again["job_id"] == body["job_id"]
+    assert "already being built" in again["message"]
+
+    # The document's own ingestion slot stays free, so an upload is not attached to a strategy job
+    assert strategy_queue.active_job("hash-a") is None
+
+
+def test_strategy_waits_for_a_running_ingestion(strategy_queue):
+    release = threading.Event()
+    ingestion, _ = strategy_queue.submit("hash-b", "b.pdf", lambda progress=None: release.wait(5))
+    body, status = app.queue_strategy_build("hash-b", "auto_merging")
+    release.set()
+    assert status == 202
+    assert body["job_id"] == ingestion.id
+    assert strategy_queue.active_job(app.strategy_job_key("hash-b", "auto_merging")) is None
+
+
+def test_unknown_document_is_not_found(strategy_queue, monkeypatch):
+    monkeypatch.setattr(app, "check_chroma_index", lambda document_hash: False)
+    assert app.queue_strategy_build("missing", "auto_merging")[1] == 404
+
+
+def test_build_locks_are_striped_per_document_and_strategy():
+    locks = {
+        retrieval_strategies._build_lock(f"hash-{i}", strategy)
+        for i in range(1000) for strategy in retrieval_strategies.STRATEGIES
+    }
+    assert len(locks) <= len(retrieval_strategies._build_locks)
+    assert retrieval_strategies._build_lock("hash-a", "auto_merging") is retrieval_strategies._build_lock("hash-a", "auto_merging")
@@ -0,0 +1,70 @@
+import hashlib
+import io
+import os
+
+import pytest
+from starlette.testclient import TestClient
+
+import app
+import asgi
+from jobs import JobQueue
+from utils import hash_file_chunked
+
+# Larger than the 8 KiB read size of hash_file_chunked and not a multiple of it
+CONTENT = b"<html><body>" + os.urandom(100_000) + b"</body></html>"
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    """Uploads go to tmp_path; queued ingestion jobs do nothing."""
+    folder = str(tmp_path)
+    monkeypatch.setattr(app, "UPLOAD_FOLDER", folder)
+    monkeypatch.setitem(app.app.config, "UPLOAD_FOLDER", folder)
+    monkeypatch.setattr(asgi, "UPLOAD_FOLDER", folder)
+    queue = JobQueue(max_workers=1)
+    monkeypatch.setattr(app, "ingestion_queue", queue)
+    monkeypatch.setattr(asgi, "ingestion_queue", queue)
+    for module in (app, asgi):
+        monkeypatch.setattr(module, "check_chroma_index", lambda document_hash: False)
+        monkeypatch.setattr(module, "upload_file_worker", lambda *args, progress=None, **kwargs: None)
+    return tmp_path
+
+
+def check_stored(upload_dir, document_hash):
+    stored = upload_dir / f"{document_hash}.html"
+    assert os.listdir(upload_dir) == [stored.name]  # no temp files left behind
+    assert stored.read_bytes() == CONTENT
+    assert document_hash == hash_file_chunked(str(stored)) == hashlib.md5(CONTENT).hexdigest()
+
+
+def test_flask_upload_hash_matches_the_stored_file(upload_dir):
+    response = app.app.test_client().post(
+        "/upload", data={"file": (io.BytesIO(CONTENT), "page.html")}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 202
+    check_stored(upload_dir, response.get_json()["hash"])
+
+
+def test_asgi_upload_hash_matches_the_stored_file(upload_dir):
+    response = TestClient(asgi.app).post("/upload", files={"file": ("page.html", CONTENT, "text/html")})
+    assert response.status_code == 202
+    check_stored(upload_dir, response.json()["hash"])
+
+
+def test_rejected_uploads_leave_no_temp_files(upload_dir):
+    response = app.app.test_client().post(
+        "/upload", data={"file": (io.BytesIO(CONTENT), "page.txt")}, content_type="multipart/form-data"
+    )
+    assert response.status_code == 400
+    response = TestClient(asgi.app).post("/upload", files={"file": ("page.txt", CONTENT, "text/plain")})
+    assert response.status_code == 400
+    assert os.listdir(upload_dir) == []
+
+
+def test_malformed_multipart_answers_400(upload_dir):
+    response = TestClient(asgi.app).post(
+        "/upload", content=b"not multipart", headers={"content-type": "multipart/form-data"}
+    )
+    assert response.status_code == 400
+    assert "boundary" in response.json()["error"].lower()
+    assert os.listdir(upload_dir) == []